@@ -1,18 +1,30 @@
 import asyncio
+import logging
 from contextlib import asynccontextmanager
 from typing import Any, Callable, Coroutine
 
 from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
+from fastapi.responses import ORJSONResponse, Response
 
-from api import db
-from api.v1 import alice
+from api.middleware import MetricsMiddleware
+from api.v1 import admin, alice, notes, telegram
+from config.settings import get_alice_settings, get_common_settings
+from handlers.bulk import BulkNotesImporter
+from handlers.export import NotesExporter
+from handlers.notes import NotesHandler
+from utils.asynctools import wait_until
+from utils.delivery import DeliveryQueue
+from utils.watchdog import LoopLagWatchdog
+import utils.metrics as metrics
+
+logger = logging.getLogger(__name__)
 
 
 class FastapiFactory:
-    def __init__(self, app_name: str, get_notes_service: Callable[[], Coroutine[Any, Any, None]],
-                 close_notes_service: Callable[[], Coroutine[Any, Any, None]],
-                 worker_service: Callable[[], Coroutine[Any, Any, None]]) -> None:
+    def __init__(self, app_name: str, get_notes_handler: Callable[[], Coroutine[Any, Any, NotesHandler]],
+                 close_notes_handler: Callable[[], Coroutine[Any, Any, None]],
+                 worker_service: Callable[[], Coroutine[Any, Any, None]] | None = None,
+                 stop_worker_service: Callable[[], None] | None = None) -> None:
         self.app = FastAPI(
             title=app_name,
             docs_url='/api/v1/openapi',
@@ -20,26 +32,72 @@ class FastapiFactory:
             default_response_class=ORJSONResponse,
             lifespan=self.lifespan
         )
-        self.get_notes_service = get_notes_service
-        self.close_notes_service = close_notes_service
+        self.get_notes_handler = get_notes_handler
+        self.close_notes_handler = close_notes_handler
         self.worker_service = worker_service
+        self.stop_worker_service = stop_worker_service
+        self.app.add_middleware(MetricsMiddleware)
         self.add_app_routes()
 
     @asynccontextmanager
     async def lifespan(self, app: FastAPI):
-        print("Starting FastAPI...")
-        notes_service = await self.get_notes_service()
-        db.notes_service = notes_service
-        loop = asyncio.get_event_loop()
-        loop.create_task(self.worker_service())
+        logger.info('Starting FastAPI...')
+        notes_handler = await self.get_notes_handler()
+        app.state.notes_handler = notes_handler
+        alice_settings = get_alice_settings()
+        notes_delivery_queue = DeliveryQueue(
+            lambda item: notes_handler.create_notes(*item),
+            alice_settings.delivery_workers,
+            alice_settings.delivery_queue_size,
+            alice_settings.delivery_deadline_seconds
+        )
+        await notes_delivery_queue.start()
+        app.state.notes_delivery_queue = notes_delivery_queue
+        metrics.DELIVERY_QUEUE_SIZE.set_collect_function(lambda: {(): notes_delivery_queue.size})
+        common_settings = get_common_settings()
+        app.state.notes_bulk_importer = BulkNotesImporter(
+            notes_handler,
+            common_settings.bulk_max_concurrent_per_app,
+            common_settings.bulk_rate_per_second,
+            common_settings.bulk_max_in_flight
+        )
+        app.state.notes_exporter = NotesExporter(notes_handler)
+        loop_watchdog = None
+        if common_settings.loop_watchdog:
+            loop_watchdog = LoopLagWatchdog(common_settings.loop_watchdog_threshold_seconds)
+            await loop_watchdog.start()
+        worker_task = None
+        if self.worker_service is not None:
+            loop = asyncio.get_event_loop()
+            worker_task = loop.create_task(self.worker_service())
         yield
-        print("Closing FastAPI...")
-        await self.close_notes_service(notes_service)
+        logger.info('Closing FastAPI...')
+        # worker and delivery queue drain in-flight work until grace period end, then sessions are closed
+        deadline = asyncio.get_running_loop().time() + common_settings.shutdown_grace_seconds
+        if worker_task is not None and self.stop_worker_service is not None:
+            self.stop_worker_service()
+        if not await wait_until(notes_delivery_queue.stop(), deadline):
+            logger.warning('Notes delivery is cancelled by shutdown deadline')
+        if worker_task is not None:
+            if not await wait_until(asyncio.gather(worker_task, return_exceptions=True), deadline):
+                logger.warning('Worker is cancelled by shutdown deadline')
+        await self.close_notes_handler()
+        if loop_watchdog is not None:
+            await loop_watchdog.stop()
 
     def add_app_routes(self) -> None:
         self.app.add_api_route('/', self.root_healthcheck)
+        self.app.add_api_route('/metrics', self.metrics, include_in_schema=False)
         self.app.include_router(alice.router, prefix='/api/v1/alice', tags=['alice'])
+        self.app.include_router(telegram.router, prefix='/api/v1/telegram', tags=['telegram'])
+        self.app.include_router(notes.router, prefix='/api/v1/notes', tags=['notes'])
+        self.app.include_router(admin.router, prefix='/api/v1/admin', tags=['admin'])
 
     @staticmethod
     async def root_healthcheck() -> None:
         return ORJSONResponse({'ok': True})
+
+    @staticmethod
+    def metrics() -> Response:
+        """Sync route, gauges collected from job queue file are read in threadpool"""
+        return Response(metrics.REGISTRY.render(), media_type=metrics.METRICS_CONTENT_TYPE)
@@ -0,0 +1,28 @@
+import hmac
+import logging
+
+from fastapi import Header, HTTPException, status
+
+from config.settings import get_common_settings
+
+logger = logging.getLogger(__name__)
+
+
+def check_api_token(authorization: str | None = Header(None)) -> None:
+    """Routes with this dependency are disabled until API_TOKEN is set"""
+    api_token = get_common_settings().api_token
+    if not api_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if not authorization or not hmac.compare_digest(authorization, f'Bearer {api_token}'):
+        logger.error('Wrong api token')
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+
+def check_admin_token(authorization: str | None = Header(None)) -> None:
+    """Diagnostics routes with this dependency are disabled until ADMIN_TOKEN is set"""
+    admin_token = get_common_settings().admin_token
+    if not admin_token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    if not authorization or not hmac.compare_digest(authorization, f'Bearer {admin_token}'):
+        logger.error('Wrong admin token')
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
@@ -1,10 +1,47 @@
-from functools import lru_cache
+import typing
 
-from handlers.notes import NotesServiceProtocol
+from fastapi import Request
 
-notes_service: NotesServiceProtocol | None = None
+from handlers.bulk import BulkNotesImporter
+from handlers.export import NotesExporter
+from handlers.notes import NotesHandler
+from utils.delivery import DeliveryQueue
+from utils.profiler import SamplingProfiler
 
+TelegramUpdateSink = typing.Callable[[dict], typing.Awaitable[None]]
+CleanupTrigger = typing.Callable[[list[str] | None], typing.Awaitable[dict]]
 
-@lru_cache
-def get_notes_service() -> NotesServiceProtocol:
-    return notes_service
+telegram_update_sink: TelegramUpdateSink | None = None
+cleanup_trigger: CleanupTrigger | None = None
+profiler = SamplingProfiler()
+
+
+def get_notes_handler(request: Request) -> NotesHandler:
+    """Services are set to app state by app lifespan, every app has its own"""
+    return request.app.state.notes_handler
+
+
+def get_telegram_update_sink() -> TelegramUpdateSink | None:
+    """Not cached, sink is set by worker after api start"""
+    return telegram_update_sink
+
+
+def get_cleanup_trigger() -> CleanupTrigger | None:
+    """Not cached, trigger is set by worker after api start"""
+    return cleanup_trigger
+
+
+def get_notes_delivery_queue(request: Request) -> DeliveryQueue:
+    return request.app.state.notes_delivery_queue
+
+
+def get_notes_bulk_importer(request: Request) -> BulkNotesImporter:
+    return request.app.state.notes_bulk_importer
+
+
+def get_notes_exporter(request: Request) -> NotesExporter:
+    return request.app.state.notes_exporter
+
+
+def get_profiler() -> SamplingProfiler:
+    return profiler
@@ -0,0 +1,37 @@
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import utils.metrics as metrics
+
+
+class MetricsMiddleware:
+    """Requests duration by route template and status. Pure ASGI, streaming responses are not buffered"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started_at = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # route is set to scope by router, unmatched paths are not labeled to keep cardinality low
+            route = scope.get('route')
+            metrics.HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started_at,
+                method=scope['method'],
+                route=getattr(route, 'path', 'unmatched'),
+                status=status_code
+            )
@@ -13,6 +13,12 @@ class AliceMessage(BaseModel):
             return None
         return self.session.get('user', {}).get('user_id')
 
+    @property
+    def message_id(self):
+        if not self.session:
+            return None
+        return f"{self.session.get('session_id')}:{self.session.get('message_id')}"
+
     @property
     def message(self):
         if not self.request:
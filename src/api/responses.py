@@ -0,0 +1,51 @@
+import asyncio
+import typing
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
+from starlette.types import Receive, Scope, Send
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response for generators which read request body while streaming.
+    Default response listens for disconnect from the start and consumes request body messages,
+    here body is read by generator through request_stream() and disconnect is listened after it"""
+
+    def __init__(self, content: typing.AsyncIterable[bytes], request: Request, **kwargs) -> None:
+        super().__init__(content, **kwargs)
+        self._request = request
+        self._body_read = asyncio.Event()
+
+    async def request_stream(self) -> typing.AsyncGenerator[bytes, None]:
+        """Disconnect is listened as soon as the last body chunk is received, even if it is not processed yet"""
+        while True:
+            message = await self._request.receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnect()
+            more_body = message.get('more_body', False)
+            if not more_body:
+                self._body_read.set()
+            if message.get('body'):
+                yield message['body']
+            if not more_body:
+                return
+
+    async def _listen_for_disconnect_after_body(self, receive: Receive) -> None:
+        await self._body_read.wait()
+        await self.listen_for_disconnect(receive)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Streaming is cancelled by disconnect"""
+        stream_task = asyncio.create_task(self.stream_response(send))
+        listen_task = asyncio.create_task(self._listen_for_disconnect_after_body(receive))
+        try:
+            await asyncio.wait((stream_task, listen_task), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (stream_task, listen_task):
+                task.cancel()
+            await asyncio.gather(stream_task, listen_task, return_exceptions=True)
+        if not stream_task.cancelled():
+            stream_task.result()
+        if self.background is not None:
+            await self.background()
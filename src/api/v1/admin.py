@@ -0,0 +1,28 @@
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from api.auth import check_admin_token
+from api.db import get_profiler
+from utils.profiler import ProfilerBusyError, SamplingProfiler
+
+
+logger = logging.getLogger(__name__)
+router = APIRouter(dependencies=[Depends(check_admin_token)])
+
+
+@router.get('/profile',
+            status_code=status.HTTP_200_OK,
+            summary="Sample stacks of all threads of api process, result is collapsed stacks for flamegraph.",
+            response_class=PlainTextResponse,
+            )
+async def get_profile(seconds: float = Query(10, gt=0, le=60),
+                      interval_ms: float = Query(5, ge=1, le=1000),
+                      profiler: SamplingProfiler = Depends(get_profiler)) -> PlainTextResponse:
+    logger.warning('Profiling for %s seconds...', seconds)
+    try:
+        collapsed_stacks = await profiler.profile(seconds, interval_ms / 1000)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return PlainTextResponse(collapsed_stacks, headers={'Content-Disposition': 'attachment; filename=profile.txt'})
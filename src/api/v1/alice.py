@@ -1,11 +1,14 @@
+import asyncio
 import logging
 
 from fastapi import APIRouter, Depends, status, Request
 import pydantic
 
 from api.models import AliceMessage
-from api.db import get_notes_service, NotesServiceProtocol
+from api.db import get_notes_delivery_queue
 from config.settings import get_alice_settings
+from utils.delivery import DeliveryQueue
+import utils.tracing as tracing
 
 
 logger = logging.getLogger(__name__)
@@ -17,7 +20,8 @@ router = APIRouter()
              summary="Insert message from Alice.",
              )
 async def get_alice_message(request: Request,
-                            notes_service: NotesServiceProtocol = Depends(get_notes_service)) -> dict:
+                            notes_delivery_queue: DeliveryQueue = Depends(get_notes_delivery_queue)) -> dict:
+    """Note is put to delivery queue and saved in background, so answer doesn't wait for notes apps"""
     try:
         req_data = AliceMessage(**await request.json())
     except pydantic.ValidationError as e:
@@ -33,7 +37,14 @@ async def get_alice_message(request: Request,
         return {'response': {'text': 'Ошибка сценария'}}
     if req_data.message:
         logger.info(f'Got message from alice: {req_data.message}')
-        await notes_service.create_note(req_data.message)
+        try:
+            # repeated Alice request of the same message gets the same note ids
+            message_id = f'alice:{req_data.message_id}'
+            with tracing.trace(message_id):
+                notes_delivery_queue.put((req_data.message, message_id))
+        except asyncio.QueueFull:
+            logger.error('Notes delivery queue is full')
+            return {'response': {'text': 'Ошибка сценария'}}
         response['response']['text'] = 'Заметка сохранена'
         response['response']['end_session'] = True
     else:
@@ -0,0 +1,79 @@
+import logging
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
+from fastapi.responses import StreamingResponse
+
+from api.auth import check_api_token
+from api.responses import DuplexStreamingResponse
+from api.db import get_notes_bulk_importer, get_notes_exporter, get_notes_handler, get_cleanup_trigger, CleanupTrigger
+from config.settings import get_common_settings
+from handlers.bulk import BulkNotesImporter
+from handlers.export import ExportFormat, NotesExporter
+from handlers.notes import NotesHandler
+from utils.text import iter_lines
+
+
+logger = logging.getLogger(__name__)
+router = APIRouter(dependencies=[Depends(check_api_token)])
+
+
+@router.post('/bulk',
+             status_code=status.HTTP_200_OK,
+             summary="Insert notes from NDJSON stream, results are streamed as NDJSON.",
+             )
+async def create_notes_bulk(request: Request,
+                            notes_bulk_importer: BulkNotesImporter = Depends(get_notes_bulk_importer)
+                            ) -> DuplexStreamingResponse:
+    async def _results():
+        lines = iter_lines(response.request_stream(), get_common_settings().bulk_max_line_size)
+        try:
+            async for result in notes_bulk_importer.import_notes(lines):
+                yield orjson.dumps(result) + b'\n'
+        except ValueError as e:
+            logger.error('Bulk import error: %s', e)
+            yield orjson.dumps({'ok': False, 'error': str(e)}) + b'\n'
+    response = DuplexStreamingResponse(_results(), request, media_type='application/x-ndjson')
+    return response
+
+
+@router.get('/export',
+            status_code=status.HTTP_200_OK,
+            summary="Export notes from all notes apps as NDJSON or CSV stream.",
+            )
+async def export_notes(export_format: str = Query(ExportFormat.NDJSON, alias='format',
+                                                  pattern=f'^({ExportFormat.NDJSON}|{ExportFormat.CSV})$'),
+                       cursor: list[str] = Query([], description='Cursor to continue export, backend:cursor'),
+                       backend: list[str] = Query([], description='Backends to export, all by default'),
+                       notes_exporter: NotesExporter = Depends(get_notes_exporter)) -> StreamingResponse:
+    try:
+        cursors = notes_exporter.parse_cursors(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    media_type = 'text/csv' if export_format == ExportFormat.CSV else 'application/x-ndjson'
+    return StreamingResponse(
+        notes_exporter.export_notes_formatted(export_format, cursors, backend), media_type=media_type)
+
+
+@router.get('/search',
+            status_code=status.HTTP_200_OK,
+            summary="Search notes of all notes apps in local index.",
+            )
+async def search_notes(query: str = Query(..., alias='q', min_length=1),
+                       limit: int = Query(20, ge=1, le=100),
+                       backend: list[str] = Query([], description='Backends to search, all by default'),
+                       notes_handler: NotesHandler = Depends(get_notes_handler)) -> dict:
+    if not notes_handler.has_notes_index:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {'notes': await notes_handler.search_notes(query, limit, backend or None)}
+
+
+@router.post('/cleanup',
+             status_code=status.HTTP_200_OK,
+             summary="Run done notes cleanup now.",
+             )
+async def trigger_cleanup(backend: list[str] = Query([], description='Backends to clean up, all by default'),
+                          cleanup_trigger: CleanupTrigger | None = Depends(get_cleanup_trigger)) -> dict:
+    if cleanup_trigger is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return await cleanup_trigger(backend or None)
@@ -0,0 +1,38 @@
+import hmac
+import logging
+
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Request
+
+from api.db import get_telegram_update_sink, TelegramUpdateSink
+from config.settings import get_settings
+
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def check_secret_token(x_telegram_bot_api_secret_token: str | None = Header(None)) -> None:
+    """Webhook route exists only in WEBHOOK update mode, updates without secret token are rejected"""
+    transmit_from = get_settings().transmit_from
+    if not transmit_from.is_webhook_mode:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    secret_token = transmit_from.webhook_secret_token
+    if not secret_token or not x_telegram_bot_api_secret_token or \
+            not hmac.compare_digest(x_telegram_bot_api_secret_token, secret_token):
+        logger.error('Wrong telegram webhook secret token')
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+
+
+@router.post('/webhook/',
+             status_code=status.HTTP_200_OK,
+             summary="Receive update from Telegram.",
+             dependencies=[Depends(check_secret_token)],
+             )
+async def get_telegram_update(request: Request,
+                              telegram_update_sink: TelegramUpdateSink | None = Depends(get_telegram_update_sink)
+                              ) -> dict:
+    """Update is put to telegram application queue or to job queue of bot worker process"""
+    if telegram_update_sink is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    await telegram_update_sink(await request.json())
+    return {'ok': True}
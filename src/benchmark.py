@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+import orjson
+
+from benchmarks import LoadConfig, MessageKind, PipelineLoadTest
+from config.settings import NoteAppType
+from fakes import FaultConfig, LatencyDistribution
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Load test of message pipeline: telegram updates and alice messages to fake notes apps.')
+    parser.add_argument('--rate', type=float, default=20, help='Messages per second')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32, help='Max messages handled at once')
+    parser.add_argument('--text-weight', type=float, default=0.6)
+    parser.add_argument('--voice-weight', type=float, default=0.2)
+    parser.add_argument('--alice-weight', type=float, default=0.2)
+    parser.add_argument('--note-app', action='append', default=[], choices=NoteAppType.list(),
+                        help='Notes apps to create notes in, all by default')
+    parser.add_argument('--recognize-ms', type=float, default=500, help='Simulated voice recognition time')
+    parser.add_argument('--seed-rows', type=int, default=0, help='Synthetic notes in every fake notes app')
+    parser.add_argument('--latency-ms', type=float, default=50, help='Fake notes apps latency (median)')
+    parser.add_argument('--latency-distribution', default=LatencyDistribution.LOGNORMAL,
+                        choices=[LatencyDistribution.FIXED, LatencyDistribution.UNIFORM,
+                                 LatencyDistribution.LOGNORMAL])
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of notes apps requests with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of notes apps requests with 503')
+    parser.add_argument('--lost-answer-rate', type=float, default=0.0,
+                        help='Share of notes apps requests applied but answered with 504')
+    parser.add_argument('--api-port', type=int, default=8899)
+    parser.add_argument('--fake-port', type=int, default=8900)
+    parser.add_argument('--random-seed', type=int, default=None)
+    parser.add_argument('--output', default='-', help='Result JSON file, stdout by default')
+    return parser.parse_args()
+
+
+async def run_benchmark(args: argparse.Namespace) -> None:
+    config = LoadConfig(
+        rate_per_second=args.rate,
+        messages=args.messages,
+        concurrency=args.concurrency,
+        weights={MessageKind.TEXT: args.text_weight, MessageKind.VOICE: args.voice_weight,
+                 MessageKind.ALICE: args.alice_weight},
+        note_apps=args.note_app or NoteAppType.list(),
+        faults=FaultConfig(args.latency_ms, args.latency_distribution,
+                           throttle_rate=args.throttle_rate, error_rate=args.error_rate,
+                           lost_answer_rate=args.lost_answer_rate),
+        seed_rows=args.seed_rows,
+        recognize_seconds=args.recognize_ms / 1000,
+        api_port=args.api_port,
+        fake_port=args.fake_port,
+        random_seed=args.random_seed
+    )
+    result = await PipelineLoadTest(config).run()
+    content = orjson.dumps(result, option=orjson.OPT_INDENT_2)
+    if args.output == '-':
+        sys.stdout.buffer.write(content + b'\n')
+    else:
+        with open(args.output, 'wb') as f:
+            f.write(content)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level='WARNING')
+    asyncio.run(run_benchmark(parse_args()))
@@ -0,0 +1,7 @@
+from .pipeline import LoadConfig, MessageKind, PipelineLoadTest
+
+__all__ = [
+    'LoadConfig',
+    'MessageKind',
+    'PipelineLoadTest'
+]
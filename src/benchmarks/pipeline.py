@@ -0,0 +1,360 @@
+import asyncio
+import logging
+import random
+import resource
+import tempfile
+import threading
+import time
+import typing
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import aiohttp
+import orjson
+import uvicorn
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+from telegram.request import BaseRequest, RequestData
+
+from api.app import FastapiFactory
+from config.settings import (
+    AppSettings, NoteAppType, NotionNoteApp, TeamlyNoteApp, TelegramBotApp, TelegramUpdateLimits, YonoteNoteApp,
+    get_alice_settings, get_common_settings
+)
+from container import NotesContainer
+from fakes import (
+    FakeNotesApps, FaultConfig, start_fake_notes_apps,
+    FAKE_STATUS_FIELD_ID, FAKE_STATUS_FIELD_VALUE, FAKE_DONE_FIELD_ID
+)
+import repositories.telegram as telegram_repositories
+import services.telegram as telegram_services
+import utils.tracing as tracing
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+logger = logging.getLogger(__name__)
+
+
+class MessageKind:
+    TEXT = 'text'
+    VOICE = 'voice'
+    ALICE = 'alice'
+
+
+@dataclass
+class LoadConfig:
+    rate_per_second: float = 20
+    messages: int = 200
+    concurrency: int = 32
+    weights: dict[str, float] = field(
+        default_factory=lambda: {MessageKind.TEXT: 0.6, MessageKind.VOICE: 0.2, MessageKind.ALICE: 0.2})
+    note_apps: list[str] = field(default_factory=lambda: NoteAppType.list())
+    faults: FaultConfig = field(default_factory=FaultConfig)
+    seed_rows: int = 0
+    recognize_seconds: float = 0.5
+    api_port: int = 8899
+    fake_port: int = 8900
+    random_seed: int | None = None
+
+
+def get_quantiles(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    quantiles = {f'p{int(q * 100)}': values[min(int(q * len(values)), len(values) - 1)] for q in QUANTILES}
+    return {**quantiles, 'max': values[-1]}
+
+
+class CollectingSpanExporter(tracing.SpanExporterProtocol):
+    """Spans durations by stage name"""
+
+    def __init__(self) -> None:
+        self.durations: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def export(self, span: tracing.Span) -> None:
+        self.durations[span.name] += [span.duration_seconds]
+        if span.error:
+            self.errors[span.name] += 1
+
+    def close(self) -> None:
+        pass
+
+    def get_stats(self) -> dict:
+        return {name: {'count': len(durations), 'errors': self.errors[name], **get_quantiles(durations)}
+                for name, durations in sorted(self.durations.items())}
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Bot api answered locally, voice files are downloaded as fixture content"""
+    _message_id = 0
+
+    def __init__(self, voice_content: bytes) -> None:
+        self._voice_content = voice_content
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _get_message(self, parameters: dict) -> dict:
+        self._message_id += 1
+        return {
+            'message_id': self._message_id,
+            'date': int(time.time()),
+            'chat': {'id': parameters.get('chat_id', 0), 'type': 'private'},
+            'text': parameters.get('text', ''),
+        }
+
+    async def do_request(self, url: str, method: str, request_data: RequestData | None = None,
+                         *args, **kwargs) -> tuple[int, bytes]:
+        if '/file/bot' in url:
+            return 200, self._voice_content
+        parameters = request_data.parameters if request_data else {}
+        endpoint = url.rsplit('/', 1)[-1]
+        if endpoint == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Load', 'username': 'load_bot'}
+        elif endpoint in ('sendMessage', 'editMessageText'):
+            result = self._get_message(parameters)
+        elif endpoint == 'getFile':
+            result = {'file_id': parameters['file_id'], 'file_unique_id': parameters['file_id'],
+                      'file_size': len(self._voice_content), 'file_path': f'voice/{parameters["file_id"]}.ogg'}
+        else:
+            result = True
+        return 200, orjson.dumps({'ok': True, 'result': result})
+
+
+class FixtureRecognizer:
+    """Stand-in for whisper, recognition time is simulated"""
+
+    def __init__(self, recognize_seconds: float) -> None:
+        self._recognize_seconds = recognize_seconds
+
+    def recognize(self, voice_path: str) -> str | None:
+        time.sleep(self._recognize_seconds)
+        return f'voice note {voice_path}'
+
+    async def async_recognize(self, voice_path: str) -> str | None:
+        with tracing.span('recognizer.fixture'):
+            await asyncio.sleep(self._recognize_seconds)
+        return f'voice note {voice_path}'
+
+
+class FakeNotesAppsThread:
+    """Fake notes apps in own thread and event loop, so they don't share event loop with measured pipeline"""
+    _loop: asyncio.AbstractEventLoop | None = None
+
+    def __init__(self, fake_notes_apps: FakeNotesApps, port: int) -> None:
+        self._fake_notes_apps = fake_notes_apps
+        self._port = port
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='fake-notes-apps', daemon=True)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        runner = self._loop.run_until_complete(
+            start_fake_notes_apps(self._fake_notes_apps, '127.0.0.1', self._port))
+        self._started.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(runner.cleanup())
+        self._loop.close()
+
+    def start(self) -> None:
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+class PipelineLoadTest:
+    """Synthetic telegram updates are handled by TelegramClient handlers with priority update processor,
+    Alice messages are posted to api. Notes are created by real notes apps clients in fake notes apps"""
+
+    def __init__(self, config: LoadConfig) -> None:
+        self._config = config
+        self._random = random.Random(config.random_seed)
+        self._latencies: dict[str, list[float]] = defaultdict(list)
+        self._errors: dict[str, int] = defaultdict(int)
+        self._failed_updates: set[int] = set()
+        self._spans = CollectingSpanExporter()
+        self._fake_notes_apps = FakeNotesApps(config.faults)
+        self._fake_notes_apps.seed(config.seed_rows)
+
+    def _get_settings(self, tmp_dir: str) -> AppSettings:
+        fake_url = f'http://127.0.0.1:{self._config.fake_port}'
+        fields = {
+            'database_id': 'load-database',
+            'status_field_id': FAKE_STATUS_FIELD_ID,
+            'status_field_value': FAKE_STATUS_FIELD_VALUE,
+            'done_field_id': FAKE_DONE_FIELD_ID,
+        }
+        note_apps = {
+            NoteAppType.NOTION.value: lambda: NotionNoteApp(app=NoteAppType.NOTION, token='load', **fields),
+            NoteAppType.YONOTE.value: lambda: YonoteNoteApp(
+                app=NoteAppType.YONOTE, token='load', collection_id='load', **fields),
+            NoteAppType.TEAMLY.value: lambda: TeamlyNoteApp(
+                app=NoteAppType.TEAMLY, integration_id='load', integration_url='load', client_secret='load',
+                client_auth_code='load', **fields),
+        }
+        common_settings = get_common_settings().model_copy(update={
+            'tmp_dir': tmp_dir, 'notion_api_url': fake_url, 'yonote_api_url': fake_url, 'teamly_api_url': fake_url})
+        # yaml config is not read, settings are built for fake notes apps
+        return AppSettings.model_construct(
+            common=common_settings,
+            alice=get_alice_settings(),
+            transmit_from=TelegramBotApp(token='load', allowed_users=[]),
+            transmit_to=[note_apps[x]() for x in self._config.note_apps]
+        )
+
+    def _get_update(self, telegram_app: Application, kind: str, number: int) -> Update:
+        user_id = number % 10 + 1
+        message = {
+            'message_id': number,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load'},
+        }
+        if kind == MessageKind.VOICE:
+            message['voice'] = {'file_id': f'load_voice_{number}', 'file_unique_id': f'load_voice_{number}',
+                                'duration': 3}
+        else:
+            message['text'] = f'load note {number}'
+        return Update.de_json({'update_id': number, 'message': message}, telegram_app.bot)
+
+    async def _count_update_error(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if isinstance(update, Update):
+            self._failed_updates.add(update.update_id)
+
+    async def _send_update(self, telegram_app: Application,
+                           update_processor: telegram_repositories.PriorityUpdateProcessor,
+                           kind: str, number: int) -> bool:
+        update = self._get_update(telegram_app, kind, number)
+        await update_processor.process_update(update, telegram_app.process_update(update))
+        return number not in self._failed_updates
+
+    async def _send_alice_message(self, http_session: aiohttp.ClientSession, number: int) -> bool:
+        message = {
+            'session': {'user': {'user_id': get_alice_settings().user_id}, 'session_id': 'load', 'message_id': number},
+            'request': {'original_utterance': f'load alice note {number}'},
+            'version': '1.0',
+        }
+        async with http_session.post('/api/v1/alice/message/', json=message) as response:
+            answer = await response.json()
+        return response.status == 201 and answer['response'].get('end_session', False)
+
+    async def _run_message(self, send: typing.Callable[[str, int], typing.Awaitable[bool]], kind: str, number: int,
+                           scheduled_at: float, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                ok = await send(kind, number)
+            except Exception as e:
+                logger.debug('Load message error: %s', e)
+                ok = False
+        # latency from scheduled time, waiting for concurrency slot is counted
+        self._latencies[kind] += [time.monotonic() - scheduled_at]
+        if not ok:
+            self._errors[kind] += 1
+
+    async def _run_load(self, send: typing.Callable[[str, int], typing.Awaitable[bool]]) -> float:
+        """Open loop load: messages are started at configured rate, latency is measured from planned start"""
+        kinds, weights = zip(*self._config.weights.items())
+        semaphore = asyncio.Semaphore(self._config.concurrency)
+        started_at = time.monotonic()
+        tasks = []
+        for number in range(1, self._config.messages + 1):
+            scheduled_at = started_at + (number - 1) / self._config.rate_per_second
+            await asyncio.sleep(max(scheduled_at - time.monotonic(), 0))
+            kind = self._random.choices(kinds, weights)[0]
+            tasks += [asyncio.create_task(self._run_message(send, kind, number, scheduled_at, semaphore))]
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started_at
+
+    async def _serve_api(self, notes_container: NotesContainer) -> tuple[uvicorn.Server, asyncio.Task]:
+        api_app = FastapiFactory('Load test', notes_container.start, notes_container.close).app
+        server = uvicorn.Server(uvicorn.Config(
+            api_app, host='127.0.0.1', port=self._config.api_port, log_level='warning', lifespan='on'))
+        # signals are handled by caller
+        server.install_signal_handlers = lambda: None
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            if server_task.done():
+                await server_task
+                raise RuntimeError('Error: Load test api is not started.')
+            await asyncio.sleep(0.05)
+        return server, server_task
+
+    def _get_result(self, duration_seconds: float) -> dict:
+        messages = {}
+        for kind, latencies in sorted(self._latencies.items()):
+            messages[kind] = {
+                'count': len(latencies),
+                'errors': self._errors[kind],
+                'error_rate': self._errors[kind] / len(latencies),
+                'throughput_per_second': len(latencies) / duration_seconds,
+                'latency_seconds': get_quantiles(latencies),
+            }
+        total = sum(len(x) for x in self._latencies.values())
+        return {
+            'config': {
+                'rate_per_second': self._config.rate_per_second,
+                'messages': self._config.messages,
+                'concurrency': self._config.concurrency,
+                'weights': self._config.weights,
+                'note_apps': self._config.note_apps,
+                'faults': self._config.faults.__dict__,
+                'seed_rows': self._config.seed_rows,
+                'recognize_seconds': self._config.recognize_seconds,
+            },
+            'duration_seconds': duration_seconds,
+            'throughput_per_second': total / duration_seconds,
+            'error_rate': sum(self._errors.values()) / total if total else 0,
+            'messages': messages,
+            'stages': self._spans.get_stats(),
+            # ru_maxrss is in kilobytes on linux, process includes fake notes apps thread
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'fake_notes_apps': self._fake_notes_apps.get_stats(),
+        }
+
+    async def run(self) -> dict:
+        fake_notes_apps_thread = FakeNotesAppsThread(self._fake_notes_apps, self._config.fake_port)
+        fake_notes_apps_thread.start()
+        tracing.configure_tracing(self._spans)
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                return await self._run(tmp_dir)
+        finally:
+            tracing.close_tracing()
+            fake_notes_apps_thread.stop()
+
+    async def _run(self, tmp_dir: str) -> dict:
+        notes_container = NotesContainer(self._get_settings(tmp_dir))
+        notes_handler = await notes_container.start()
+        telegram_app = Application.builder().token('1:load').updater(None) \
+            .request(FakeTelegramRequest(b'OggS' + bytes(4096))) \
+            .get_updates_request(FakeTelegramRequest(b'')).build()
+        telegram_app.add_error_handler(self._count_update_error)
+        update_processor = telegram_repositories.create_update_processor(TelegramUpdateLimits())
+        await telegram_app.initialize()
+        side_effects = telegram_repositories.TelegramSideEffects(telegram_app)
+        await side_effects.start()
+        telegram_client = telegram_repositories.TelegramClient(
+            telegram_app, FixtureRecognizer(self._config.recognize_seconds), side_effects, tmp_dir, [])
+        await notes_handler.transmit_messages(telegram_services.TelegramService(telegram_client))
+        server, server_task = await self._serve_api(notes_container)
+        try:
+            async with aiohttp.ClientSession(f'http://127.0.0.1:{self._config.api_port}') as http_session:
+                async def _send(kind: str, number: int) -> bool:
+                    if kind == MessageKind.ALICE:
+                        return await self._send_alice_message(http_session, number)
+                    return await self._send_update(telegram_app, update_processor, kind, number)
+                duration_seconds = await self._run_load(_send)
+        finally:
+            # api lifespan delivers queued alice notes and closes notes container
+            server.should_exit = True
+            await server_task
+            await side_effects.stop()
+            await telegram_app.shutdown()
+        return self._get_result(duration_seconds)
@@ -3,7 +3,7 @@ import shutil
 from enum import Enum
 from functools import lru_cache
 
-from pydantic import BaseModel, Field, field_validator
+from pydantic import BaseModel, Field, field_validator, model_validator
 from pydantic_settings import (
     BaseSettings,
     YamlConfigSettingsSource,
@@ -15,6 +15,11 @@ from pydantic_settings import (
 CWD = os.getcwd()
 CONFIG_FILE_NAME = 'config.yaml'
 CONFIG_FILE_EXAMPLE_NAME = 'config.example.yaml'
+JOB_QUEUE_FILE_NAME = 'jobs.sqlite3'
+LEADER_ELECTION_FILE_NAME = 'leader.sqlite3'
+TRACES_FILE_NAME = 'traces.jsonl'
+SEARCH_INDEX_FILE_NAME = 'search.sqlite3'
+TENANTS_DIR_NAME = 'tenants'
 
 
 class EnumWithList(Enum):
@@ -29,20 +34,78 @@ class NoteAppType(EnumWithList):
     YONOTE = 'YONOTE'
 
 
+class AppRole(EnumWithList):
+    ALL = 'ALL'
+    API = 'API'
+    BOT = 'BOT'
+    RECOGNIZER = 'RECOGNIZER'
+
+
+class RecognizerMode(EnumWithList):
+    LOCAL = 'LOCAL'
+    QUEUE = 'QUEUE'
+
+
+class TracingExporter(EnumWithList):
+    JSONL = 'JSONL'
+    OTEL = 'OTEL'
+
+
 class BotAppType(EnumWithList):
     TELEGRAM = 'TELEGRAM'
 
 
+class TelegramUpdateMode(EnumWithList):
+    POLLING = 'POLLING'
+    WEBHOOK = 'WEBHOOK'
+
+
 class BotApp(BaseModel):
     app: BotAppType
 
 
+class UpdateClassLimit(BaseModel):
+    max_concurrent: int
+    priority: int
+
+
+class TelegramUpdateLimits(BaseModel):
+    """Concurrent updates budgets, lower priority value is handled first"""
+    max_concurrent_updates: int = 8
+    max_pending_updates: int = 1000
+    command: UpdateClassLimit = UpdateClassLimit(max_concurrent=4, priority=0)
+    text: UpdateClassLimit = UpdateClassLimit(max_concurrent=4, priority=1)
+    voice: UpdateClassLimit = UpdateClassLimit(max_concurrent=2, priority=2)
+    other: UpdateClassLimit = UpdateClassLimit(max_concurrent=2, priority=3)
+
+
 class TelegramBotApp(BotApp):
     """Telegram integration settings, more info:
     https://core.telegram.org/bots/api#authorizing-your-bot"""
     app: BotAppType = BotAppType.TELEGRAM.value
     token: str
     allowed_users: list[str]
+    update_mode: TelegramUpdateMode = TelegramUpdateMode.POLLING.value
+    webhook_url: str | None = None
+    webhook_secret_token: str | None = None
+    update_limits: TelegramUpdateLimits = TelegramUpdateLimits()
+    notes_reply_ttl_seconds: int = 10
+    notes_pagination: bool = False
+    # not allowed users get one rejection reply per interval
+    rejection_reply_interval_seconds: int = 3600
+
+    @model_validator(mode='after')
+    def check_webhook_url(self) -> 'TelegramBotApp':
+        if self.is_webhook_mode and not self.webhook_url:
+            raise ValueError('Error: webhook_url is required for WEBHOOK update mode.')
+        # webhook route is public, forged updates are rejected by secret token
+        if self.is_webhook_mode and not self.webhook_secret_token:
+            raise ValueError('Error: webhook_secret_token is required for WEBHOOK update mode.')
+        return self
+
+    @property
+    def is_webhook_mode(self) -> bool:
+        return self.update_mode == TelegramUpdateMode.WEBHOOK
 
 
 class NoteApp(BaseModel):
@@ -53,6 +116,8 @@ class NoteApp(BaseModel):
     done_field_id: str
     start_words: list[str] = []
     delete_done_notes: bool = False
+    delete_done_notes_min_interval_seconds: int = 300
+    delete_done_notes_max_interval_seconds: int = 3600
 
 
 class NotionNoteApp(NoteApp):
@@ -70,6 +135,7 @@ class TeamlyNoteApp(NoteApp):
     integration_url: str
     client_secret: str
     client_auth_code: str
+    token_refresh_skew_seconds: int = 60
 
 
 class YonoteNoteApp(NoteApp):
@@ -80,6 +146,23 @@ class YonoteNoteApp(NoteApp):
     collection_id: str
 
 
+class Tenant(BaseModel):
+    """Team with own notes apps, messages of its telegram users are saved only there"""
+    name: str = Field(pattern=r'^[\w-]+$')
+    users: list[str]
+    transmit_to: list[NotionNoteApp | TeamlyNoteApp | YonoteNoteApp]
+
+    @field_validator('transmit_to', mode='after')
+    @classmethod
+    def check_delete_done_notes(
+            cls, transmit_to: list[NotionNoteApp | TeamlyNoteApp | YonoteNoteApp]
+    ) -> list[NotionNoteApp | TeamlyNoteApp | YonoteNoteApp]:
+        # cleanup jobs are run for transmit_to notes apps only
+        if any(x.delete_done_notes for x in transmit_to):
+            raise ValueError('Error: delete_done_notes is not supported for tenant notes apps.')
+        return transmit_to
+
+
 class CommonSettings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file='.env.local', env_file_encoding='utf-8', extra='ignore')
@@ -87,9 +170,47 @@ class CommonSettings(BaseSettings):
     log_level: str = Field('INFO', alias='LOG_LEVEL')
     tmp_dir: str = Field('tmp', alias='TMP_DIR')
 
+    app_role: AppRole = Field(AppRole.ALL, alias='APP_ROLE')
+    api_workers: int = Field(1, alias='API_WORKERS')
+    recognizer_mode: RecognizerMode = Field(RecognizerMode.LOCAL, alias='RECOGNIZER_MODE')
+    recognizer_timeout_seconds: float = Field(300, alias='RECOGNIZER_TIMEOUT_SECONDS')
+    job_queue_retention_seconds: float = Field(86400, alias='JOB_QUEUE_RETENTION_SECONDS')
+    leader_election: bool = Field(True, alias='LEADER_ELECTION')
+    leader_lease_seconds: float = Field(60, alias='LEADER_LEASE_SECONDS')
+    scheduler_jitter_ratio: float = Field(0.1, alias='SCHEDULER_JITTER_RATIO')
+    shutdown_grace_seconds: float = Field(30, alias='SHUTDOWN_GRACE_SECONDS')
+    tracing_exporter: TracingExporter | None = Field(None, alias='TRACING_EXPORTER')
+    loop_watchdog: bool = Field(False, alias='LOOP_WATCHDOG')
+    loop_watchdog_threshold_seconds: float = Field(0.25, alias='LOOP_WATCHDOG_THRESHOLD_SECONDS')
+
     api_host: str = Field('0.0.0.0', alias='API_HOST')
     api_port: str = Field('8888', alias='API_PORT')
     api_name: str = Field('Notes bot', alias='API_NAME')
+    api_token: str | None = Field(None, alias='API_TOKEN')
+    admin_token: str | None = Field(None, alias='ADMIN_TOKEN')
+
+    # notes apps api urls override, e.g. for fake notes apps
+    notion_api_url: str | None = Field(None, alias='NOTION_API_URL')
+    yonote_api_url: str | None = Field(None, alias='YONOTE_API_URL')
+    teamly_api_url: str | None = Field(None, alias='TEAMLY_API_URL')
+    metrics_port: int | None = Field(None, alias='METRICS_PORT')
+
+    duplicates_window_seconds: float = Field(60, alias='DUPLICATES_WINDOW_SECONDS')
+    duplicates_similarity: float = Field(0.85, alias='DUPLICATES_SIMILARITY')
+    duplicates_index_size: int = Field(256, alias='DUPLICATES_INDEX_SIZE')
+
+    search_index: bool = Field(True, alias='SEARCH_INDEX')
+    search_sync_interval_seconds: int = Field(3600, alias='SEARCH_SYNC_INTERVAL_SECONDS')
+
+    tenant_idle_seconds: float = Field(900, alias='TENANT_IDLE_SECONDS')
+    tenant_max_active: int = Field(100, alias='TENANT_MAX_ACTIVE')
+
+    config_watch_interval_seconds: float = Field(5, alias='CONFIG_WATCH_INTERVAL_SECONDS')
+
+    bulk_max_concurrent_per_app: int = Field(4, alias='BULK_MAX_CONCURRENT_PER_APP')
+    bulk_rate_per_second: float = Field(3.0, alias='BULK_RATE_PER_SECOND')
+    bulk_max_in_flight: int = Field(32, alias='BULK_MAX_IN_FLIGHT')
+    bulk_max_line_size: int = Field(1024 * 1024, alias='BULK_MAX_LINE_SIZE')
 
     @field_validator('tmp_dir', mode='after')
     @classmethod
@@ -104,6 +225,22 @@ class CommonSettings(BaseSettings):
     def config_path(self) -> str:
         return os.path.join(self.tmp_dir, CONFIG_FILE_NAME)
 
+    @property
+    def job_queue_path(self) -> str:
+        return os.path.join(self.tmp_dir, JOB_QUEUE_FILE_NAME)
+
+    @property
+    def leader_election_path(self) -> str:
+        return os.path.join(self.tmp_dir, LEADER_ELECTION_FILE_NAME)
+
+    @property
+    def traces_path(self) -> str:
+        return os.path.join(self.tmp_dir, TRACES_FILE_NAME)
+
+    def get_tenant_dir(self, tenant_name: str) -> str:
+        """Tenant files (search index, tokens)"""
+        return os.path.join(self.tmp_dir, TENANTS_DIR_NAME, tenant_name)
+
 
 @lru_cache
 def get_common_settings() -> CommonSettings:
@@ -118,6 +255,9 @@ class AliceSettings(BaseSettings):
         env_file='.env.local', env_file_encoding='utf-8', extra='ignore')
 
     user_id: str = Field(None, alias='ALICE_USER_ID')
+    delivery_workers: int = Field(2, alias='ALICE_DELIVERY_WORKERS')
+    delivery_queue_size: int = Field(1000, alias='ALICE_DELIVERY_QUEUE_SIZE')
+    delivery_deadline_seconds: float = Field(300, alias='ALICE_DELIVERY_DEADLINE_SECONDS')
 
 
 @lru_cache
@@ -133,6 +273,17 @@ class AppSettings(BaseSettings):
     transmit_from: TelegramBotApp = Field(alias='transmit_from')
     transmit_to: list[
         NotionNoteApp | TeamlyNoteApp | YonoteNoteApp] = Field(alias='transmit_to')
+    tenants: list[Tenant] = []
+
+    @model_validator(mode='after')
+    def check_tenants(self) -> 'AppSettings':
+        names = [x.name for x in self.tenants]
+        if len(names) != len(set(names)):
+            raise ValueError('Error: Tenant names must be unique.')
+        users = [user for x in self.tenants for user in x.users]
+        if len(users) != len(set(users)):
+            raise ValueError('Error: User can be in one tenant only.')
+        return self
 
     @classmethod
     def settings_customise_sources(
@@ -143,10 +294,27 @@ class AppSettings(BaseSettings):
         config_path = get_common_settings().config_path
         return (YamlConfigSettingsSource(settings_cls, yaml_file=config_path, yaml_file_encoding='utf-8'),)
 
+    def get_allowed_users(self) -> list[str]:
+        """Users of tenants are allowed too, empty list allows all users"""
+        if not self.transmit_from.allowed_users:
+            return []
+        return self.transmit_from.allowed_users + [user for x in self.tenants for user in x.users]
+
     def get_first_notion_client_config(self) -> NotionNoteApp | None:
         return next((x for x in self.transmit_to if x.app == NoteAppType.NOTION), None)
 
 
-@lru_cache
+_settings: AppSettings | None = None
+
+
 def get_settings() -> AppSettings:
-    return AppSettings()
+    """Settings are read once, config reload replaces them by set_settings"""
+    global _settings
+    if _settings is None:
+        _settings = AppSettings()
+    return _settings
+
+
+def set_settings(settings: AppSettings) -> None:
+    global _settings
+    _settings = settings
@@ -0,0 +1,79 @@
+import asyncio
+import hashlib
+import logging
+import os
+import typing
+
+import utils.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+T = typing.TypeVar('T')
+
+
+class ConfigWatcher(typing.Generic[T]):
+    """Config file is polled for changes, changed config is loaded (and validated) by load function and
+    applied by apply function. Invalid config is logged once, current config stays in use until next change"""
+    _watch_task: asyncio.Task | None = None
+
+    def __init__(self, path: str, load: typing.Callable[[], T], apply: typing.Callable[[T], typing.Awaitable[None]],
+                 interval_seconds: float = 5) -> None:
+        self._path = path
+        self._load = load
+        self._apply = apply
+        self._interval_seconds = interval_seconds
+        # config is read before watcher creation, its version is current
+        self._stat = self._get_stat()
+        self._digest = self._get_digest()
+
+    def _get_stat(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _get_digest(self) -> bytes | None:
+        try:
+            with open(self._path, 'rb') as f:
+                return hashlib.blake2b(f.read(), digest_size=16).digest()
+        except OSError:
+            return None
+
+    async def check(self) -> bool:
+        """True if changed config was applied. File is read only if its modification time or size changed"""
+        stat = self._get_stat()
+        if stat is None or stat == self._stat:
+            return False
+        self._stat = stat
+        digest = self._get_digest()
+        if digest is None or digest == self._digest:
+            return False
+        self._digest = digest
+        try:
+            config = self._load()
+            await self._apply(config)
+        except Exception as e:
+            logger.error('Config %s is not applied, current config is kept: %s', self._path, e)
+            metrics.CONFIG_RELOADS.inc(result='error')
+            return False
+        logger.warning('Config %s is reloaded', self._path)
+        metrics.CONFIG_RELOADS.inc(result='applied')
+        return True
+
+    async def _run_watch(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval_seconds)
+            await self.check()
+
+    async def start(self) -> None:
+        """Idempotent, zero interval disables watching"""
+        if self._watch_task is None and self._interval_seconds > 0:
+            self._watch_task = asyncio.create_task(self._run_watch())
+
+    async def stop(self) -> None:
+        if self._watch_task is None:
+            return
+        self._watch_task.cancel()
+        await asyncio.gather(self._watch_task, return_exceptions=True)
+        self._watch_task = None
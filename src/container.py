@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import os
+from contextlib import AsyncExitStack
+
+from config.settings import AppSettings, NoteApp, NoteAppType, Tenant, SEARCH_INDEX_FILE_NAME
+import handlers.notes as notes_handlers
+import handlers.filter as filter_handlers
+import handlers.tenants as tenants_handlers
+import repositories.teamly as teamly_repositories
+import repositories.yonote as yonote_repositories
+import repositories.notion as notion_repositories
+import services.teamly as teamly_services
+import services.yonote as yonote_services
+import services.notion as notion_services
+import utils.http as http_utils
+from utils.search import SqliteNotesIndex
+
+logger = logging.getLogger(__name__)
+
+
+class NotesContainer:
+    """Notes resources shared by bot worker and api: one pooled session per notes app, default notes handler
+    and registry of tenant notes handlers, which share the sessions"""
+    _notes_handler: notes_handlers.NotesHandler | None = None
+    _tenant_registry: tenants_handlers.TenantRegistry | None = None
+
+    def __init__(self, settings: AppSettings) -> None:
+        self._settings = settings
+        self._exit_stack = AsyncExitStack()
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def notes_handler(self) -> notes_handlers.NotesHandler:
+        if self._notes_handler is None:
+            raise RuntimeError('Error: Notes container is not started.')
+        return self._notes_handler
+
+    @property
+    def tenant_registry(self) -> tenants_handlers.TenantRegistry:
+        if self._tenant_registry is None:
+            raise RuntimeError('Error: Notes container is not started.')
+        return self._tenant_registry
+
+    @property
+    def active_tenants_count(self) -> int:
+        return self._tenant_registry.active_count if self._tenant_registry is not None else 0
+
+    async def _open_sessions(self) -> None:
+        common_settings = self._settings.common
+        self._teamly_session = await self._exit_stack.enter_async_context(http_utils.aiohttp_session_context(
+            common_settings.teamly_api_url or teamly_repositories.TEAMLY_API_URL))
+        self._yonote_session = await self._exit_stack.enter_async_context(http_utils.aiohttp_session_context(
+            common_settings.yonote_api_url or yonote_repositories.YONOTE_API_URL))
+        self._notion_session = await self._exit_stack.enter_async_context(http_utils.aiohttp_session_context(
+            common_settings.notion_api_url or notion_repositories.NOTION_API_URL))
+
+    async def _build_notes_handler(self, note_client_configs: list[NoteApp], tmp_dir: str,
+                                   exit_stack: AsyncExitStack) -> notes_handlers.NotesHandler:
+        """Notes handler resources are closed by exit stack, sessions are not"""
+        common_settings = self._settings.common
+        teamly_session, yonote_session, notion_session = \
+            self._teamly_session, self._yonote_session, self._notion_session
+        notes_handler = notes_handlers.NotesHandler(filter_handlers.NotesFilter).with_duplicates_window(
+            common_settings.duplicates_window_seconds,
+            common_settings.duplicates_similarity,
+            common_settings.duplicates_index_size
+        )
+        if common_settings.search_index:
+            notes_index = SqliteNotesIndex(os.path.join(tmp_dir, SEARCH_INDEX_FILE_NAME))
+            exit_stack.callback(notes_index.close)
+            notes_handler = notes_handler.with_notes_index(notes_index)
+
+        for note_client_config in note_client_configs:
+            if note_client_config.app == NoteAppType.TEAMLY:
+                teamly_auth = teamly_repositories.TeamlyAuthClient(
+                    teamly_session,
+                    tmp_dir,
+                    note_client_config.integration_id,
+                    note_client_config.integration_url,
+                    note_client_config.client_secret,
+                    note_client_config.client_auth_code,
+                    note_client_config.token_refresh_skew_seconds
+                )
+                await teamly_auth.start()
+                exit_stack.push_async_callback(teamly_auth.stop)
+                teamly_client = teamly_repositories.TeamlyClient(
+                    teamly_session,
+                    teamly_auth,
+                    note_client_config.database_id,
+                    note_client_config.status_field_id,
+                    note_client_config.status_field_value,
+                    note_client_config.done_field_id
+                )
+                notes_service = teamly_services.TeamlyService(teamly_client)
+            elif note_client_config.app == NoteAppType.NOTION:
+                notion_client = notion_repositories.NotionClient(
+                    notion_session,
+                    note_client_config.token,
+                    note_client_config.database_id,
+                    note_client_config.status_field_id,
+                    note_client_config.status_field_value,
+                    note_client_config.done_field_id
+                )
+                notes_service = notion_services.NotionService(notion_client)
+            elif note_client_config.app == NoteAppType.YONOTE:
+                yonote_client = yonote_repositories.YonoteClient(
+                    yonote_session,
+                    note_client_config.token,
+                    note_client_config.database_id,
+                    note_client_config.collection_id,
+                    note_client_config.status_field_id,
+                    note_client_config.status_field_value,
+                    note_client_config.done_field_id
+                )
+                notes_service = yonote_services.YonoteService(yonote_client)
+            else:
+                raise ValueError(f'Error: Unknown note app {note_client_config.app}')
+            notes_handler = notes_handler.with_notes_service(
+                notes_service,
+                note_client_config.delete_done_notes,
+                note_client_config.start_words,
+                (note_client_config.delete_done_notes_min_interval_seconds,
+                 note_client_config.delete_done_notes_max_interval_seconds)
+            )
+        return notes_handler
+
+    async def _build_tenant_notes_handler(
+            self, tenant: Tenant) -> tuple[notes_handlers.NotesHandler, AsyncExitStack]:
+        tenant_dir = self._settings.common.get_tenant_dir(tenant.name)
+        os.makedirs(tenant_dir, exist_ok=True)
+        exit_stack = AsyncExitStack()
+        try:
+            notes_handler = await self._build_notes_handler(tenant.transmit_to, tenant_dir, exit_stack)
+        except BaseException:
+            await exit_stack.aclose()
+            raise
+        return notes_handler, exit_stack
+
+    async def _close_services(self) -> None:
+        await self._services_exit_stack.aclose()
+
+    async def start(self) -> notes_handlers.NotesHandler:
+        """Idempotent, the container is started by the first of api and worker"""
+        async with self._start_lock:
+            if self._notes_handler is None:
+                await self._open_sessions()
+                # notes services resources are replaced by config reload, so they have own exit stack
+                self._services_exit_stack = AsyncExitStack()
+                self._exit_stack.push_async_callback(self._close_services)
+                self._notes_handler = await self._build_notes_handler(
+                    self._settings.transmit_to, self._settings.common.tmp_dir, self._services_exit_stack)
+                self._tenant_registry = tenants_handlers.TenantRegistry(
+                    self._notes_handler,
+                    self._settings.tenants,
+                    self._build_tenant_notes_handler,
+                    self._settings.common.tenant_idle_seconds,
+                    self._settings.common.tenant_max_active
+                )
+                await self._tenant_registry.start()
+                self._exit_stack.push_async_callback(self._tenant_registry.close)
+        return self._notes_handler
+
+    async def reload(self, settings: AppSettings) -> None:
+        """Notes services, routing and credentials of reloaded config replace current ones at once. Sessions,
+        search index and recent notes of notes handler and active tenants with unchanged config are kept"""
+        async with self._start_lock:
+            if self._notes_handler is None:
+                self._settings = settings
+                return
+            exit_stack = AsyncExitStack()
+            try:
+                notes_handler = await self._build_notes_handler(
+                    settings.transmit_to, settings.common.tmp_dir, exit_stack)
+            except BaseException:
+                await exit_stack.aclose()
+                raise
+            self._settings = settings
+            self._notes_handler.replace_notes_services(notes_handler)
+            exit_stack, self._services_exit_stack = self._services_exit_stack, exit_stack
+            await self._tenant_registry.set_tenants(settings.tenants)
+            # in-flight requests of replaced services keep their clients, only token refresh is stopped
+            await exit_stack.aclose()
+        logger.info('Notes container is reloaded: %s', list(self._notes_handler.get_notes_services()))
+
+    async def close(self) -> None:
+        async with self._start_lock:
+            await self._exit_stack.aclose()
+            self._notes_handler = None
+            self._tenant_registry = None
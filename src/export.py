@@ -0,0 +1,44 @@
+import argparse
+import asyncio
+import logging
+import sys
+
+from config.settings import get_settings
+from config.logging import configure_logging
+from container import NotesContainer
+from handlers.export import ExportFormat, NotesExporter
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Export notes from all configured notes apps.')
+    parser.add_argument('--format', dest='export_format', default=ExportFormat.NDJSON,
+                        choices=[ExportFormat.NDJSON, ExportFormat.CSV])
+    parser.add_argument('--output', default='-', help='Output file, stdout by default')
+    parser.add_argument('--cursor', action='append', default=[],
+                        help='Cursor to continue export, backend:cursor (next_cursor of the last page_end row '
+                             'or cursor of the last row)')
+    parser.add_argument('--backend', action='append', default=[], help='Backends to export, all by default')
+    return parser.parse_args()
+
+
+async def export_notes(args: argparse.Namespace) -> None:
+    settings = get_settings()
+    notes_container = NotesContainer(settings)
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    try:
+        notes_exporter = NotesExporter(await notes_container.start())
+        async for chunk in notes_exporter.export_notes_formatted(
+                args.export_format, notes_exporter.parse_cursors(args.cursor), args.backend):
+            output.write(chunk)
+    finally:
+        output.flush()
+        if output is not sys.stdout.buffer:
+            output.close()
+        await notes_container.close()
+
+
+if __name__ == '__main__':
+    configure_logging(get_settings())
+    asyncio.run(export_notes(parse_args()))
@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+import logging
+
+from fakes import FakeNotesApps, FaultConfig, LatencyDistribution, start_fake_notes_apps
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description='Fake Notion, Yonote and Teamly apis, point NOTION_API_URL, YONOTE_API_URL and TEAMLY_API_URL '
+                    'to it. Configured status and done field ids must be "status" and "done".')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--rows', type=int, default=0, help='Synthetic notes in every notes app')
+    parser.add_argument('--done-ratio', type=float, default=0.1, help='Share of done synthetic notes')
+    parser.add_argument('--latency-ms', type=float, default=0, help='Latency of every request (median)')
+    parser.add_argument('--latency-distribution', default=LatencyDistribution.FIXED,
+                        choices=[LatencyDistribution.FIXED, LatencyDistribution.UNIFORM,
+                                 LatencyDistribution.LOGNORMAL])
+    parser.add_argument('--latency-spread', type=float, default=0.5,
+                        help='Uniform: share of latency, lognormal: sigma of log latency')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of requests answered with 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503')
+    parser.add_argument('--lost-answer-rate', type=float, default=0.0,
+                        help='Share of requests applied but answered with 504')
+    return parser.parse_args()
+
+
+async def run_fake_notes_apps(args: argparse.Namespace) -> None:
+    fake_notes_apps = FakeNotesApps(FaultConfig(
+        args.latency_ms, args.latency_distribution, args.latency_spread, args.throttle_rate, args.error_rate,
+        lost_answer_rate=args.lost_answer_rate))
+    fake_notes_apps.seed(args.rows, args.done_ratio)
+    runner = await start_fake_notes_apps(fake_notes_apps, args.host, args.port)
+    logger.warning('Fake notes apps are served on http://%s:%s', args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level='INFO')
+    try:
+        asyncio.run(run_fake_notes_apps(parse_args()))
+    except KeyboardInterrupt:
+        pass
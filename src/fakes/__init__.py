@@ -0,0 +1,14 @@
+from .notes_apps import (
+    FakeNotesApps, FaultConfig, LatencyDistribution, start_fake_notes_apps,
+    FAKE_STATUS_FIELD_ID, FAKE_STATUS_FIELD_VALUE, FAKE_DONE_FIELD_ID
+)
+
+__all__ = [
+    'FakeNotesApps',
+    'FaultConfig',
+    'LatencyDistribution',
+    'start_fake_notes_apps',
+    'FAKE_STATUS_FIELD_ID',
+    'FAKE_STATUS_FIELD_VALUE',
+    'FAKE_DONE_FIELD_ID'
+]
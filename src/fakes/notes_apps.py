@@ -0,0 +1,279 @@
+import asyncio
+import logging
+import random
+import time
+import typing
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+
+from aiohttp import web
+
+FAKE_STATUS_FIELD_ID = 'status'
+FAKE_STATUS_FIELD_VALUE = 'new'
+FAKE_DONE_FIELD_ID = 'done'
+FAKE_TEAMLY_DATABASE_ID = uuid.UUID(int=0)
+NOTION_DEFAULT_PAGE_SIZE = 100
+YONOTE_DEFAULT_PAGE_LIMIT = 25
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyDistribution:
+    FIXED = 'fixed'
+    UNIFORM = 'uniform'
+    LOGNORMAL = 'lognormal'
+
+
+@dataclass
+class FaultConfig:
+    """Latency of every request and share of requests answered with 429 or 5xx.
+    Lost answer requests are applied but answered with 5xx, like timeout after server accepted write"""
+    latency_ms: float = 0
+    latency_distribution: str = LatencyDistribution.FIXED
+    # uniform: latency_ms +- spread, lognormal: sigma of log latency
+    latency_spread: float = 0.5
+    throttle_rate: float = 0.0
+    error_rate: float = 0.0
+    retry_after_seconds: int = 1
+    lost_answer_rate: float = 0.0
+
+    def sample_latency_seconds(self) -> float:
+        if self.latency_ms <= 0:
+            return 0
+        if self.latency_distribution == LatencyDistribution.UNIFORM:
+            spread = self.latency_ms * self.latency_spread
+            return max(random.uniform(self.latency_ms - spread, self.latency_ms + spread), 0) / 1000
+        if self.latency_distribution == LatencyDistribution.LOGNORMAL:
+            # latency_ms is median
+            return random.lognormvariate(0, self.latency_spread) * self.latency_ms / 1000
+        return self.latency_ms / 1000
+
+
+@dataclass
+class FakeNote:
+    id: uuid.UUID
+    title: str
+    status: str = FAKE_STATUS_FIELD_VALUE
+    done: bool = False
+    created_at: float = field(default_factory=time.time)
+
+
+class FakeNotesApps:
+    """Stand-in for Notion, Yonote and Teamly apis used by repositories, notes are kept in memory.
+    All apps are served by one aiohttp app, so *_API_URL settings can point to the same address"""
+
+    def __init__(self, faults: FaultConfig | None = None, token_ttl_seconds: int = 3600) -> None:
+        self.faults = faults or FaultConfig()
+        self._token_ttl_seconds = token_ttl_seconds
+        self._notes: dict[str, dict[uuid.UUID, FakeNote]] = {'notion': {}, 'yonote': {}, 'teamly': {}}
+        self.requests: Counter[tuple[str, int]] = Counter()
+
+    def seed(self, rows: int, done_ratio: float = 0.1, apps: typing.Iterable[str] | None = None) -> None:
+        """Large synthetic databases"""
+        for app in apps or self._notes:
+            for i in range(rows):
+                note = FakeNote(uuid.uuid4(), f'{app} note {i}', done=random.random() < done_ratio)
+                self._notes[app][note.id] = note
+
+    def get_notes(self, app: str) -> list[FakeNote]:
+        return list(self._notes[app].values())
+
+    def get_stats(self) -> dict:
+        return {
+            'notes': {app: len(notes) for app, notes in self._notes.items()},
+            # notes with repeated titles, created by retried writes
+            'duplicates': {app: len(notes) - len({x.title for x in notes.values()})
+                           for app, notes in self._notes.items()},
+            'requests': [{'route': route, 'status': status, 'count': count}
+                         for (route, status), count in sorted(self.requests.items())],
+        }
+
+    @web.middleware
+    async def _faults_middleware(self, request: web.Request, handler: typing.Callable) -> web.StreamResponse:
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else request.path
+        if route.startswith('/_fake'):
+            return await handler(request)
+        await asyncio.sleep(self.faults.sample_latency_seconds())
+        fault = random.random()
+        if fault < self.faults.throttle_rate:
+            response = web.json_response(
+                {'ok': False, 'error': 'rate_limited'}, status=429,
+                headers={'Retry-After': str(self.faults.retry_after_seconds)})
+        elif fault < self.faults.throttle_rate + self.faults.error_rate:
+            response = web.json_response({'ok': False, 'error': 'unavailable'}, status=503)
+        elif fault < self.faults.throttle_rate + self.faults.error_rate + self.faults.lost_answer_rate:
+            await handler(request)
+            response = web.json_response({'ok': False, 'error': 'timeout'}, status=504)
+        else:
+            response = await handler(request)
+        self.requests[(route, response.status)] += 1
+        return response
+
+    # Notion
+
+    @staticmethod
+    def _to_notion_page(note: FakeNote) -> dict:
+        return {
+            'object': 'page',
+            'id': str(note.id),
+            'archived': False,
+            'properties': {
+                'Name': {'title': [{'plain_text': note.title}]},
+                'Status': {'status': {'id': note.status}},
+                'Done': {'checkbox': note.done},
+            }
+        }
+
+    async def _notion_create_page(self, request: web.Request) -> web.Response:
+        message = await request.json()
+        properties = message.get('properties', {})
+        title = properties.get('Name', {}).get('title', [{}])[0].get('text', {}).get('content', '')
+        note = FakeNote(uuid.uuid4(), title, properties.get('Status', {}).get('status', {}).get('id'))
+        self._notes['notion'][note.id] = note
+        return web.json_response(self._to_notion_page(note))
+
+    async def _notion_update_page(self, request: web.Request) -> web.Response:
+        note = self._notes['notion'].get(uuid.UUID(request.match_info['page_id']))
+        if note is None:
+            return web.json_response({'object': 'error', 'status': 404, 'code': 'object_not_found'}, status=404)
+        if (await request.json()).get('archived'):
+            del self._notes['notion'][note.id]
+        return web.json_response(self._to_notion_page(note))
+
+    @classmethod
+    def _filter_notion_notes(cls, notes: list[FakeNote], notion_filter: dict) -> list[FakeNote]:
+        """Checkbox and title filters, timestamp filters are ignored"""
+        for x in notion_filter.get('and', []):
+            notes = cls._filter_notion_notes(notes, x)
+        if 'checkbox' in notion_filter:
+            notes = [x for x in notes if x.done == notion_filter['checkbox'].get('equals')]
+        if 'title' in notion_filter:
+            notes = [x for x in notes if x.title == notion_filter['title'].get('equals')]
+        return notes
+
+    async def _notion_query_database(self, request: web.Request) -> web.Response:
+        message = await request.json()
+        notes = self._filter_notion_notes(self.get_notes('notion'), message.get('filter', {}))
+        offset = int(message.get('start_cursor') or 0)
+        page_size = min(message.get('page_size', NOTION_DEFAULT_PAGE_SIZE), NOTION_DEFAULT_PAGE_SIZE)
+        has_more = offset + page_size < len(notes)
+        return web.json_response({
+            'object': 'list',
+            'results': [self._to_notion_page(x) for x in notes[offset:offset + page_size]],
+            'request_id': str(uuid.uuid4()),
+            'type': 'page_or_database',
+            'has_more': has_more,
+            'next_cursor': str(offset + page_size) if has_more else None,
+        })
+
+    # Yonote
+
+    @staticmethod
+    def _to_yonote_row(note: FakeNote) -> dict:
+        return {
+            'id': str(note.id),
+            'title': note.title,
+            'properties': {
+                FAKE_STATUS_FIELD_ID: [note.status],
+                FAKE_DONE_FIELD_ID: '1' if note.done else '0',
+            }
+        }
+
+    async def _yonote_create_document(self, request: web.Request) -> web.Response:
+        message = await request.json()
+        status = message.get('properties', {}).get(FAKE_STATUS_FIELD_ID) or [FAKE_STATUS_FIELD_VALUE]
+        note = FakeNote(uuid.UUID(message['id']) if message.get('id') else uuid.uuid4(),
+                        message.get('title', ''), status[0])
+        self._notes['yonote'][note.id] = note
+        return web.json_response({'data': self._to_yonote_row(note), 'status': 200, 'ok': True})
+
+    async def _yonote_delete_document(self, request: web.Request) -> web.Response:
+        message = await request.json()
+        if self._notes['yonote'].pop(uuid.UUID(message['id']), None) is None:
+            return web.json_response({'ok': False, 'status': 404, 'error': 'not_found'}, status=404)
+        return web.json_response({'success': True, 'status': 200, 'ok': True})
+
+    async def _yonote_get_document(self, request: web.Request) -> web.Response:
+        note = self._notes['yonote'].get(uuid.UUID((await request.json())['id']))
+        if note is None:
+            return web.json_response({'ok': False, 'status': 404, 'error': 'not_found'}, status=404)
+        return web.json_response({'data': self._to_yonote_row(note), 'status': 200, 'ok': True})
+
+    async def _yonote_list_rows(self, request: web.Request) -> web.Response:
+        notes = self.get_notes('yonote')
+        offset = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', YONOTE_DEFAULT_PAGE_LIMIT))
+        return web.json_response({
+            'pagination': {'offset': offset, 'limit': limit},
+            'data': [self._to_yonote_row(x) for x in notes[offset:offset + limit]],
+            'propsPolicies': [],
+            'policies': [],
+            'count': len(notes),
+            'status': 200,
+            'ok': True,
+        })
+
+    # Teamly
+
+    async def _teamly_auth(self, request: web.Request) -> web.Response:
+        now = int(time.time())
+        return web.json_response({
+            'access_token': uuid.uuid4().hex,
+            'refresh_token': uuid.uuid4().hex,
+            'access_token_expires_at': now + self._token_ttl_seconds,
+            'refresh_token_expires_at': now + self._token_ttl_seconds * 24,
+            'accounts': [{'slug': 'fake'}],
+        })
+
+    async def _teamly_execute_command(self, request: web.Request) -> web.Response:
+        if not request.headers.get('Authorization'):
+            return web.json_response({'error': 'unauthorized'}, status=401)
+        entity = (await request.json()).get('payload', {}).get('entity', {})
+        properties = {x.get('code'): x.get('value') for x in entity.get('properties', [])}
+        note = FakeNote(uuid.UUID(entity['id']) if entity.get('id') else uuid.uuid4(),
+                        (properties.get('title') or {}).get('text', ''),
+                        properties.get(FAKE_STATUS_FIELD_ID, FAKE_STATUS_FIELD_VALUE))
+        self._notes['teamly'][note.id] = note
+        return web.json_response({'id': str(note.id)})
+
+    async def _teamly_query_content(self, request: web.Request) -> web.Response:
+        if not request.headers.get('Authorization'):
+            return web.json_response({'error': 'unauthorized'}, status=401)
+        return web.json_response({
+            'id': str(FAKE_TEAMLY_DATABASE_ID),
+            'title': 'Fake database',
+            'content': [{'article': {'id': str(x.id), 'properties': {'properties': {
+                'title': {'text': x.title},
+                FAKE_STATUS_FIELD_ID: x.status,
+                FAKE_DONE_FIELD_ID: x.done,
+            }}}} for x in self.get_notes('teamly')],
+        })
+
+    async def _get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.get_stats())
+
+    def create_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._faults_middleware])
+        app.router.add_post('/v1/pages', self._notion_create_page)
+        app.router.add_patch('/v1/pages/{page_id}', self._notion_update_page)
+        app.router.add_post('/v1/databases/{database_id}/query', self._notion_query_database)
+        app.router.add_post('/api/documents.create', self._yonote_create_document)
+        app.router.add_post('/api/documents.delete', self._yonote_delete_document)
+        app.router.add_post('/api/documents.info', self._yonote_get_document)
+        app.router.add_post('/api/database.rows.list', self._yonote_list_rows)
+        app.router.add_post('/api/v1/auth/integration/authorize', self._teamly_auth)
+        app.router.add_post('/api/v1/auth/integration/refresh', self._teamly_auth)
+        app.router.add_post('/api/v1/wiki/properties/command/execute', self._teamly_execute_command)
+        app.router.add_post('/api/v1/ql/content-database/content', self._teamly_query_content)
+        app.router.add_get('/_fake/stats', self._get_stats)
+        return app
+
+
+async def start_fake_notes_apps(fake_notes_apps: FakeNotesApps, host: str = '127.0.0.1',
+                                port: int = 8900) -> web.AppRunner:
+    """Serve fake notes apps in running event loop, stop it with runner.cleanup()"""
+    runner = web.AppRunner(fake_notes_apps.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
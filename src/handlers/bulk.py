@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import typing
+from contextlib import asynccontextmanager
+
+import orjson
+
+import handlers.notes as notes_handlers
+from utils.limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+class BulkNotesImporter:
+    """Notes import from NDJSON lines, every line is {"text": "...", "id": "..."} or json string.
+    Notes are created by notes handler like messages, optional id makes repeated import of line idempotent.
+    Lines are read only when there is free in-flight slot, so memory doesn't depend on import size.
+    Writes are limited per notes service by concurrency and rate, limits are shared by all imports"""
+
+    def __init__(self, notes_handler: notes_handlers.NotesHandler, max_concurrent_per_service: int = 4,
+                 rate_per_second: float = 3.0, max_in_flight: int = 32) -> None:
+        self._notes_handler = notes_handler
+        self._max_concurrent_per_service = max_concurrent_per_service
+        self._rate_per_second = rate_per_second
+        self._max_in_flight = max_in_flight
+        self._limits: dict[str, tuple[asyncio.Semaphore, RateLimiter]] = {}
+
+    def _get_limits(self, name: str) -> tuple[asyncio.Semaphore, RateLimiter]:
+        if name not in self._limits:
+            self._limits[name] = (
+                asyncio.Semaphore(self._max_concurrent_per_service),
+                RateLimiter(self._rate_per_second, self._max_concurrent_per_service)
+            )
+        return self._limits[name]
+
+    @asynccontextmanager
+    async def _limit_service(self, name: str) -> typing.AsyncGenerator[None, None]:
+        semaphore, rate_limiter = self._get_limits(name)
+        async with semaphore, rate_limiter:
+            yield
+
+    @staticmethod
+    def _parse_line(line: bytes) -> tuple[str, str | None]:
+        """Text and id of line"""
+        data = orjson.loads(line)
+        text = data.get('text') if isinstance(data, dict) else data
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError('Error: Note text must be not empty string.')
+        line_id = data.get('id') if isinstance(data, dict) else None
+        if line_id is not None and not isinstance(line_id, (str, int)):
+            raise ValueError('Error: Note id must be string or number.')
+        return text, str(line_id) if line_id is not None else None
+
+    async def _import_line(self, line_number: int, line: bytes) -> dict:
+        try:
+            text, line_id = self._parse_line(line)
+        except (orjson.JSONDecodeError, ValueError) as e:
+            return {'line': line_number, 'ok': False, 'error': str(e)}
+        errors = await self._notes_handler.create_service_notes(
+            text, f'bulk:{line_id}' if line_id else None, self._limit_service)
+        if errors is None:
+            return {'line': line_number, 'ok': True, 'services': [], 'duplicate': True}
+        result = {
+            'line': line_number,
+            'ok': not any(errors.values()),
+            'services': list(errors),
+        }
+        if any(errors.values()):
+            for name, error in errors.items():
+                if error is not None:
+                    logger.error('Bulk create note error (%s): %s', name, error)
+            result['errors'] = {name: str(error) or error.__class__.__name__
+                                for name, error in errors.items() if error is not None}
+        return result
+
+    async def import_notes(self, lines: typing.AsyncIterable[bytes]) -> typing.AsyncGenerator[dict, None]:
+        """Yield result for every not empty line in order of completion"""
+        pending: set[asyncio.Task] = set()
+        try:
+            line_number = 0
+            async for line in lines:
+                line_number += 1
+                if not line.strip():
+                    continue
+                if len(pending) >= self._max_in_flight:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.create_task(self._import_line(line_number, line)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
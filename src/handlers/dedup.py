@@ -0,0 +1,82 @@
+import hashlib
+import re
+import time
+from collections import deque
+from dataclasses import dataclass
+
+SHINGLE_SIZE = 3
+
+_NOT_WORD_RE = re.compile(r'[\W_]+')
+
+
+def normalize_text(text: str) -> str:
+    """Case and punctuation differ in typed and recognized versions of the same note"""
+    return ' '.join(_NOT_WORD_RE.sub(' ', text.lower()).split())
+
+
+def get_shingles(normalized_text: str) -> frozenset[str]:
+    if len(normalized_text) <= SHINGLE_SIZE:
+        return frozenset([normalized_text])
+    return frozenset(normalized_text[i:i + SHINGLE_SIZE] for i in range(len(normalized_text) - SHINGLE_SIZE + 1))
+
+
+def get_jaccard_similarity(first: frozenset[str], second: frozenset[str]) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+@dataclass
+class _RecentNote:
+    message_id: str | None
+    added_at: float
+    digest: bytes
+    shingles: frozenset[str]
+
+
+class RecentNotesIndex:
+    """Notes of recent window with normalized text hash and character shingles. Exact duplicates are found by hash,
+    near duplicates by shingles Jaccard similarity. Index is bounded by window and size, so scan is cheap"""
+
+    def __init__(self, window_seconds: float = 60, similarity: float = 0.85, max_size: int = 256) -> None:
+        self._window_seconds = window_seconds
+        self._similarity = similarity
+        self._max_size = max_size
+        self._notes: deque[_RecentNote] = deque()
+
+    def __len__(self) -> int:
+        return len(self._notes)
+
+    def _evict(self, now: float) -> None:
+        while self._notes and (len(self._notes) > self._max_size or
+                               now - self._notes[0].added_at > self._window_seconds):
+            self._notes.popleft()
+
+    @staticmethod
+    def _get_digest(normalized_text: str) -> bytes:
+        return hashlib.blake2b(normalized_text.encode(), digest_size=16).digest()
+
+    def check_and_add(self, text: str, message_id: str | None = None) -> bool:
+        """True if text duplicates note of window, otherwise text is added to index"""
+        now = time.monotonic()
+        self._evict(now)
+        normalized_text = normalize_text(text)
+        digest = self._get_digest(normalized_text)
+        shingles = None
+        for note in self._notes:
+            # repeated delivery of the same message is not duplicate, it is deduplicated by note ids
+            if message_id is not None and note.message_id == message_id:
+                return False
+            if note.digest == digest:
+                return True
+            shingles = shingles or get_shingles(normalized_text)
+            if get_jaccard_similarity(note.shingles, shingles) >= self._similarity:
+                return True
+        self._notes.append(_RecentNote(message_id, now, digest, shingles or get_shingles(normalized_text)))
+        self._evict(now)
+        return False
+
+    def discard(self, text: str, message_id: str | None = None) -> None:
+        """Note is removed from index if it was not created, so its resend is not dropped as duplicate"""
+        digest = self._get_digest(normalize_text(text))
+        self._notes = deque(x for x in self._notes if x.digest != digest or x.message_id != message_id)
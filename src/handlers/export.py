@@ -0,0 +1,111 @@
+import asyncio
+import csv
+import io
+import logging
+import typing
+
+import orjson
+
+import handlers.notes as notes_handlers
+
+EXPORT_FIELDS = ['id', 'backend', 'title', 'status', 'done', 'cursor', 'next_cursor', 'page_end', 'error']
+
+logger = logging.getLogger(__name__)
+
+
+class ExportFormat:
+    NDJSON = 'ndjson'
+    CSV = 'csv'
+
+
+class NotesExporter:
+    """Export of notes from all notes services, services are paged concurrently into bounded queue,
+    so memory doesn't depend on notes count.
+    Every row has cursor of its page, the last row of page has page_end and cursor of the next page (row without
+    notes for empty page). Export of service is continued from next_cursor of its last page_end row, empty
+    next_cursor means service is exported. If export is interrupted inside page, it is continued from cursor
+    of the last row, so the page is exported again. Error row has cursor of failed page"""
+    _done = object()
+
+    def __init__(self, notes_handler: notes_handlers.NotesHandler, max_queued_pages: int = 4) -> None:
+        self._notes_handler = notes_handler
+        self._max_queued_pages = max_queued_pages
+
+    async def _export_service(self, name: str, notes_service: notes_handlers.NotesServiceProtocol,
+                              cursor: str | None, queue: asyncio.Queue) -> None:
+        try:
+            async for next_cursor, notes in notes_service.iter_notes_pages(cursor):
+                rows = [{
+                    'id': str(x.id),
+                    'backend': name,
+                    'title': x.title,
+                    'status': x.status,
+                    'done': x.done,
+                    'cursor': cursor,
+                } for x in notes] or [{'backend': name, 'cursor': cursor}]
+                rows[-1].update(next_cursor=next_cursor, page_end=True)
+                await queue.put(rows)
+                cursor = next_cursor
+        except Exception as e:
+            logger.error('Export error (%s): %s', name, e)
+            await queue.put([{'backend': name, 'error': str(e) or e.__class__.__name__, 'cursor': cursor}])
+        finally:
+            await queue.put(self._done)
+
+    async def export_notes(self, cursors: dict[str, str | None] | None = None,
+                           backends: list[str] | None = None) -> typing.AsyncGenerator[dict, None]:
+        notes_services = {
+            name: notes_service for name, notes_service in self._notes_handler.get_notes_services().items()
+            if not backends or name in backends
+        }
+        cursors = cursors or {}
+        queue = asyncio.Queue(self._max_queued_pages)
+        tasks = [
+            asyncio.create_task(self._export_service(name, notes_service, cursors.get(name), queue))
+            for name, notes_service in notes_services.items()
+        ]
+        try:
+            running = len(tasks)
+            while running:
+                page = await queue.get()
+                if page is self._done:
+                    running -= 1
+                    continue
+                for row in page:
+                    yield row
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def to_ndjson(row: dict) -> bytes:
+        return orjson.dumps(row) + b'\n'
+
+    @staticmethod
+    def to_csv(row: dict | None = None) -> bytes:
+        """Header without row"""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, EXPORT_FIELDS, extrasaction='ignore')
+        if row is None:
+            writer.writeheader()
+        else:
+            writer.writerow(row)
+        return buffer.getvalue().encode()
+
+    async def export_notes_formatted(self, export_format: str, cursors: dict[str, str | None] | None = None,
+                                     backends: list[str] | None = None) -> typing.AsyncGenerator[bytes, None]:
+        if export_format == ExportFormat.CSV:
+            yield self.to_csv()
+        async for row in self.export_notes(cursors, backends):
+            yield self.to_csv(row) if export_format == ExportFormat.CSV else self.to_ndjson(row)
+
+    @staticmethod
+    def parse_cursors(cursors: list[str]) -> dict[str, str]:
+        """Cursors in backend:cursor format"""
+        parsed = {}
+        for cursor in cursors:
+            backend, separator, value = cursor.partition(':')
+            if not separator:
+                raise ValueError(f'Error: Wrong cursor {cursor}, backend:cursor expected.')
+            parsed[backend] = value
+        return parsed
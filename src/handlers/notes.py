@@ -1,10 +1,28 @@
+import asyncio
 import logging
+import time
 import typing
 import uuid
+from collections import OrderedDict
+from contextlib import nullcontext
+
+from handlers.dedup import RecentNotesIndex
+import models.notes as notes_models
+import utils.metrics as metrics
+import utils.tracing as tracing
+
+# namespace of note ids derived from message ids
+NOTES_NAMESPACE = uuid.UUID('5b0c4d3e-6f1a-4c2e-9d7b-2a8e1f6c3b90')
+CREATED_NOTE_IDS_CACHE_SIZE = 10000
 
 logger = logging.getLogger(__name__)
 
 
+def get_note_id(message_id: str, notes_service_name: str) -> uuid.UUID:
+    """Stable note id of message in notes service, repeated creation of the same message is deduplicated by it"""
+    return uuid.uuid5(NOTES_NAMESPACE, f'{notes_service_name}:{message_id}')
+
+
 class MessageServiceProtocol(typing.Protocol):
     async def handle_messages(self, callback: typing.Coroutine) -> None:
         ...
@@ -12,17 +30,25 @@ class MessageServiceProtocol(typing.Protocol):
     async def handle_notes_request(self, callback: typing.Coroutine) -> None:
         ...
 
+    async def handle_search_request(self, callback: typing.Coroutine) -> None:
+        ...
+
 
 class NotesServiceProtocol(typing.Protocol):
     delete_done_notes: bool = False
+    delete_done_notes_interval: tuple[int, int] = (300, 3600)
     start_words: list[str] = []
 
-    async def create_note(self, text: str) -> None:
+    async def create_note(self, text: str, note_id: uuid.UUID | None = None) -> None:
         ...
 
     async def get_undone_note_titles(self) -> list[str]:
         ...
 
+    def iter_notes_pages(self, cursor: str | None = None
+                         ) -> typing.AsyncGenerator[tuple[str | None, list[notes_models.Note]], None]:
+        ...
+
     async def get_done_note_ids(self) -> list[uuid.UUID]:
         ...
 
@@ -30,48 +56,223 @@ class NotesServiceProtocol(typing.Protocol):
         ...
 
 
+class NotesIndexProtocol(typing.Protocol):
+    async def add_notes(self, backend: str, notes: list[notes_models.Note], synced_at: float | None = None) -> None:
+        ...
+
+    async def delete_notes(self, backend: str, note_ids: list[uuid.UUID]) -> None:
+        ...
+
+    async def delete_stale_notes(self, backend: str, synced_before: float) -> int:
+        ...
+
+    async def search(self, query: str, limit: int = 20,
+                     backends: list[str] | None = None) -> list[notes_models.SearchedNote]:
+        ...
+
+
+# concurrency and rate limit of notes service writes by notes service name
+NotesServiceLimit = typing.Callable[[str], typing.AsyncContextManager]
+
+
 class NotesFilterProtocol(typing.Protocol):
     def get_needed_to_create_notes(self, text: str) -> list[NotesServiceProtocol]:
         ...
 
 
 class NotesHandler:
-    def __init__(self, message_service: MessageServiceProtocol, filter_class: type[NotesFilterProtocol]) -> None:
-        self._message_service = message_service
+    def __init__(self, filter_class: type[NotesFilterProtocol]) -> None:
         self._filter_class = filter_class
         self._notes_services: list[NotesServiceProtocol] = []
+        self._notes_services_by_name: dict[str, NotesServiceProtocol] = {}
+        self._notes_created_listeners: list[typing.Callable[[str], None]] = []
+        self._created_note_ids: OrderedDict[uuid.UUID, None] = OrderedDict()
+        self._recent_notes: RecentNotesIndex | None = None
+        self._notes_index: NotesIndexProtocol | None = None
 
     def with_notes_service(self, notes_service: NotesServiceProtocol,
-                           delete_done_notes: bool, start_words: list[str]) -> typing.Self:
+                           delete_done_notes: bool, start_words: list[str],
+                           delete_done_notes_interval: tuple[int, int] = (300, 3600)) -> typing.Self:
         notes_service.delete_done_notes = delete_done_notes
+        notes_service.delete_done_notes_interval = delete_done_notes_interval
         notes_service.start_words = start_words
         self._notes_services += [notes_service]
+        # unique name, service class name with number for repeated apps
+        name = notes_service.__class__.__name__
+        number = 1
+        while name in self._notes_services_by_name:
+            number += 1
+            name = f'{notes_service.__class__.__name__}_{number}'
+        self._notes_services_by_name[name] = notes_service
         return self
 
-    async def _create_notes(self, text: str) -> None:
-        for notes_service in self._filter_class(self._notes_services).get_needed_to_create_notes(text):
-            await notes_service.create_note(text)
+    def with_duplicates_window(self, window_seconds: float, similarity: float, max_size: int) -> typing.Self:
+        """Notes similar to recent ones (text and its voice version, double send) are dropped"""
+        if window_seconds > 0:
+            self._recent_notes = RecentNotesIndex(window_seconds, similarity, max_size)
+        return self
+
+    def with_notes_index(self, notes_index: NotesIndexProtocol) -> typing.Self:
+        """Local search index, updated after note creation and by notes services sync"""
+        self._notes_index = notes_index
+        return self
+
+    def replace_notes_services(self, notes_handler: 'NotesHandler') -> None:
+        """Notes services and routing of other handler (reloaded config) replace current ones at once.
+        Listeners, recent notes, created note ids and search index of this handler are kept"""
+        self._filter_class = notes_handler._filter_class
+        self._notes_services, self._notes_services_by_name = \
+            notes_handler._notes_services, notes_handler._notes_services_by_name
+
+    @property
+    def has_notes_index(self) -> bool:
+        return self._notes_index is not None
+
+    def get_notes_services(self) -> dict[str, NotesServiceProtocol]:
+        """Notes services by unique name"""
+        return dict(self._notes_services_by_name)
+
+    def add_notes_created_listener(self, listener: typing.Callable[[str], None]) -> None:
+        """Listener is called with notes service name after note creation"""
+        self._notes_created_listeners += [listener]
+
+    def _get_notes_service_name(self, notes_service: NotesServiceProtocol) -> str:
+        return next(name for name, x in self._notes_services_by_name.items() if x is notes_service)
+
+    def get_needed_to_create_notes(self, text: str) -> list[NotesServiceProtocol]:
+        return self._filter_class(self._notes_services).get_needed_to_create_notes(text)
 
-    async def _get_notes(self) -> str:
-        notes = []
-        for notes_service in self._notes_services:
-            notes += [notes_service.__class__.__name__ + ':']
+    def _add_created_note_id(self, note_id: uuid.UUID) -> None:
+        self._created_note_ids[note_id] = None
+        if len(self._created_note_ids) > CREATED_NOTE_IDS_CACHE_SIZE:
+            self._created_note_ids.popitem(last=False)
+
+    async def _create_service_note(self, name: str, notes_service: NotesServiceProtocol, text: str,
+                                   message_id: str | None, service_limit: NotesServiceLimit | None) -> None:
+        note_id = get_note_id(message_id, name) if message_id else None
+        if note_id in self._created_note_ids:
+            logger.info('Note is already created (%s): %s', name, note_id)
+            metrics.NOTES_DUPLICATES_SKIPPED.inc(backend=name)
+            return
+        async with service_limit(name) if service_limit is not None else nullcontext():
+            with tracing.span('notes.create_note', service=name), metrics.NOTES_CREATE_SECONDS.time(backend=name):
+                try:
+                    await notes_service.create_note(text, note_id)
+                except Exception:
+                    metrics.NOTES_FAILED.inc(backend=name)
+                    raise
+        if note_id:
+            self._add_created_note_id(note_id)
+        metrics.NOTES_CREATED.inc(backend=name)
+        await self._index_created_note(name, note_id, text)
+        for listener in self._notes_created_listeners:
+            listener(name)
+
+    async def create_service_notes(self, text: str, message_id: str | None = None,
+                                   service_limit: NotesServiceLimit | None = None
+                                   ) -> dict[str, BaseException | None] | None:
+        """Create note in notes services selected by filter concurrently, return errors by notes service name or
+        None if note is dropped as duplicate. With message id repeated call (delivery retry after error of one
+        service) doesn't create notes again in services where they were created. If note is created in no service,
+        it is removed from recent notes, so its resend is not dropped as duplicate"""
+        if self._recent_notes is not None and self._recent_notes.check_and_add(text, message_id):
+            logger.info('Duplicate note is dropped: %s', message_id)
+            metrics.NOTES_DUPLICATES_DROPPED.inc()
+            return None
+        # names are resolved before the first await, services can be replaced by config reload meanwhile
+        notes_services = [(self._get_notes_service_name(x), x) for x in self.get_needed_to_create_notes(text)]
+        try:
+            errors = await asyncio.gather(*[
+                self._create_service_note(name, notes_service, text, message_id, service_limit)
+                for name, notes_service in notes_services
+            ], return_exceptions=True)
+        except BaseException:
+            self._discard_recent_note(text, message_id)
+            raise
+        if notes_services and all(x is not None for x in errors):
+            self._discard_recent_note(text, message_id)
+        return {name: error for (name, _), error in zip(notes_services, errors)}
+
+    def _discard_recent_note(self, text: str, message_id: str | None) -> None:
+        if self._recent_notes is not None:
+            self._recent_notes.discard(text, message_id)
+
+    async def create_notes(self, text: str, message_id: str | None = None) -> None:
+        """Create note in notes services selected by filter, the first error is raised"""
+        errors = await self.create_service_notes(text, message_id) or {}
+        error = next((x for x in errors.values() if x is not None), None)
+        if error is not None:
+            raise error
+
+    async def _index_created_note(self, name: str, note_id: uuid.UUID | None, text: str) -> None:
+        """Notes with ids not used by notes service (Notion sets page ids) are replaced by synced versions"""
+        if self._notes_index is None:
+            return
+        note = notes_models.Note(id=note_id or uuid.uuid4(), title=text, status=None, done=False)
+        try:
+            await self._notes_index.add_notes(name, [note])
+        except Exception as e:
+            logger.error('Index note error (%s): %s', name, e)
+
+    async def sync_service_notes_index(self, name: str) -> bool:
+        """Index all notes of notes service, notes deleted in service are deleted from index.
+        True if index was changed by deletion"""
+        logger.debug('Sync notes index (%s)', name)
+        synced_at = time.time()
+        count = 0
+        async for _, notes in self._notes_services_by_name[name].iter_notes_pages():
+            await self._notes_index.add_notes(name, notes, synced_at)
+            count += len(notes)
+        deleted = await self._notes_index.delete_stale_notes(name, synced_at)
+        logger.info('Notes index is synced (%s): %s notes, %s deleted', name, count, deleted)
+        return deleted > 0
+
+    async def search_notes(self, query: str, limit: int = 20,
+                           backends: list[str] | None = None) -> list[notes_models.SearchedNote]:
+        """Search in local index without notes services requests"""
+        if self._notes_index is None:
+            return []
+        with tracing.span('notes.search'):
+            return await self._notes_index.search(query, limit, backends)
+
+    @staticmethod
+    async def _get_service_notes(notes_service: NotesServiceProtocol) -> str:
+        notes = [notes_service.__class__.__name__ + ':']
+        try:
             notes += await notes_service.get_undone_note_titles()
+        except Exception as e:
+            logger.error('Get notes error (%s): %s', notes_service.__class__.__name__, e)
+            notes += ['Error getting notes']
         return '\n'.join(notes)
 
-    async def transmit_messages(self) -> None:
-        await self._message_service.handle_messages(self._create_notes)
-        await self._message_service.handle_notes_request(self._get_notes)
+    async def get_notes(self) -> typing.AsyncGenerator[str, None]:
+        """Notes of every service are requested concurrently and yielded as soon as they are received"""
+        tasks = [asyncio.create_task(self._get_service_notes(x)) for x in self._notes_services]
+        try:
+            for next_task in asyncio.as_completed(tasks):
+                yield await next_task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def transmit_messages(self, message_service: MessageServiceProtocol) -> None:
+        await message_service.handle_messages(self.create_notes)
+        await message_service.handle_notes_request(self.get_notes)
+        if self._notes_index is not None:
+            await message_service.handle_search_request(self.search_notes)
         logger.info(
             'Message handlers initialized (%s) => {%s}.',
-            self._message_service.__class__.__name__,
+            message_service.__class__.__name__,
             list(map(lambda x: x.__class__.__name__, self._notes_services)),
         )
 
-    async def delete_done_notes(self) -> None:
-        logger.debug('Delete done notes')
-        for notes_service in self._notes_services:
-            if notes_service.delete_done_notes:
-                note_ids = await notes_service.get_done_note_ids()
-                for note_id in note_ids:
-                    await notes_service.delete_note(note_id)
+    async def delete_service_done_notes(self, name: str) -> bool:
+        """Delete done notes of one notes service, True if something was deleted"""
+        logger.debug('Delete done notes (%s)', name)
+        notes_service = self._notes_services_by_name[name]
+        note_ids = await notes_service.get_done_note_ids()
+        for note_id in note_ids:
+            await notes_service.delete_note(note_id)
+        if self._notes_index is not None and note_ids:
+            await self._notes_index.delete_notes(name, note_ids)
+        return len(note_ids) > 0
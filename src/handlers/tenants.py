@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import logging
+import time
+import typing
+from collections import OrderedDict
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager, suppress
+from dataclasses import dataclass
+
+from config.settings import Tenant
+import handlers.notes as notes_handlers
+import models.notes as notes_models
+import utils.metrics as metrics
+
+logger = logging.getLogger(__name__)
+
+_user_id: contextvars.ContextVar[str | None] = contextvars.ContextVar('user_id', default=None)
+
+TenantNotesHandlerBuilder = typing.Callable[
+    [Tenant], typing.Awaitable[tuple[notes_handlers.NotesHandler, AsyncExitStack]]]
+
+
+def get_user_id() -> str | None:
+    return _user_id.get()
+
+
+@contextmanager
+def user_context(user_id: str | None) -> typing.Generator[None, None, None]:
+    """Messages handled in context are routed to notes handler of user tenant"""
+    token = _user_id.set(user_id)
+    try:
+        yield
+    finally:
+        _user_id.reset(token)
+
+
+@dataclass
+class _ActiveTenant:
+    tenant: Tenant
+    notes_handler: notes_handlers.NotesHandler
+    exit_stack: AsyncExitStack
+    used_at: float
+    # running calls of notes handler, evicted tenant is closed after the last of them
+    in_use: int = 0
+    evicted: bool = False
+    closed: bool = False
+
+
+class TenantRegistry:
+    """Messages of tenant users are handled by notes handler of their tenant, other messages by default one.
+    Tenant notes handlers are built on first message and closed after idle period or when too many tenants
+    are active, so memory is proportional to active tenants. Sessions and recognizer are shared by tenants.
+    Tenant evicted while its notes handler is in use is closed after the last call"""
+    _evictor_task: asyncio.Task | None = None
+
+    def __init__(self, default_notes_handler: notes_handlers.NotesHandler, tenants: list[Tenant],
+                 build_notes_handler: TenantNotesHandlerBuilder, idle_seconds: float = 900,
+                 max_active: int = 100) -> None:
+        self._default_notes_handler = default_notes_handler
+        self._tenants_by_user: dict[str, Tenant] = {}
+        self._build_notes_handler = build_notes_handler
+        self._idle_seconds = idle_seconds
+        self._max_active = max_active
+        # least recently used first
+        self._active: OrderedDict[str, _ActiveTenant] = OrderedDict()
+        self._activations: dict[str, asyncio.Task] = {}
+        self._set_tenants_by_user(tenants)
+
+    def _set_tenants_by_user(self, tenants: list[Tenant]) -> None:
+        self._tenants_by_user = {user: tenant for tenant in tenants for user in tenant.users}
+
+    async def set_tenants(self, tenants: list[Tenant]) -> None:
+        """Tenants of reloaded config, active tenants removed or changed in it are closed
+        and built again by next message"""
+        self._set_tenants_by_user(tenants)
+        tenants_by_name = {x.name: x for x in tenants}
+        for name in [name for name, x in self._active.items() if tenants_by_name.get(name) != x.tenant]:
+            await self._close_tenant(name)
+
+    @property
+    def active_count(self) -> int:
+        return len(self._active)
+
+    @asynccontextmanager
+    async def _use_notes_handler(self, user_id: str | None = None
+                                 ) -> typing.AsyncGenerator[notes_handlers.NotesHandler, None]:
+        tenant = self._tenants_by_user.get(user_id) if user_id else None
+        if tenant is None:
+            yield self._default_notes_handler
+            return
+        active = self._active.get(tenant.name) or await self._activate(tenant)
+        active.used_at = time.monotonic()
+        if self._active.get(tenant.name) is active:
+            self._active.move_to_end(tenant.name)
+        active.in_use += 1
+        try:
+            yield active.notes_handler
+        finally:
+            active.in_use -= 1
+            if active.evicted and active.in_use == 0:
+                await self._close_active(active)
+
+    async def _activate(self, tenant: Tenant) -> _ActiveTenant:
+        """Concurrent first messages of tenant wait for one activation"""
+        task = self._activations.get(tenant.name)
+        if task is None:
+            task = asyncio.create_task(self._build_tenant(tenant))
+            self._activations[tenant.name] = task
+            task.add_done_callback(lambda _: self._activations.pop(tenant.name, None))
+        return await asyncio.shield(task)
+
+    async def _build_tenant(self, tenant: Tenant) -> _ActiveTenant:
+        notes_handler, exit_stack = await self._build_notes_handler(tenant)
+        active = _ActiveTenant(tenant, notes_handler, exit_stack, time.monotonic())
+        self._active[tenant.name] = active
+        metrics.TENANT_ACTIVATIONS.inc()
+        logger.info('Tenant %s is activated (%s active)', tenant.name, len(self._active))
+        while len(self._active) > self._max_active:
+            await self._close_tenant(next(iter(self._active)))
+        return active
+
+    async def _close_tenant(self, name: str, force: bool = False) -> None:
+        """Tenant can be closed concurrently by eviction, config reload and activation of other tenant"""
+        active = self._active.pop(name, None)
+        if active is None:
+            return
+        active.evicted = True
+        if active.in_use and not force:
+            logger.info('Tenant %s is evicted, it is closed after %s running calls', name, active.in_use)
+            return
+        await self._close_active(active)
+
+    async def _close_active(self, active: _ActiveTenant) -> None:
+        if active.closed:
+            return
+        active.closed = True
+        try:
+            await active.exit_stack.aclose()
+        except Exception as e:
+            logger.error('Tenant %s close error: %s', active.tenant.name, e)
+        logger.info('Tenant %s is closed', active.tenant.name)
+
+    async def evict_idle_tenants(self) -> bool:
+        """True if some tenant was evicted"""
+        now = time.monotonic()
+        names = [name for name, x in self._active.items() if now - x.used_at > self._idle_seconds]
+        for name in names:
+            await self._close_tenant(name)
+        return len(names) > 0
+
+    async def _run_evictor(self) -> None:
+        while True:
+            await asyncio.sleep(self._idle_seconds / 4)
+            try:
+                await self.evict_idle_tenants()
+            except Exception as e:
+                logger.exception('Idle tenants eviction error: %s', e)
+
+    async def start(self) -> None:
+        if self._evictor_task is None:
+            self._evictor_task = asyncio.create_task(self._run_evictor())
+
+    async def close(self) -> None:
+        """Tenants are closed even if in use, in-flight calls are drained before"""
+        if self._evictor_task is not None:
+            self._evictor_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._evictor_task
+            self._evictor_task = None
+        for name in list(self._active):
+            await self._close_tenant(name, force=True)
+
+    async def create_notes(self, text: str, message_id: str | None = None) -> None:
+        async with self._use_notes_handler(get_user_id()) as notes_handler:
+            await notes_handler.create_notes(text, message_id)
+
+    async def get_notes(self) -> typing.AsyncGenerator[str, None]:
+        async with self._use_notes_handler(get_user_id()) as notes_handler:
+            async for notes in notes_handler.get_notes():
+                yield notes
+
+    async def search_notes(self, query: str, limit: int = 20,
+                           backends: list[str] | None = None) -> list[notes_models.SearchedNote]:
+        async with self._use_notes_handler(get_user_id()) as notes_handler:
+            return await notes_handler.search_notes(query, limit, backends)
+
+    async def transmit_messages(self, message_service: notes_handlers.MessageServiceProtocol) -> None:
+        await message_service.handle_messages(self.create_notes)
+        await message_service.handle_notes_request(self.get_notes)
+        if self._default_notes_handler.has_notes_index:
+            await message_service.handle_search_request(self.search_notes)
+        logger.info('Message handlers initialized (%s) => %s tenants.',
+                    message_service.__class__.__name__, len(set(x.name for x in self._tenants_by_user.values())))
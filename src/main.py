@@ -1,116 +1,256 @@
-import aiohttp
 import asyncio
 import logging
 import os
+import signal
+import sys
+import typing
+from contextlib import AsyncExitStack, nullcontext
+from functools import partial
 
 import uvicorn
+from fastapi import FastAPI
+from telegram.ext import Application
 
-from config.settings import get_settings, NoteAppType
+from config.settings import get_settings, set_settings, AppSettings, AppRole, RecognizerMode, TracingExporter
 from config.logging import configure_logging
+from config.watcher import ConfigWatcher
+from container import NotesContainer
 from api.app import FastapiFactory
-import handlers.notes as notes_handlers
-import handlers.filter as filter_handlers
-import repositories.teamly as teamly_repositories
-import repositories.yonote as yonote_repositories
-import repositories.notion as notion_repositories
+from handlers.notes import NotesHandler
+import api.db as api_db
 import repositories.telegram as telegram_repositories
-import services.teamly as teamly_services
-import services.yonote as yonote_services
-import services.notion as notion_services
 import services.telegram as telegram_services
 import utils.recognizer as recognizer_utils
 import utils.scheduler as scheduler_utils
-import utils.http as http_utils
+import utils.jobqueue as jobqueue_utils
+import utils.leader as leader_utils
+import utils.metrics as metrics
+import utils.tracing as tracing
+import utils.watchdog as watchdog_utils
+from utils.asynctools import wait_until
+
+# telegram connection settings are applied only by restart
+TELEGRAM_RESTART_FIELDS = ('token', 'update_mode', 'webhook_url', 'webhook_secret_token', 'update_limits')
 
 logger = logging.getLogger(__name__)
 
 
 class App:
+    _telegram_client: telegram_repositories.TelegramClient | None = None
+    _scheduler: scheduler_utils.Scheduler | None = None
+
     def __init__(self) -> None:
         self._settings = get_settings()
         configure_logging(self._settings)
         self._configure_dirs()
+        self._configure_tracing()
+        self._notes_container = NotesContainer(self._settings)
+        self._config_watcher = ConfigWatcher(
+            self._settings.common.config_path, AppSettings, self._apply_settings,
+            self._settings.common.config_watch_interval_seconds)
+        self._job_queue = jobqueue_utils.SqliteJobQueue(self._settings.common.job_queue_path)
+        self._app_role = self._settings.common.app_role
+        self._shutdown_event = asyncio.Event()
+        metrics.JOB_QUEUE_PENDING.set_collect_function(
+            lambda: {(kind,): count for kind, count in self._job_queue.count_pending_sync().items()})
+        metrics.TENANTS_ACTIVE.set_collect_function(
+            lambda: {(): self._notes_container.active_tenants_count})
 
     def _configure_dirs(self):
         if not os.path.exists(self._settings.common.tmp_dir):
             os.mkdir(self._settings.common.tmp_dir)
 
+    def _configure_tracing(self) -> None:
+        if self._settings.common.tracing_exporter == TracingExporter.JSONL:
+            tracing.configure_tracing(tracing.JsonLinesSpanExporter(self._settings.common.traces_path))
+        elif self._settings.common.tracing_exporter == TracingExporter.OTEL:
+            tracing.configure_tracing(tracing.OpenTelemetrySpanExporter())
+
+    def _get_update_processor(self) -> telegram_repositories.PriorityUpdateProcessor:
+        update_processor = telegram_repositories.create_update_processor(self._settings.transmit_from.update_limits)
+        metrics.TELEGRAM_UPDATES_RUNNING.set_collect_function(
+            lambda: {(name,): stats.running for name, stats in update_processor.get_stats().items()})
+        metrics.TELEGRAM_UPDATES_WAITING.set_collect_function(
+            lambda: {(name,): stats.waiting for name, stats in update_processor.get_stats().items()})
+        return update_processor
+
+    def _get_recognizer(self) -> recognizer_utils.SpeechRecognizerProtocol:
+        if self._settings.common.recognizer_mode == RecognizerMode.QUEUE:
+            return recognizer_utils.QueueSpeechRecognizer(
+                self._job_queue, self._settings.common.recognizer_timeout_seconds)
+        return recognizer_utils.SpeechRecognizer(self._settings.common.tmp_dir)
+
+    def _get_metrics_server_context(self) -> typing.AsyncContextManager:
+        """Processes without api serve metrics on METRICS_PORT"""
+        if self._settings.common.metrics_port is None:
+            return nullcontext()
+        return metrics.metrics_server_context(self._settings.common.api_host, self._settings.common.metrics_port)
+
+    def _get_loop_watchdog(self) -> typing.AsyncContextManager:
+        if not self._settings.common.loop_watchdog:
+            return nullcontext()
+        return watchdog_utils.LoopLagWatchdog(self._settings.common.loop_watchdog_threshold_seconds)
+
+    def _get_leader_election(self) -> leader_utils.LeaderElectionProtocol | None:
+        if not self._settings.common.leader_election:
+            return None
+        return leader_utils.SqliteLeaderElection(
+            self._settings.common.leader_election_path, self._settings.common.leader_lease_seconds)
+
+    @staticmethod
+    def _get_delete_done_notes_job_name(notes_service_name: str) -> str:
+        return f'delete_done_notes:{notes_service_name}'
+
+    def _get_delete_done_notes_job_names(self, notes_service_names: list[str] | None) -> list[str]:
+        """Cleanup jobs of all notes services by default, other adaptive jobs are not triggered"""
+        if not notes_service_names:
+            notes_service_names = list(self._notes_container.notes_handler.get_notes_services())
+        return [self._get_delete_done_notes_job_name(x) for x in notes_service_names]
+
+    async def _run_delete_done_notes_jobs(self) -> None:
+        """Cleanup job per notes service, interval is tightened after note creation"""
+        for name, notes_service in self._notes_handler.get_notes_services().items():
+            if not notes_service.delete_done_notes:
+                continue
+            await self._scheduler.run_adaptive_job(
+                self._get_delete_done_notes_job_name(name),
+                partial(self._notes_handler.delete_service_done_notes, name),
+                *notes_service.delete_done_notes_interval
+            )
+
+    async def _run_sync_notes_index_jobs(self) -> None:
+        """Search index sync job per notes service, the first sync is run at start"""
+        if not self._notes_handler.has_notes_index:
+            return
+        interval_seconds = self._settings.common.search_sync_interval_seconds
+        job_names = []
+        for name in self._notes_handler.get_notes_services():
+            job_names += [f'sync_notes_index:{name}']
+            await self._scheduler.run_adaptive_job(
+                job_names[-1], partial(self._notes_handler.sync_service_notes_index, name),
+                interval_seconds, interval_seconds
+            )
+        self._scheduler.trigger_jobs(job_names)
+
+    async def _purge_job_queue(self) -> bool:
+        """Results of timed out recognitions and jobs of stopped consumers are deleted after retention period"""
+        return await self._job_queue.purge(self._settings.common.job_queue_retention_seconds) > 0
+
+    async def _reload_notes_jobs(self) -> None:
+        """Jobs of notes services of reloaded config replace current ones"""
+        self._scheduler.remove_adaptive_jobs([
+            x for x in self._scheduler.get_stats() if x.startswith(('delete_done_notes:', 'sync_notes_index:'))])
+        await self._run_delete_done_notes_jobs()
+        await self._run_sync_notes_index_jobs()
+
+    async def _apply_settings(self, settings: AppSettings) -> None:
+        """Notes apps, routing, credentials, tenants and allowed users of reloaded config are applied
+        without restart, recognizer and telegram connection keep running"""
+        await self._notes_container.reload(settings)
+        if self._telegram_client is not None:
+            self._telegram_client.set_allowed_users(settings.get_allowed_users())
+        if self._scheduler is not None and not self._shutdown_event.is_set():
+            await self._reload_notes_jobs()
+        changed_fields = [x for x in TELEGRAM_RESTART_FIELDS
+                          if getattr(settings.transmit_from, x) != getattr(self._settings.transmit_from, x)]
+        if changed_fields:
+            logger.warning('Changed transmit_from settings are applied after restart: %s', changed_fields)
+        self._settings = settings
+        set_settings(settings)
+
+    async def _start_notes_container(self) -> NotesHandler:
+        notes_handler = await self._notes_container.start()
+        await self._config_watcher.start()
+        return notes_handler
+
+    async def _close_notes_container(self) -> None:
+        await self._config_watcher.stop()
+        await self._notes_container.close()
+
+    async def _trigger_cleanup(self, notes_service_names: list[str] | None = None) -> dict:
+        return {'triggered': self._scheduler.trigger_jobs(
+            self._get_delete_done_notes_job_names(notes_service_names))}
+
+    async def _trigger_queued_cleanup(self, notes_service_names: list[str] | None = None) -> dict:
+        return await scheduler_utils.put_queued_trigger(
+            self._job_queue, self._get_delete_done_notes_job_names(notes_service_names))
+
+    def request_shutdown(self) -> None:
+        """Worker and recognizer stop taking new work, drain in-flight work and exit"""
+        logger.warning('Shutdown requested...')
+        self._shutdown_event.set()
+
+    def _add_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+        for shutdown_signal in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(shutdown_signal, self.request_shutdown)
+
+    def _get_shutdown_deadline(self) -> float:
+        return asyncio.get_running_loop().time() + self._settings.common.shutdown_grace_seconds
+
+    async def _drain_worker(self, telegram_app: Application,
+                            consumers: list[asyncio.Task]) -> None:
+        """Stop receiving updates and triggers, then wait for in-flight work until grace period end"""
+        deadline = self._get_shutdown_deadline()
+        api_db.telegram_update_sink = None
+        api_db.cleanup_trigger = None
+        if consumers and not await wait_until(asyncio.gather(*consumers), deadline):
+            logger.warning('Queued jobs consumers are cancelled by shutdown deadline')
+        await self._scheduler.stop(deadline)
+        if not await telegram_repositories.drain_telegram_app(telegram_app, deadline):
+            logger.warning('Telegram updates handling is cancelled by shutdown deadline')
+        if not await wait_until(self._telegram_side_effects.stop(), deadline):
+            logger.warning('Telegram side effects are cancelled by shutdown deadline')
+
     async def run_async_worker(self) -> None:
-        async with http_utils.aiohttp_session_context(teamly_repositories.TEAMLY_API_URL) as teamly_session, \
-                http_utils.aiohttp_session_context(yonote_repositories.YONOTE_API_URL) as yonote_session, \
-                http_utils.aiohttp_session_context(notion_repositories.NOTION_API_URL) as notion_session, \
-                telegram_repositories.telegram_app_context(self._settings.transmit_from.token) as telegram_app:
-            self._recognizer = recognizer_utils.SpeechRecognizer(self._settings.common.tmp_dir)
+        self._update_processor = self._get_update_processor()
+        async with telegram_repositories.telegram_app_context(
+                    self._settings.transmit_from.token,
+                    self._settings.transmit_from.webhook_url if self._settings.transmit_from.is_webhook_mode else None,
+                    self._settings.transmit_from.webhook_secret_token,
+                    self._update_processor
+                ) as telegram_app, \
+                AsyncExitStack() as exit_stack:
+            consumers = []
+            self._notes_handler = await self._start_notes_container()
+            if self._settings.transmit_from.is_webhook_mode:
+                api_db.telegram_update_sink = partial(telegram_repositories.put_webhook_update, telegram_app)
+            if self._app_role == AppRole.BOT and self._settings.transmit_from.is_webhook_mode:
+                consumers += [asyncio.create_task(telegram_repositories.run_queued_updates_consumer(
+                    telegram_app, self._job_queue, self._shutdown_event))]
+            self._recognizer = self._get_recognizer()
+            self._telegram_side_effects = telegram_repositories.TelegramSideEffects(telegram_app)
+            await self._telegram_side_effects.start()
+            exit_stack.push_async_callback(self._telegram_side_effects.stop)
             self._telegram_client = telegram_repositories.TelegramClient(
                 telegram_app,
                 self._recognizer,
+                self._telegram_side_effects,
                 self._settings.common.tmp_dir,
-                self._settings.transmit_from.allowed_users
+                self._settings.get_allowed_users(),
+                self._settings.transmit_from.notes_reply_ttl_seconds,
+                self._settings.transmit_from.notes_pagination,
+                self._settings.transmit_from.rejection_reply_interval_seconds
             )
             self._telegram_service = telegram_services.TelegramService(self._telegram_client)
-            self._notes_handler = notes_handlers.NotesHandler(self._telegram_service, filter_handlers.NotesFilter)
-
-            for note_client_config in self._settings.transmit_to:
-                if note_client_config.app == NoteAppType.TEAMLY:
-                    self._teamly_auth = teamly_repositories.TeamlyAuthClient(
-                        teamly_session,
-                        self._settings.common.tmp_dir,
-                        note_client_config.integration_id,
-                        note_client_config.integration_url,
-                        note_client_config.client_secret,
-                        note_client_config.client_auth_code
-                    )
-                    self._teamly_client = teamly_repositories.TeamlyClient(
-                        teamly_session,
-                        self._teamly_auth,
-                        note_client_config.database_id,
-                        note_client_config.status_field_id,
-                        note_client_config.status_field_value,
-                        note_client_config.done_field_id
-                    )
-                    self._teamly_service = teamly_services.TeamlyService(self._teamly_client)
-                    self._notes_handler = self._notes_handler.with_notes_service(
-                        self._teamly_service,
-                        note_client_config.delete_done_notes,
-                        note_client_config.start_words
-                    )
-                elif note_client_config.app == NoteAppType.NOTION:
-                    self._notion_client = notion_repositories.NotionClient(
-                        notion_session,
-                        note_client_config.token,
-                        note_client_config.database_id,
-                        note_client_config.status_field_id,
-                        note_client_config.status_field_value,
-                        note_client_config.done_field_id
-                    )
-                    self._notion_service = notion_services.NotionService(self._notion_client)
-                    self._notes_handler = self._notes_handler.with_notes_service(
-                        self._notion_service,
-                        note_client_config.delete_done_notes,
-                        note_client_config.start_words
-                    )
-                elif note_client_config.app == NoteAppType.YONOTE:
-                    self._yonote_client = yonote_repositories.YonoteClient(
-                        yonote_session,
-                        note_client_config.token,
-                        note_client_config.database_id,
-                        note_client_config.collection_id,
-                        note_client_config.status_field_id,
-                        note_client_config.status_field_value,
-                        note_client_config.done_field_id
-                    )
-                    self._yonote_service = yonote_services.YonoteService(self._yonote_client)
-                    self._notes_handler = self._notes_handler.with_notes_service(
-                        self._yonote_service,
-                        note_client_config.delete_done_notes,
-                        note_client_config.start_words
-                    )
-                else:
-                    raise ValueError(f'Error: Unknown note app {note_client_config.app}')
-            await self._notes_handler.transmit_messages()
-            await scheduler_utils.Scheduler().run_job(self._notes_handler.delete_done_notes, every_seconds=300)
-            while True:
-                await asyncio.sleep(5)
+            await self._notes_container.tenant_registry.transmit_messages(self._telegram_service)
+            self._scheduler = scheduler_utils.Scheduler(
+                self._get_leader_election(), self._settings.common.scheduler_jitter_ratio)
+            exit_stack.push_async_callback(self._scheduler.stop)
+            await self._run_delete_done_notes_jobs()
+            self._notes_handler.add_notes_created_listener(
+                lambda name: self._scheduler.touch_job(self._get_delete_done_notes_job_name(name)))
+            await self._run_sync_notes_index_jobs()
+            await self._scheduler.run_adaptive_job('purge_job_queue', self._purge_job_queue, 3600, 3600)
+            api_db.cleanup_trigger = self._trigger_cleanup
+            if self._app_role == AppRole.BOT:
+                consumers += [asyncio.create_task(scheduler_utils.run_queued_triggers_consumer(
+                    self._scheduler, self._job_queue, self._shutdown_event))]
+            for consumer in consumers:
+                exit_stack.callback(consumer.cancel)
+            await self._shutdown_event.wait()
+            logger.warning('Draining worker...')
+            await self._drain_worker(telegram_app, consumers)
 
     async def run_async_worker_safe(self) -> None:
         try:
@@ -118,36 +258,67 @@ class App:
         except asyncio.CancelledError:
             pass
 
-    async def get_notes_service(self) -> None:
-        notion_session = aiohttp.ClientSession(notion_repositories.NOTION_API_URL)
-        notion_client_config = self._settings.get_first_notion_client_config()
-        notion_client = notion_repositories.NotionClient(
-            notion_session,
-            notion_client_config.token,
-            notion_client_config.database_id,
-            notion_client_config.status_field_id,
-            notion_client_config.status_field_value,
-            notion_client_config.done_field_id
-        )
-        notion_service = notion_services.NotionService(notion_client)
-        return notion_service
+    async def run_async_worker_standalone(self) -> None:
+        self._add_signal_handlers()
+        try:
+            async with self._get_metrics_server_context(), self._get_loop_watchdog():
+                await self.run_async_worker_safe()
+        finally:
+            await self._close_notes_container()
 
-    @staticmethod
-    async def close_notes_service(notion_service: notion_services.NotionService):
-        await notion_service._notes_client._notion_session._session.close()
+    async def run_async_recognizer(self) -> None:
+        self._add_signal_handlers()
+        recognizer = recognizer_utils.SpeechRecognizer(self._settings.common.tmp_dir)
+        worker = asyncio.create_task(
+            recognizer_utils.run_recognizer_worker(recognizer, self._job_queue, self._shutdown_event))
+        worker.add_done_callback(lambda _: self._shutdown_event.set())
+        async with self._get_metrics_server_context(), self._get_loop_watchdog():
+            await self._shutdown_event.wait()
+            if not await wait_until(worker, self._get_shutdown_deadline()):
+                logger.warning('Recognize job is cancelled by shutdown deadline')
 
     def run(self) -> None:
+        """Bot worker without api, in webhook mode updates are received by api processes"""
         logger.warning('Starting app...')
+        if self._settings.transmit_from.is_webhook_mode and self._app_role != AppRole.BOT:
+            logger.warning('Telegram webhook mode needs api, updates will not be received without it')
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(self.run_async_worker_standalone())
+
+    def run_recognizer(self) -> None:
+        logger.warning('Starting recognizer...')
         loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.run_async_worker_safe())
+        loop.run_until_complete(self.run_async_recognizer())
+
+    def get_api_app(self) -> FastAPI:
+        """Stateless api without bot worker, webhook updates are sent to bot worker by job queue"""
+        if self._settings.transmit_from.is_webhook_mode:
+            api_db.telegram_update_sink = partial(telegram_repositories.put_queued_update, self._job_queue)
+        api_db.cleanup_trigger = self._trigger_queued_cleanup
+        return FastapiFactory(
+            self._settings.common.api_name,
+            get_notes_handler=self._start_notes_container,
+            close_notes_handler=self._close_notes_container
+        ).app
+
+    def run_api(self) -> None:
+        logger.warning('Starting api...')
+        uvicorn.run(
+            'main:create_api_app',
+            factory=True,
+            workers=self._settings.common.api_workers,
+            host=self._settings.common.api_host,
+            port=int(self._settings.common.api_port)
+        )
 
     def run_with_api(self) -> None:
         logger.warning('Starting app and api...')
         app = FastapiFactory(
             self._settings.common.api_name,
-            get_notes_service=self.get_notes_service,
-            close_notes_service=self.close_notes_service,
-            worker_service=self.run_async_worker_safe
+            get_notes_handler=self._start_notes_container,
+            close_notes_handler=self._close_notes_container,
+            worker_service=self.run_async_worker_safe,
+            stop_worker_service=self.request_shutdown
         )
         uvicorn.run(
             app.app,
@@ -155,14 +326,32 @@ class App:
             port=int(self._settings.common.api_port)
         )
 
+    def run_role(self, app_role: AppRole | None = None) -> None:
+        self._app_role = app_role or self._app_role
+        if self._app_role == AppRole.API:
+            self.run_api()
+        elif self._app_role == AppRole.BOT:
+            self.run()
+        elif self._app_role == AppRole.RECOGNIZER:
+            self.run_recognizer()
+        else:
+            self.run_with_api()
+
     def close(self) -> None:
         logger.warning('Closing app...')
+        self._job_queue.close()
+        tracing.close_tracing()
+
+
+def create_api_app() -> FastAPI:
+    """Api app factory for uvicorn workers"""
+    return App().get_api_app()
 
 
 if __name__ == '__main__':
     app = App()
     try:
-        app.run_with_api()
+        app.run_role(AppRole(sys.argv[1].upper()) if len(sys.argv) > 1 else None)
     except KeyboardInterrupt:
         pass
     finally:
@@ -8,3 +8,7 @@ class Note(BaseModel):
     title: str | None
     status: str | None
     done: bool | None
+
+
+class SearchedNote(Note):
+    backend: str
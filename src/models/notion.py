@@ -15,6 +15,8 @@ class NotesAnswer(BaseModel):
     results: list[dict]
     request_id: uuid.UUID
     type: str
+    has_more: bool = False
+    next_cursor: str | None = None
 
     def to_notes(self) -> list[Note]:
         notes = list(map(lambda x: {
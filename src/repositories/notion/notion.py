@@ -1,3 +1,4 @@
+import datetime
 import logging
 import uuid
 
@@ -11,6 +12,7 @@ NOTION_API_URL = 'https://api.notion.com'
 NOTION_API_CREATE_NOTE = '/v1/pages'
 NOTION_API_DELETE_NOTE = '/v1/pages'
 NOTION_API_GET_NOTES = '/v1/databases'
+NOTION_NOTES_PAGE_SIZE = 100
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +21,7 @@ class NotionClient(notes_services.NoteClientProtocol):
 
     def __init__(self, notion_session: aiohttp.ClientSession, notion_token: str, database_id: str,
                  status_field_id: str, status_field_value: str, done_field_id: str) -> None:
-        self._notion_session = http_utils.ClientSession(notion_session)
+        self._notion_session = http_utils.ClientSession(notion_session, 'notion')
         self._notion_token = notion_token
         self._database_id = database_id
         self._status_field_id = status_field_id
@@ -34,8 +36,30 @@ class NotionClient(notes_services.NoteClientProtocol):
             'Notion-Version': '2022-06-28',
         }
 
-    async def create_note(self, text: str) -> None:
+    async def _is_note_created(self, text: str, created_after: datetime.datetime) -> bool:
+        """Best effort: Notion pages have no client ids, note is searched by title and creation time (minutes).
+        If several pages match, the title collides with other pages and the check is skipped, so retry may
+        create a duplicate, but note is never lost because of other page"""
+        message = {
+            'filter': {
+                'and': [
+                    {'property': 'Name', 'title': {'equals': text}},
+                    # created_time is rounded to minutes
+                    {'timestamp': 'created_time', 'created_time': {
+                        'on_or_after': created_after.replace(second=0, microsecond=0).isoformat()}},
+                ]
+            },
+            'page_size': 2,
+        }
+        matches = len((await self._query_notes(message)).results)
+        if matches > 1:
+            logger.warning('Notion note title collides with other pages, created note check is skipped')
+        return matches == 1
+
+    async def create_note(self, text: str, note_id: uuid.UUID | None = None) -> None:
+        """Page id is set by Notion, note_id is not used"""
         logger.debug('Notion create note start')
+        created_after = datetime.datetime.now(datetime.timezone.utc)
         message = {
             'parent': {
                 'database_id': self._database_id
@@ -46,20 +70,32 @@ class NotionClient(notes_services.NoteClientProtocol):
             }
         }
         answer = await self._notion_session.request(
-            'POST', NOTION_API_CREATE_NOTE, message, headers=self._get_token_headers())
+            'POST', NOTION_API_CREATE_NOTE, message, headers=self._get_token_headers(),
+            write_check=http_utils.WriteCheck(lambda: self._is_note_created(text, created_after)))
         logger.debug('Notion create note answer: %s', answer)
         return
 
-    async def get_notes(self, message: dict = {}) -> list[notion_models.Note]:
-        logger.debug('Notion get notes start')
+    async def _query_notes(self, message: dict) -> notion_models.NotesAnswer:
         answer = await self._notion_session.request(
             'POST', NOTION_API_GET_NOTES + f'/{self._database_id}/query', message, headers=self._get_token_headers())
-        answer_model = notion_models.NotesAnswer(**answer)
+        return notion_models.NotesAnswer(**answer)
+
+    async def get_notes(self, message: dict = {}) -> list[notion_models.Note]:
+        logger.debug('Notion get notes start')
+        answer_model = await self._query_notes(message)
         notes = answer_model.to_notes()
 
         logger.debug('Notion get notes answer: %s', notes)
         return notes
 
+    async def get_notes_page(self, cursor: str | None = None) -> tuple[list[notion_models.Note], str | None]:
+        logger.debug('Notion get notes page start: %s', cursor)
+        message = {'page_size': NOTION_NOTES_PAGE_SIZE}
+        if cursor:
+            message['start_cursor'] = cursor
+        answer_model = await self._query_notes(message)
+        return answer_model.to_notes(), answer_model.next_cursor if answer_model.has_more else None
+
     async def get_done_notes(self) -> list[notion_models.Note]:
         message = {
             'filter': {
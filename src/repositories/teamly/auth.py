@@ -1,32 +1,50 @@
+import asyncio
 import logging
 import os
-from datetime import datetime
+import time
 
 import aiohttp
 import orjson
 
 import models.teamly as teamly_models
 from .teamly import TeamlyAuthClientProtocol
+import utils.files as files_utils
 import utils.http as http_utils
+import utils.tracing as tracing
 
 TEAMLY_API_AUTH = '/api/v1/auth/integration/authorize'
 TEAMLY_API_REFRESH = '/api/v1/auth/integration/refresh'
 TEAMLY_TOKEN_FILE = 'teamly_tokens.json'
+TEAMLY_TOKEN_LOCK_FILE = 'teamly_tokens.lock'
+TEAMLY_REFRESH_RETRY_SECONDS = 30
+# tokens with lifetime shorter than refresh skew are not refreshed more often
+TEAMLY_REFRESH_MIN_DELAY_SECONDS = 30
 
 logger = logging.getLogger(__name__)
 
 
 class TeamlyAuthClient(TeamlyAuthClientProtocol):
-    _teamly_tokens = None
+    """Teamly token manager: tokens are refreshed in background ahead of expiry,
+    concurrent refreshes are collapsed into one and get_token_headers returns cached headers.
+    Tokens file is shared by processes, refresh is done under file lock with tokens read again from file,
+    so refresh token rotated by other process is not used"""
+    _teamly_tokens: teamly_models.AuthTokens | None = None
+    _token_headers: dict | None = None
+    _refresh_task: asyncio.Task | None = None
 
     def __init__(self, teamly_session: aiohttp.ClientSession, tmp_dir: str,
-                 integration_id: str, integration_url: str, client_secret: str, client_auth_code: str) -> None:
-        self._teamly_session = http_utils.ClientSession(teamly_session)
+                 integration_id: str, integration_url: str, client_secret: str, client_auth_code: str,
+                 refresh_skew_seconds: int = 60) -> None:
+        self._teamly_session = http_utils.ClientSession(teamly_session, 'teamly')
         self._tmp_dir = tmp_dir
         self._integration_id = integration_id
         self._integration_url = integration_url
         self._client_secret = client_secret
         self._client_auth_code = client_auth_code
+        self._refresh_skew_seconds = refresh_skew_seconds
+        self._teamly_tokens_path = os.path.join(self._tmp_dir, TEAMLY_TOKEN_FILE)
+        self._teamly_tokens_lock_path = os.path.join(self._tmp_dir, TEAMLY_TOKEN_LOCK_FILE)
+        self._refresh_lock = asyncio.Lock()
 
     async def _get_auth_tokens(self) -> teamly_models.AuthTokensAnswer:
         logger.debug('Teamly auth start')
@@ -51,43 +69,91 @@ class TeamlyAuthClient(TeamlyAuthClientProtocol):
         logger.debug('Teamly refresh answer: %s', answer)
         return teamly_models.AuthTokensAnswer(**answer)
 
-    def _read_tokens(self) -> teamly_models.AuthTokens:
-        if self._teamly_tokens:
+    async def _read_tokens(self, from_file: bool = False) -> teamly_models.AuthTokens:
+        if self._teamly_tokens and not from_file:
             return self._teamly_tokens
-        teamly_tokens_path = os.path.join(self._tmp_dir, TEAMLY_TOKEN_FILE)
-        if not os.path.exists(teamly_tokens_path):
-            open(teamly_tokens_path, 'w').close()
-        with open(teamly_tokens_path, 'r') as file_opened:
-            content = file_opened.read()
+        content = await files_utils.async_read_file(self._teamly_tokens_path)
         try:
-            teamly_tokens = orjson.loads(content)
+            teamly_tokens = orjson.loads(content or '')
         except orjson.JSONDecodeError:
             teamly_tokens = {}
-        self._teamly_tokens = teamly_models.AuthTokens(**teamly_tokens)
+        self._set_tokens(teamly_models.AuthTokens(**teamly_tokens))
         return self._teamly_tokens
 
-    def _write_tokens(self, teamly_tokens: teamly_models.AuthTokens) -> teamly_models.AuthTokens:
-        teamly_tokens_path = os.path.join(self._tmp_dir, TEAMLY_TOKEN_FILE)
-        with open(teamly_tokens_path, 'w') as file_opened:
-            file_opened.write(teamly_tokens.model_dump_json())
-        self._teamly_tokens = teamly_tokens
-        return teamly_tokens
-
-    async def _handle_tokens(self) -> teamly_models.AuthTokens:
-        teamly_tokens = self._read_tokens()
-        if not teamly_tokens.refresh_token_expires_at or \
-                datetime.fromtimestamp(teamly_tokens.refresh_token_expires_at) < datetime.now():
-            answer = await self._get_auth_tokens()
-            teamly_tokens = self._write_tokens(answer.to_auth_tokens())
-        if not teamly_tokens.access_token_expires_at or \
-                datetime.fromtimestamp(teamly_tokens.access_token_expires_at) < datetime.now():
-            answer = await self._refresh_auth_tokens(teamly_tokens.refresh_token)
-            teamly_tokens = self._write_tokens(answer.to_auth_tokens())
+    async def _write_tokens(self, teamly_tokens: teamly_models.AuthTokens) -> teamly_models.AuthTokens:
+        await files_utils.async_write_file_atomic(self._teamly_tokens_path, teamly_tokens.model_dump_json())
+        self._set_tokens(teamly_tokens)
         return teamly_tokens
 
-    async def get_token_headers(self) -> dict:
-        teamly_tokens = await self._handle_tokens()
-        return {
+    def _set_tokens(self, teamly_tokens: teamly_models.AuthTokens) -> None:
+        self._teamly_tokens = teamly_tokens
+        self._token_headers = {
             'X-Account-Slug': teamly_tokens.slug,
             'Authorization': 'Bearer %s' % (teamly_tokens.access_token,)
         }
+
+    def _is_expired(self, expires_at: int | None, skew_seconds: int = 0) -> bool:
+        return not expires_at or expires_at - skew_seconds <= time.time()
+
+    def _is_access_token_valid(self) -> bool:
+        return bool(self._teamly_tokens) and not self._is_expired(self._teamly_tokens.access_token_expires_at)
+
+    def _is_refresh_needed(self, teamly_tokens: teamly_models.AuthTokens, skew_seconds: int) -> bool:
+        return self._is_expired(teamly_tokens.refresh_token_expires_at, skew_seconds) or \
+            self._is_expired(teamly_tokens.access_token_expires_at, skew_seconds)
+
+    async def _handle_tokens(self, skew_seconds: int = 0) -> teamly_models.AuthTokens:
+        """Single-flight refresh: callers waiting on the lock reuse tokens refreshed by the first one,
+        processes waiting on the file lock reuse tokens written by the first one"""
+        async with self._refresh_lock:
+            teamly_tokens = await self._read_tokens()
+            if not self._is_refresh_needed(teamly_tokens, skew_seconds):
+                return teamly_tokens
+            async with files_utils.async_file_lock(self._teamly_tokens_lock_path):
+                teamly_tokens = await self._read_tokens(from_file=True)
+                if self._is_expired(teamly_tokens.refresh_token_expires_at, skew_seconds):
+                    with tracing.span('teamly.token_auth'):
+                        answer = await self._get_auth_tokens()
+                        teamly_tokens = await self._write_tokens(answer.to_auth_tokens())
+                if self._is_expired(teamly_tokens.access_token_expires_at, skew_seconds):
+                    with tracing.span('teamly.token_refresh'):
+                        answer = await self._refresh_auth_tokens(teamly_tokens.refresh_token)
+                        teamly_tokens = await self._write_tokens(answer.to_auth_tokens())
+            return teamly_tokens
+
+    def _get_refresh_delay(self) -> float:
+        if not self._teamly_tokens or not self._teamly_tokens.access_token_expires_at:
+            return 0
+        return max(self._teamly_tokens.access_token_expires_at - self._refresh_skew_seconds - time.time(),
+                   TEAMLY_REFRESH_MIN_DELAY_SECONDS)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._get_refresh_delay())
+            try:
+                await self._handle_tokens(self._refresh_skew_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error('Teamly background token refresh error: %s', e)
+                await asyncio.sleep(TEAMLY_REFRESH_RETRY_SECONDS)
+
+    async def start(self) -> None:
+        """Start background refresh, first iteration loads tokens from file or Teamly"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresh_task is None:
+            return
+        self._refresh_task.cancel()
+        try:
+            await self._refresh_task
+        except asyncio.CancelledError:
+            pass
+        self._refresh_task = None
+
+    async def get_token_headers(self) -> dict:
+        if not self._is_access_token_valid():
+            await self._handle_tokens()
+        return self._token_headers
@@ -29,21 +29,26 @@ class TeamlyClient(notes_services.NoteClientProtocol):
 
     def __init__(self, teamly_session: aiohttp.ClientSession, teamly_auth: TeamlyAuthClientProtocol,
                  database_id: str, status_field_id: str, status_field_value: str, done_field_id: str) -> None:
-        self._teamly_session = http_utils.ClientSession(teamly_session)
+        self._teamly_session = http_utils.ClientSession(teamly_session, 'teamly')
         self._teamly_auth = teamly_auth
         self._database_id = database_id
         self._status_field_id = status_field_id
         self._status_field_value = status_field_value
         self._done_field_id = done_field_id
 
-    async def create_note(self, text: str) -> None:
+    async def _is_note_created(self, note_id: uuid.UUID) -> bool:
+        """Teamly has no request of one article, it is searched in database content"""
+        return any(x.id == note_id for x in await self.get_notes())
+
+    async def create_note(self, text: str, note_id: uuid.UUID | None = None) -> None:
         logger.debug('Teamly create note start')
+        note_id = note_id or uuid.uuid4()
         message = {
             "code": "article_create",
             "payload": {
                 "entity": {
                     "spaceId": self._database_id,
-                    "id": str(uuid.uuid4()),
+                    "id": str(note_id),
                     "properties": [
                         {
                             "method": "add",
@@ -62,7 +67,8 @@ class TeamlyClient(notes_services.NoteClientProtocol):
             }
         }
         answer = await self._teamly_session.request(
-            'POST', TEAMLY_API_CREATE_NOTE, message, headers=await self._teamly_auth.get_token_headers())
+            'POST', TEAMLY_API_CREATE_NOTE, message, headers=await self._teamly_auth.get_token_headers(),
+            write_check=http_utils.WriteCheck(lambda: self._is_note_created(note_id)))
         logger.debug('Teamly create note answer: %s', answer)
         return
 
@@ -93,6 +99,10 @@ class TeamlyClient(notes_services.NoteClientProtocol):
         logger.debug('Teamly get notes answer: %s', notes)
         return notes
 
+    async def get_notes_page(self, cursor: str | None = None) -> tuple[list[teamly_models.Note], str | None]:
+        """Content database query returns all rows at once, so there is only one page"""
+        return await self.get_notes(), None
+
     async def get_done_notes(self) -> list[teamly_models.Note]:
         notes = await self.get_notes()
         done_notes = list(filter(lambda x: x.done, notes))
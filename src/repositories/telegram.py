@@ -1,117 +1,445 @@
 import asyncio
+import html
 import logging
 import os
+import time
 import typing
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 from functools import wraps
 
 import backoff
-from telegram import Update, KeyboardButton, ReplyKeyboardMarkup
-from telegram.ext import Application, ContextTypes, CommandHandler, MessageHandler, filters
-from telegram.error import NetworkError
+from telegram import (
+    InlineKeyboardButton, InlineKeyboardMarkup, Message, Update, KeyboardButton, ReplyKeyboardMarkup
+)
+from telegram.ext import (
+    Application, BaseUpdateProcessor, CallbackQueryHandler, ContextTypes, CommandHandler, MessageHandler, filters
+)
+from telegram.error import BadRequest, NetworkError, TelegramError
 
+from config.settings import TelegramUpdateLimits
+import handlers.tenants as tenants_handlers
 from services.telegram import TelegramClientProtocol
+from utils.asynctools import wait_until
+import utils.files as files_utils
+from utils.jobqueue import SqliteJobQueue
+from utils.limiter import LimitClass, PriorityLimiter
 from utils.recognizer import SpeechRecognizerProtocol
+from utils.text import split_text
+import utils.metrics as metrics
+import utils.tracing as tracing
+
+TELEGRAM_DELETE_MESSAGES_LIMIT = 100
+TELEGRAM_UPDATE_JOB_KIND = 'telegram_update'
+TELEGRAM_MESSAGE_LIMIT = 4096
+NOTES_PAGE_CALLBACK_PREFIX = 'notes_page:'
+NOTES_PAGES_CACHE_SIZE = 100
+SEARCH_RESULTS_LIMIT = 20
 
 logger = logging.getLogger(__name__)
 
 
 @backoff.on_exception(backoff.expo, NetworkError, max_tries=6)
-async def start_telegram_app(application: Application) -> None:
-    """Telegram initialization with retries"""
+async def start_telegram_app(application: Application, webhook_url: str | None = None,
+                             webhook_secret_token: str | None = None) -> None:
+    """Telegram initialization with retries.
+    With webhook_url updates are pushed by Telegram to the api and put to application update queue,
+    otherwise updates are polled"""
     await application.initialize()
     await application.start()
-    await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    if webhook_url:
+        await application.bot.set_webhook(
+            webhook_url, secret_token=webhook_secret_token, allowed_updates=Update.ALL_TYPES)
+    else:
+        await application.bot.delete_webhook()
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+
+async def drain_telegram_app(application: Application, deadline: float) -> bool:
+    """Stop receiving updates and wait for handling of received ones until event loop time deadline.
+    Return False if handling was cancelled by deadline"""
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if not application.running:
+        return True
+    return await wait_until(application.stop(), deadline)
 
 
 async def stop_telegram_app(application: Application) -> None:
-    if application.updater.running:
+    if application.updater and application.updater.running:
         await application.updater.stop()
     if application.running:
         await application.stop()
     await application.shutdown()
 
 
+class UpdateClass:
+    COMMAND = 'command'
+    TEXT = 'text'
+    VOICE = 'voice'
+    OTHER = 'other'
+
+
+def get_update_class(update: object) -> str:
+    message = update.message if isinstance(update, Update) else None
+    if not message:
+        return UpdateClass.OTHER
+    if message.voice:
+        return UpdateClass.VOICE
+    if message.text and message.text.startswith('/'):
+        return UpdateClass.COMMAND
+    if message.text:
+        return UpdateClass.TEXT
+    return UpdateClass.OTHER
+
+
+class PriorityUpdateProcessor(BaseUpdateProcessor):
+    """Updates are handled by priority of update class with per class and per user limits.
+    Base processor semaphore only bounds pending updates, so waiting updates can be reordered.
+    Handlers are registered as blocking, so their whole run time is counted by limiter"""
+
+    def __init__(self, limiter: PriorityLimiter, max_pending_updates: int) -> None:
+        super().__init__(max(max_pending_updates, limiter.max_concurrent))
+        self._limiter = limiter
+
+    async def do_process_update(self, update: object, coroutine: typing.Awaitable[typing.Any]) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        await self._limiter.run(get_update_class(update), user.id if user else None, coroutine)
+
+    def get_stats(self) -> dict:
+        return self._limiter.get_stats()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def create_update_processor(update_limits: TelegramUpdateLimits) -> PriorityUpdateProcessor:
+    limiter = PriorityLimiter([
+        LimitClass(update_class, limit.max_concurrent, limit.priority)
+        for update_class, limit in (
+            (UpdateClass.COMMAND, update_limits.command),
+            (UpdateClass.TEXT, update_limits.text),
+            (UpdateClass.VOICE, update_limits.voice),
+            (UpdateClass.OTHER, update_limits.other),
+        )
+    ], update_limits.max_concurrent_updates,
+        lambda update_class, wait_seconds: metrics.TELEGRAM_UPDATE_WAIT_SECONDS.observe(
+            wait_seconds, update_class=update_class))
+    return PriorityUpdateProcessor(limiter, update_limits.max_pending_updates)
+
+
 @asynccontextmanager
-async def telegram_app_context(telegram_token: str) -> typing.AsyncGenerator[Application, None]:
+async def telegram_app_context(telegram_token: str, webhook_url: str | None = None,
+                               webhook_secret_token: str | None = None,
+                               update_processor: BaseUpdateProcessor | None = None
+                               ) -> typing.AsyncGenerator[Application, None]:
     """Context manager for Telegram app"""
-    application = Application.builder().token(telegram_token).concurrent_updates(True).build()
+    builder = Application.builder().token(telegram_token).concurrent_updates(update_processor or True)
+    if webhook_url:
+        builder = builder.updater(None)
+    application = builder.build()
     try:
-        await start_telegram_app(application)
+        await start_telegram_app(application, webhook_url, webhook_secret_token)
         yield application
     finally:
         await stop_telegram_app(application)
 
 
+async def put_webhook_update(application: Application, update_data: dict) -> None:
+    """Put update received by webhook to application update queue"""
+    update = Update.de_json(update_data, application.bot)
+    await application.update_queue.put(update)
+
+
+async def put_queued_update(job_queue: SqliteJobQueue, update_data: dict) -> None:
+    """Put update received by webhook in api process to job queue of bot worker process"""
+    await job_queue.put(TELEGRAM_UPDATE_JOB_KIND, update_data)
+
+
+async def run_queued_updates_consumer(application: Application, job_queue: SqliteJobQueue,
+                                      stop_event: asyncio.Event | None = None) -> None:
+    async for job in job_queue.iter_jobs(TELEGRAM_UPDATE_JOB_KIND, stop_event=stop_event):
+        await put_webhook_update(application, job.payload)
+        await job_queue.finish(job.id, keep_result=False)
+
+
+class TelegramSideEffects:
+    """Background queue for acknowledgements and message deletions, so handlers don't wait for them.
+    Deletions are batched per chat with delete_messages, timed deletions are scheduled on job queue"""
+    _worker_task: asyncio.Task | None = None
+    _flush_handle: asyncio.TimerHandle | None = None
+
+    def __init__(self, telegram_app: Application, delete_batch_delay_seconds: float = 0.5) -> None:
+        self._telegram_app = telegram_app
+        self._delete_batch_delay_seconds = delete_batch_delay_seconds
+        self._queue: asyncio.Queue[typing.Callable[[], typing.Awaitable[typing.Any]] | None] = asyncio.Queue()
+        self._pending_deletions: dict[int, list[int]] = {}
+
+    async def _run_worker(self) -> None:
+        while True:
+            side_effect = await self._queue.get()
+            try:
+                if side_effect is None:
+                    return
+                await side_effect()
+            except TelegramError as e:
+                logger.error('Telegram side effect error: %s', e)
+            except Exception as e:
+                # worker must survive any side effect, otherwise queue grows and replies stop
+                logger.exception('Telegram side effect unexpected error: %s', e)
+            finally:
+                self._queue.task_done()
+
+    async def _delete_messages(self, deletions: dict[int, list[int]]) -> None:
+        for chat_id, message_ids in deletions.items():
+            for i in range(0, len(message_ids), TELEGRAM_DELETE_MESSAGES_LIMIT):
+                await self._telegram_app.bot.delete_messages(
+                    chat_id, message_ids[i:i + TELEGRAM_DELETE_MESSAGES_LIMIT])
+
+    def _flush_deletions(self) -> None:
+        self._flush_handle = None
+        if not self._pending_deletions:
+            return
+        deletions, self._pending_deletions = self._pending_deletions, {}
+        self._queue.put_nowait(lambda: self._delete_messages(deletions))
+
+    def reply_text(self, message: Message, text: str) -> None:
+        self._queue.put_nowait(lambda: message.reply_text(text))
+
+    def reply_html(self, message: Message, text: str) -> None:
+        self._queue.put_nowait(lambda: message.reply_html(text))
+
+    def delete_message(self, message: Message) -> None:
+        self._pending_deletions.setdefault(message.chat_id, []).append(message.message_id)
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                self._delete_batch_delay_seconds, self._flush_deletions)
+
+    def delete_message_later(self, message: Message, delay_seconds: float) -> None:
+        async def _delete_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+            self.delete_message(message)
+        if self._telegram_app.job_queue is not None:
+            self._telegram_app.job_queue.run_once(_delete_job, delay_seconds)
+        else:
+            asyncio.get_running_loop().call_later(delay_seconds, self.delete_message, message)
+
+    async def start(self) -> None:
+        if self._worker_task is None:
+            self._worker_task = asyncio.create_task(self._run_worker())
+
+    async def stop(self) -> None:
+        """Send queued side effects and stop worker. Idempotent, cancelled stop cancels worker"""
+        if self._worker_task is None:
+            return
+        worker_task, self._worker_task = self._worker_task, None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        self._flush_deletions()
+        self._queue.put_nowait(None)
+        await worker_task
+
+
+def get_message_id(message: Message) -> str:
+    """Id of message in all chats, spans and notes of message are correlated by it"""
+    return f'telegram:{message.chat_id}:{message.message_id}'
+
+
+class UserAuthorizer:
+    """Allowed user ids are kept in frozenset, swapped whole by set_allowed_users. Rejected users get
+    one reply per interval, last replies are kept in bounded LRU, so spam of unknown users costs no api calls"""
+
+    def __init__(self, allowed_users: typing.Iterable[str] = (), rejection_reply_interval_seconds: float = 3600,
+                 max_rejected_users: int = 10000) -> None:
+        self._rejection_reply_interval_seconds = rejection_reply_interval_seconds
+        self._max_rejected_users = max_rejected_users
+        self._rejection_replied_at: OrderedDict[int | None, float] = OrderedDict()
+        self.set_allowed_users(allowed_users)
+
+    def set_allowed_users(self, allowed_users: typing.Iterable[str]) -> None:
+        """Empty allowed users allow all users"""
+        self._allowed_users = frozenset(str(x) for x in allowed_users)
+
+    def is_allowed(self, user_id: int | None) -> bool:
+        if not self._allowed_users:
+            return True
+        return user_id is not None and str(user_id) in self._allowed_users
+
+    def should_reply_rejection(self, user_id: int | None) -> bool:
+        now = time.monotonic()
+        replied_at = self._rejection_replied_at.get(user_id)
+        if replied_at is not None and now - replied_at < self._rejection_reply_interval_seconds:
+            self._rejection_replied_at.move_to_end(user_id)
+            return False
+        self._rejection_replied_at[user_id] = now
+        self._rejection_replied_at.move_to_end(user_id)
+        while len(self._rejection_replied_at) > self._max_rejected_users:
+            self._rejection_replied_at.popitem(last=False)
+        return True
+
+
 def check_user_allowed(func):
     @wraps(func)
-    async def _implementation(self: TelegramClientProtocol, update: Update, *func_args, **func_kwargs):
+    async def _implementation(self: 'TelegramClient', update: Update, *func_args, **func_kwargs):
         """Check if user allowed and send message if not"""
-        def _is_user_allowed(self: TelegramClientProtocol, update: Update):
-            """User allow rules"""
-            if not self._allowed_users:
-                return True
-            if not update.effective_user:
-                return False
-            user = update.effective_user
-            if str(user.id) in self._allowed_users:
-                return True
-            return False
-        #
-        if _is_user_allowed(self, update):
-            return await func(self, update, *func_args, **func_kwargs)
-        if update.effective_user:
-            await update.message.reply_html(
-                rf"Hi {update.effective_user.mention_html()}! You are not allowed to use this bot, contact admin.")
+        user = update.effective_user
+        user_id = user.id if user else None
+        if self._authorizer.is_allowed(user_id):
+            # spans of one update are correlated by chat and message ids
+            message = update.effective_message
+            trace_id = get_message_id(message) if message else None
+            handler_name = func.__name__.strip('_')
+            # notes of tenant users are routed to their tenant notes apps
+            with tracing.trace(trace_id), tracing.span(f'telegram.{handler_name}'), \
+                    metrics.TELEGRAM_HANDLER_SECONDS.time(handler=handler_name), \
+                    tenants_handlers.user_context(str(user_id) if user_id is not None else None):
+                return await func(self, update, *func_args, **func_kwargs)
+        if not self._authorizer.should_reply_rejection(user_id) or not update.effective_message:
+            metrics.TELEGRAM_REJECTED_UPDATES.inc(replied='false')
+            return
+        metrics.TELEGRAM_REJECTED_UPDATES.inc(replied='true')
+        if user:
+            self._side_effects.reply_html(
+                update.effective_message,
+                rf"Hi {user.mention_html()}! You are not allowed to use this bot, contact admin.")
         else:
-            await update.message.reply_html(
-                "Hi! You are not allowed to use this bot, contact admin.")
-        return
+            self._side_effects.reply_html(
+                update.effective_message, "Hi! You are not allowed to use this bot, contact admin.")
     return _implementation
 
 
 class TelegramClient(TelegramClientProtocol):
     _message_callback: typing.Callable = None
     _voice_callback: typing.Callable = None
-    _allowed_users: list = None
+    _search_request_callback: typing.Callable = None
 
-    def __init__(self, telegram_app: Application, recognizer_app: SpeechRecognizerProtocol, tmp_dir: str = 'tmp',
-                 allowed_users: list = []) -> None:
+    def __init__(self, telegram_app: Application, recognizer_app: SpeechRecognizerProtocol,
+                 side_effects: TelegramSideEffects, tmp_dir: str = 'tmp', allowed_users: list = [],
+                 notes_reply_ttl_seconds: int = 10, notes_pagination: bool = False,
+                 rejection_reply_interval_seconds: float = 3600) -> None:
         self._telegram_app = telegram_app
+        self._side_effects = side_effects
+        self._notes_reply_ttl_seconds = notes_reply_ttl_seconds
+        self._notes_pagination = notes_pagination
+        # pages of paginated notes reply by its (chat id, message id), with id of user requested them
+        self._notes_pages: OrderedDict[tuple[int, int], tuple[int | None, list[str]]] = OrderedDict()
         self._tmp_dir = tmp_dir
-        self._allowed_users = allowed_users
+        self._authorizer = UserAuthorizer(allowed_users, rejection_reply_interval_seconds)
         self._recognizer = recognizer_app
         self._handle_default_commands()
 
     @check_user_allowed
     async def _text_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.debug('Got message from telegram: %s', update.message.text)
-        await self._message_callback(update.message.text)
-        await update.message.reply_text('Message recieved.')
-        await update.message.delete()
+        await self._message_callback(update.message.text, get_message_id(update.message))
+        self._side_effects.reply_text(update.message, 'Message recieved.')
+        self._side_effects.delete_message(update.message)
 
     @check_user_allowed
     async def _voice_message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         logger.debug('Got voice from telegram: %s', update.message.voice.file_id)
-        new_file = await context.bot.get_file(update.message.voice.file_id)
-        voice_file_path = os.path.join(self._tmp_dir, update.message.voice.file_id + '.ogg')
-        await new_file.download_to_drive(voice_file_path)
-        text = await self._recognizer.async_recognize(voice_file_path) or update.message.voice.file_id
-        await self._voice_callback(text)
-        os.unlink(voice_file_path)
-        await update.message.reply_text('Voice recieved.')
-        await update.message.delete()
+        with tracing.span('telegram.voice_download'):
+            new_file = await context.bot.get_file(update.message.voice.file_id)
+            voice_file_path = os.path.join(self._tmp_dir, update.message.voice.file_id + '.ogg')
+            # download_to_drive writes file in event loop
+            await files_utils.async_write_bytes(voice_file_path, bytes(await new_file.download_as_bytearray()))
+        with tracing.span('recognizer.recognize'):
+            text = await self._recognizer.async_recognize(voice_file_path) or update.message.voice.file_id
+        await self._voice_callback(text, get_message_id(update.message))
+        await files_utils.async_remove_file(voice_file_path)
+        self._side_effects.reply_text(update.message, 'Voice recieved.')
+        self._side_effects.delete_message(update.message)
+
+    @staticmethod
+    def _get_notes_page_markup(pages: list[str], page: int) -> InlineKeyboardMarkup | None:
+        if len(pages) < 2:
+            return None
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton('<', callback_data=f'{NOTES_PAGE_CALLBACK_PREFIX}{max(page - 1, 0)}'),
+            InlineKeyboardButton(f'{page + 1}/{len(pages)}', callback_data=f'{NOTES_PAGE_CALLBACK_PREFIX}{page}'),
+            InlineKeyboardButton('>', callback_data=f'{NOTES_PAGE_CALLBACK_PREFIX}{min(page + 1, len(pages) - 1)}'),
+        ]])
+
+    async def _render_notes_messages(self, message: Message, replies: list[tuple[Message, str]],
+                                     pages: list[str]) -> list[tuple[Message, str]]:
+        """Edit changed reply messages and send new ones, one message per page"""
+        for i, page in enumerate(pages):
+            if i >= len(replies):
+                replies += [(await message.reply_html(page), page)]
+            elif replies[i][1] != page:
+                replies[i] = (await replies[i][0].edit_text(page, parse_mode='HTML'), page)
+        return replies
+
+    async def _render_notes_paginated(self, message: Message, replies: list[tuple[Message, str]],
+                                      pages: list[str]) -> list[tuple[Message, str]]:
+        """One reply message with first page and pagination buttons, buttons change with pages count"""
+        reply_markup = self._get_notes_page_markup(pages, 0)
+        if not replies:
+            replies = [(await message.reply_html(pages[0], reply_markup=reply_markup), pages[0])]
+        elif replies[0][1] != pages[0] or replies[0][0].reply_markup != reply_markup:
+            replies = [(await replies[0][0].edit_text(
+                pages[0], parse_mode='HTML', reply_markup=reply_markup), pages[0])]
+        user_id = message.from_user.id if message.from_user else None
+        self._notes_pages[(replies[0][0].chat_id, replies[0][0].message_id)] = (user_id, pages)
+        while len(self._notes_pages) > NOTES_PAGES_CACHE_SIZE:
+            self._notes_pages.popitem(last=False)
+        return replies
 
     @check_user_allowed
     async def _notes_request_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Reply is rendered progressively as notes of every service are received"""
         logger.debug('Got notes request from telegram: %s', update.message.text)
         user = update.effective_user
-        reply_message = await update.message.reply_html(
-            f'Hi {user.mention_html()}! Your current notes:\n{await self._notes_request_callback()}'
-        )
-        await update.message.delete()
-        await asyncio.sleep(10)
-        await reply_message.delete()
+        render = self._render_notes_paginated if self._notes_pagination else self._render_notes_messages
+        text = f'Hi {user.mention_html()}! Your current notes:'
+        replies = []
+        async for notes in self._notes_request_callback():
+            text += '\n' + html.escape(notes)
+            replies = await render(update.message, replies, split_text(text, TELEGRAM_MESSAGE_LIMIT))
+        if not replies:
+            replies = await render(update.message, replies, [text])
+        self._side_effects.delete_message(update.message)
+        for reply_message, _ in replies:
+            self._side_effects.delete_message_later(reply_message, self._notes_reply_ttl_seconds)
+
+    @check_user_allowed
+    async def _search_request_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Notes are searched in local index, answer doesn't wait for notes apps"""
+        logger.debug('Got search request from telegram: %s', update.message.text)
+        query = ' '.join(context.args or [])
+        if not query.strip():
+            self._side_effects.reply_text(update.message, 'Usage: /search *words*')
+            return
+        notes = await self._search_request_callback(query, SEARCH_RESULTS_LIMIT)
+        lines = [f'Found notes ({len(notes)}):' if notes else 'Notes not found.']
+        lines += [f'[{html.escape(x.backend)}] {"(done) " if x.done else ""}{html.escape(x.title or "")}'
+                  for x in notes]
+        pages = split_text('\n'.join(lines), TELEGRAM_MESSAGE_LIMIT)
+        replies = await self._render_notes_messages(update.message, [], pages)
+        self._side_effects.delete_message(update.message)
+        for reply_message, _ in replies:
+            self._side_effects.delete_message_later(reply_message, self._notes_reply_ttl_seconds)
+
+    @check_user_allowed
+    async def _notes_page_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        query = update.callback_query
+        user_id, pages = self._notes_pages.get(
+            (query.message.chat_id, query.message.message_id), (None, None)) if query.message else (None, None)
+        if not pages:
+            await query.answer('Notes are expired, request them again.')
+            return
+        if user_id != query.from_user.id:
+            await query.answer('Notes are requested by other user.')
+            return
+        page = min(int(query.data.removeprefix(NOTES_PAGE_CALLBACK_PREFIX)), len(pages) - 1)
+        await query.answer()
+        try:
+            await query.edit_message_text(
+                pages[page], parse_mode='HTML', reply_markup=self._get_notes_page_markup(pages, page))
+        except BadRequest as e:
+            logger.debug('Notes page not changed: %s', e)
 
     async def _start_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Send a message when the command /start is issued."""
@@ -127,25 +455,34 @@ class TelegramClient(TelegramClientProtocol):
 
     def _handle_default_commands(self):
         self._telegram_app.add_handler(
-            CommandHandler("start", self._start_handler, block=False))
+            CommandHandler("start", self._start_handler))
+
+    def set_allowed_users(self, allowed_users: list[str]) -> None:
+        self._authorizer.set_allowed_users(allowed_users)
 
     def handle_text_message(self, callback: typing.Coroutine) -> None:
         self._message_callback = callback
         self._telegram_app.add_handler(MessageHandler(
             filters.TEXT & ~filters.COMMAND,
-            self._text_message_handler,
-            block=False
+            self._text_message_handler
         ))
 
     def handle_voice_message(self, callback: typing.Coroutine) -> None:
         self._voice_callback = callback
         self._telegram_app.add_handler(MessageHandler(
             filters.VOICE,
-            self._voice_message_handler,
-            block=False
+            self._voice_message_handler
         ))
 
     def handle_notes_request(self, callback: typing.Coroutine) -> None:
         self._notes_request_callback = callback
         self._telegram_app.add_handler(
-            CommandHandler("notes", self._notes_request_handler, block=False))
+            CommandHandler("notes", self._notes_request_handler))
+        if self._notes_pagination:
+            self._telegram_app.add_handler(CallbackQueryHandler(
+                self._notes_page_handler, pattern=f'^{NOTES_PAGE_CALLBACK_PREFIX}'))
+
+    def handle_search_request(self, callback: typing.Coroutine) -> None:
+        self._search_request_callback = callback
+        self._telegram_app.add_handler(
+            CommandHandler("search", self._search_request_handler))
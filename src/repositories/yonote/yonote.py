@@ -10,7 +10,9 @@ import utils.http as http_utils
 YONOTE_API_URL = 'https://app.yonote.ru'
 YONOTE_API_CREATE_NOTE = '/api/documents.create'
 YONOTE_API_DELETE_NOTE = '/api/documents.delete'
-YONOTE_API_GET_NOTES = '/api/database.rows.list?limit=100&offset=0'
+YONOTE_API_GET_NOTE = '/api/documents.info'
+YONOTE_API_GET_NOTES = '/api/database.rows.list'
+YONOTE_NOTES_PAGE_LIMIT = 100
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +21,7 @@ class YonoteClient(notes_services.NoteClientProtocol):
 
     def __init__(self, yonote_session: aiohttp.ClientSession, yonote_token: str, database_id: str,
                  collection_id: str, status_field_id: str, status_field_value: str, done_field_id: str) -> None:
-        self._yonote_session = http_utils.ClientSession(yonote_session)
+        self._yonote_session = http_utils.ClientSession(yonote_session, 'yonote')
         self._yonote_token = yonote_token
         self._database_id = database_id
         self._collection_id = collection_id
@@ -34,10 +36,16 @@ class YonoteClient(notes_services.NoteClientProtocol):
             'Authorization': f'Bearer {self._yonote_token}',
         }
 
-    async def create_note(self, text: str) -> None:
+    async def _is_note_created(self, note_id: uuid.UUID) -> bool:
+        answer = await self._yonote_session.request(
+            'POST', YONOTE_API_GET_NOTE, {'id': str(note_id)}, headers=self._get_token_headers())
+        return bool(answer.get('ok') and answer.get('data'))
+
+    async def create_note(self, text: str, note_id: uuid.UUID | None = None) -> None:
         logger.debug('Yonote create note start')
+        note_id = note_id or uuid.uuid4()
         message = {
-            'id': str(uuid.uuid4()),
+            'id': str(note_id),
             'parentDocumentId': self._database_id,
             'collectionId': self._collection_id,
             'title': text,
@@ -50,23 +58,37 @@ class YonoteClient(notes_services.NoteClientProtocol):
             'text': '',
         }
         answer = await self._yonote_session.request(
-            'POST', YONOTE_API_CREATE_NOTE, message, headers=self._get_token_headers())
+            'POST', YONOTE_API_CREATE_NOTE, message, headers=self._get_token_headers(),
+            write_check=http_utils.WriteCheck(lambda: self._is_note_created(note_id)))
         logger.debug('Yonote create note answer: %s', answer)
         return
 
-    async def get_notes(self) -> list[yonote_models.Note]:
-        logger.debug('Yonote get notes start')
+    async def _list_notes(self, offset: int) -> yonote_models.NotesAnswer:
         message = {
             'parentDocumentId': self._database_id,
         }
         answer = await self._yonote_session.request(
-            'POST', YONOTE_API_GET_NOTES, message, headers=self._get_token_headers())
-        answer_model = yonote_models.NotesAnswer(**answer)
+            'POST', YONOTE_API_GET_NOTES, message, headers=self._get_token_headers(),
+            params={'limit': YONOTE_NOTES_PAGE_LIMIT, 'offset': offset})
+        return yonote_models.NotesAnswer(**answer)
+
+    async def get_notes(self) -> list[yonote_models.Note]:
+        logger.debug('Yonote get notes start')
+        answer_model = await self._list_notes(0)
         notes = answer_model.to_notes(self._status_field_id, self._done_field_id)
 
         logger.debug('Yonote get notes answer: %s', notes)
         return notes
 
+    async def get_notes_page(self, cursor: str | None = None) -> tuple[list[yonote_models.Note], str | None]:
+        """Cursor is rows offset"""
+        logger.debug('Yonote get notes page start: %s', cursor)
+        offset = int(cursor) if cursor else 0
+        answer_model = await self._list_notes(offset)
+        next_offset = offset + len(answer_model.data)
+        next_cursor = str(next_offset) if answer_model.data and next_offset < answer_model.count else None
+        return answer_model.to_notes(self._status_field_id, self._done_field_id), next_cursor
+
     async def get_done_notes(self) -> list[yonote_models.Note]:
         notes = await self.get_notes()
         done_notes = list(filter(lambda x: x.done, notes))
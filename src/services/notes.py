@@ -6,12 +6,15 @@ import models.notes as notes_models
 
 
 class NoteClientProtocol(typing.Protocol):
-    async def create_note(self, message: str) -> None:
+    async def create_note(self, message: str, note_id: uuid.UUID | None = None) -> None:
         ...
 
     async def get_notes(self) -> list[notes_models.Note]:
         ...
 
+    async def get_notes_page(self, cursor: str | None = None) -> tuple[list[notes_models.Note], str | None]:
+        ...
+
     async def get_undone_notes(self) -> list[notes_models.Note]:
         ...
 
@@ -26,12 +29,22 @@ class NoteService(notes_handlers.NotesServiceProtocol):
     def __init__(self, notes_client: NoteClientProtocol) -> None:
         self._notes_client = notes_client
 
-    async def create_note(self, text: str) -> None:
-        await self._notes_client.create_note(text)
+    async def create_note(self, text: str, note_id: uuid.UUID | None = None) -> None:
+        await self._notes_client.create_note(text, note_id)
 
     async def get_notes(self) -> list[notes_models.Note]:
         return await self._notes_client.get_notes()
 
+    async def iter_notes_pages(self, cursor: str | None = None
+                               ) -> typing.AsyncGenerator[tuple[str | None, list[notes_models.Note]], None]:
+        """Yield (next page cursor, page notes) starting from cursor, next page cursor is None for the last page"""
+        while True:
+            notes, next_cursor = await self._notes_client.get_notes_page(cursor)
+            yield next_cursor, notes
+            if not next_cursor:
+                return
+            cursor = next_cursor
+
     async def get_undone_note_titles(self) -> list[str]:
         undone_notes = await self._notes_client.get_undone_notes()
         undone_note_titles = list(map(lambda x: '[%s] %s' % (
@@ -7,7 +7,8 @@ logger = logging.getLogger(__name__)
 
 
 class TelegramClientProtocol(typing.Protocol):
-    _allowed_users: list = None
+    def set_allowed_users(self, allowed_users: list[str]) -> None:
+        ...
 
     def handle_text_message(self, callback: typing.Coroutine) -> None:
         ...
@@ -18,6 +19,9 @@ class TelegramClientProtocol(typing.Protocol):
     def handle_notes_request(self, callback: typing.Coroutine) -> None:
         ...
 
+    def handle_search_request(self, callback: typing.Coroutine) -> None:
+        ...
+
 
 class TelegramService(notes_handlers.MessageServiceProtocol):
     def __init__(self, chat_client: TelegramClientProtocol) -> None:
@@ -29,3 +33,6 @@ class TelegramService(notes_handlers.MessageServiceProtocol):
 
     async def handle_notes_request(self, callback: typing.Coroutine) -> None:
         self._chat_client.handle_notes_request(callback)
+
+    async def handle_search_request(self, callback: typing.Coroutine) -> None:
+        self._chat_client.handle_search_request(callback)
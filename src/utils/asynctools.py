@@ -1,4 +1,6 @@
 import asyncio
+import contextvars
+import typing
 from functools import wraps, partial
 
 
@@ -7,6 +9,16 @@ def async_wrapper(func):
     async def run(*args, loop=None, executor=None, **kwargs):
         if loop is None:
             loop = asyncio.get_event_loop()
-        pfunc = partial(func, *args, **kwargs)
+        # context variables (trace ids) are passed to executor thread
+        pfunc = partial(contextvars.copy_context().run, func, *args, **kwargs)
         return await loop.run_in_executor(executor, pfunc)
     return run
+
+
+async def wait_until(awaitable: typing.Awaitable, deadline: float) -> bool:
+    """Wait awaitable until event loop time deadline, after it awaitable is cancelled. Return False on timeout"""
+    try:
+        await asyncio.wait_for(awaitable, max(deadline - asyncio.get_running_loop().time(), 0))
+    except asyncio.TimeoutError:
+        return False
+    return True
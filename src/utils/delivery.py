@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+import typing
+
+import utils.metrics as metrics
+import utils.tracing as tracing
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryQueue:
+    """In-process queue, items are delivered by background workers. Every item has deadline,
+    items not started before it are dropped. Transient errors are retried by http clients of callback only,
+    started delivery is not cancelled, so write applied by server is not repeated"""
+
+    def __init__(self, callback: typing.Callable[[typing.Any], typing.Awaitable[None]], workers: int = 2,
+                 max_size: int = 1000, deadline_seconds: float = 300) -> None:
+        self._callback = callback
+        self._workers = workers
+        self._deadline_seconds = deadline_seconds
+        self._queue: asyncio.Queue[tuple[typing.Any, float, str | None] | None] = asyncio.Queue(max_size)
+        self._worker_tasks: list[asyncio.Task] = []
+
+    @property
+    def size(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, item: typing.Any) -> None:
+        """Raises asyncio.QueueFull if queue is full"""
+        self._queue.put_nowait((item, time.monotonic() + self._deadline_seconds, tracing.get_trace_id()))
+
+    async def _deliver(self, item: typing.Any, deadline: float, trace_id: str | None = None) -> None:
+        with tracing.trace(trace_id), tracing.span('delivery.deliver'):
+            if time.monotonic() > deadline:
+                logger.error('Delivery deadline is exceeded in queue: %s', item)
+                metrics.DELIVERY_FAILED.inc()
+                return
+            try:
+                await self._callback(item)
+            except Exception as e:
+                logger.error('Delivery failed: %s, %s', item, e)
+                metrics.DELIVERY_FAILED.inc()
+
+    async def _run_worker(self) -> None:
+        while True:
+            queue_item = await self._queue.get()
+            try:
+                if queue_item is None:
+                    return
+                await self._deliver(*queue_item)
+            finally:
+                self._queue.task_done()
+
+    async def start(self) -> None:
+        if not self._worker_tasks:
+            self._worker_tasks = [asyncio.create_task(self._run_worker()) for _ in range(self._workers)]
+
+    async def stop(self) -> None:
+        """Deliver queued items and stop workers"""
+        for _ in self._worker_tasks:
+            await self._queue.put(None)
+        await asyncio.gather(*self._worker_tasks)
+        self._worker_tasks = []
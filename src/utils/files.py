@@ -0,0 +1,66 @@
+import asyncio
+import fcntl
+import os
+import tempfile
+import typing
+from contextlib import asynccontextmanager
+
+from utils.asynctools import async_wrapper
+
+
+def read_file(path: str) -> str | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file_opened:
+        return file_opened.read()
+
+
+def write_file_atomic(path: str, content: str) -> None:
+    """Write to a temporary file in the same directory and rename it over the target,
+    so readers never see a partially written file"""
+    dir_name = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix='.' + os.path.basename(path) + '.')
+    try:
+        with os.fdopen(fd, 'w') as file_opened:
+            file_opened.write(content)
+            file_opened.flush()
+            os.fsync(file_opened.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def write_bytes(path: str, content: bytes) -> None:
+    with open(path, 'wb') as file_opened:
+        file_opened.write(content)
+
+
+def remove_file(path: str) -> None:
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+@asynccontextmanager
+async def async_file_lock(path: str, poll_seconds: float = 0.05) -> typing.AsyncGenerator[None, None]:
+    """Exclusive lock of processes of one host on lock file. Lock is polled without blocking,
+    so cancelled waiter never takes it in background"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll_seconds)
+        yield
+    finally:
+        # closing the file releases the lock
+        os.close(fd)
+
+
+async_read_file = async_wrapper(read_file)
+async_write_file_atomic = async_wrapper(write_file_atomic)
+async_write_bytes = async_wrapper(write_bytes)
+async_remove_file = async_wrapper(remove_file)
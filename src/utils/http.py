@@ -1,12 +1,17 @@
 import logging
+import time
 import typing
 from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
 
 import aiohttp
 import backoff
 import orjson
 import pydantic
 
+import utils.metrics as metrics
+import utils.tracing as tracing
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,9 +22,64 @@ async def aiohttp_session_context(*args, **kwargs) -> typing.AsyncGenerator[aioh
         yield session
 
 
+def _on_backoff(details: dict) -> None:
+    client_name = details['args'][0].name
+    metrics.HTTP_CLIENT_RETRIES.inc(client=client_name)
+    metrics.HTTP_CLIENT_BACKOFF_SECONDS.inc(details['wait'], client=client_name)
+
+
+def _on_giveup(details: dict) -> None:
+    metrics.HTTP_CLIENT_GIVEUPS.inc(client=details['args'][0].name)
+
+
+def _get_retry_after_seconds(exception: BaseException | None) -> float | None:
+    """Seconds of Retry-After header (delay or http date) of throttled response"""
+    if not isinstance(exception, aiohttp.ClientResponseError) or exception.status != 429 or not exception.headers:
+        return None
+    retry_after = exception.headers.get('Retry-After')
+    if not retry_after:
+        return None
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after_expo(max_retry_after_seconds: float = 60) -> typing.Generator[float, BaseException | None, None]:
+    """Jittered exponential wait, throttled response is retried not earlier than its Retry-After.
+    Jitter is applied here, so Retry-After is not shortened by it"""
+    expo = backoff.expo()
+    next(expo)
+    exception = yield
+    while True:
+        retry_after = _get_retry_after_seconds(exception)
+        wait = backoff.full_jitter(next(expo))
+        if retry_after is not None:
+            wait = max(wait, min(retry_after, max_retry_after_seconds))
+        exception = yield wait
+
+
+class WriteCheck:
+    """Check of not idempotent write before its retry, previous try could be applied by server
+    even if its answer was lost. One check object is used for all tries of one write"""
+
+    def __init__(self, is_written: typing.Callable[[], typing.Awaitable[bool]]) -> None:
+        self._is_written = is_written
+        self._tried = False
+
+    async def is_written_before(self) -> bool:
+        tried, self._tried = self._tried, True
+        return tried and await self._is_written()
+
+
 class ClientSession:
-    def __init__(self, session: aiohttp.ClientSession) -> None:
+    def __init__(self, session: aiohttp.ClientSession, name: str = 'http') -> None:
         self._session = session
+        self.name = name
 
     @staticmethod
     def load_json_answer(text_response: str) -> dict:
@@ -37,15 +97,28 @@ class ClientSession:
             logger.error('Validation answer error: %s', answer)
             raise
 
-    @backoff.on_exception(backoff.expo, aiohttp.ClientError, max_tries=6)
-    async def request(self, method: str, url: str, json_data: dict | None, **kwargs) -> dict:
-        async with self._session.request(
-            method,
-            url,
-            json=json_data,
-            **kwargs
-        ) as response:
-            text_response = await response.text()
+    @backoff.on_exception(_retry_after_expo, aiohttp.ClientError, max_tries=6, jitter=None,
+                          on_backoff=_on_backoff, on_giveup=_on_giveup)
+    async def request(self, method: str, url: str, json_data: dict | None,
+                      write_check: WriteCheck | None = None, **kwargs) -> dict:
+        """Retried write with check returns empty answer if previous try was applied"""
+        if write_check is not None and await write_check.is_written_before():
+            logger.warning('Write is applied by previous try, retry is skipped: %s %s', method, url)
+            metrics.HTTP_CLIENT_DUPLICATE_WRITES.inc(client=self.name)
+            return {}
+        with tracing.span('http.request', method=method, url=url) as request_span:
+            async with self._session.request(
+                method,
+                url,
+                json=json_data,
+                **kwargs
+            ) as response:
+                if request_span:
+                    request_span.set_attribute('status', response.status)
+                # throttled and failed requests are retried by backoff
+                if response.status == 429 or response.status >= 500:
+                    response.raise_for_status()
+                text_response = await response.text()
             answer = self.load_json_answer(text_response)
             if kwargs.get('answer_model'):
                 return self.convert_answer_to_model(answer, kwargs.get('answer_model'))
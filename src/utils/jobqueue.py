@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from contextlib import suppress
+from dataclasses import dataclass
+
+import orjson
+
+from utils.asynctools import async_wrapper
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus:
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    payload: typing.Any
+    attempts: int
+
+
+class JobError(Exception):
+    pass
+
+
+class SqliteJobQueue:
+    """Job queue shared by processes of one host through sqlite file.
+    Taken jobs are leased, jobs of died worker are taken again after lease expiration,
+    jobs with expired lease after max_attempts are failed"""
+
+    def __init__(self, path: str, lease_seconds: float = 300, max_attempts: int = 3) -> None:
+        self._path = path
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+        self._connection: sqlite3.Connection | None = None
+        # connection is shared by executor threads
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload BLOB,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    locked_until REAL,
+                    result BLOB,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_kind_status ON jobs (kind, status, created_at)')
+            self._connection = connection
+        return self._connection
+
+    def put_sync(self, kind: str, payload: typing.Any) -> str:
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._connect().execute(
+                'INSERT INTO jobs (id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                (job_id, kind, orjson.dumps(payload), JobStatus.PENDING, time.time())
+            )
+        return job_id
+
+    def take_sync(self, kind: str) -> Job | None:
+        with self._lock:
+            connection = self._connect()
+            now = time.time()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'UPDATE jobs SET status = ?, result = ?, locked_until = NULL WHERE kind = ? AND status = ? AND '
+                    'locked_until < ? AND attempts >= ?',
+                    (JobStatus.FAILED, orjson.dumps(f'Error: Job is not finished in {self._max_attempts} attempts.'),
+                     kind, JobStatus.RUNNING, now, self._max_attempts)
+                )
+                row = connection.execute(
+                    'SELECT id, payload, attempts FROM jobs WHERE kind = ? AND attempts < ? AND '
+                    '(status = ? OR (status = ? AND locked_until < ?)) ORDER BY created_at LIMIT 1',
+                    (kind, self._max_attempts, JobStatus.PENDING, JobStatus.RUNNING, now)
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        'UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ? WHERE id = ?',
+                        (JobStatus.RUNNING, now + self._lease_seconds, row[0])
+                    )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        return Job(row[0], kind, orjson.loads(row[1]), row[2] + 1)
+
+    def finish_sync(self, job_id: str, result: typing.Any = None, error: str | None = None,
+                    keep_result: bool = True) -> None:
+        with self._lock:
+            if not keep_result:
+                self._connect().execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+                return
+            self._connect().execute(
+                'UPDATE jobs SET status = ?, result = ?, locked_until = NULL WHERE id = ?',
+                (JobStatus.FAILED if error else JobStatus.DONE, orjson.dumps(error or result), job_id)
+            )
+
+    def pop_result_sync(self, job_id: str) -> tuple[str, typing.Any] | None:
+        """Return (status, result) of finished job and delete it, None if job is not finished"""
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute('SELECT status, result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                raise JobError(f'Error: Job {job_id} not found.')
+            status, result = row
+            if status not in (JobStatus.DONE, JobStatus.FAILED):
+                return None
+            connection.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        return status, orjson.loads(result) if result is not None else None
+
+    def count_pending_sync(self) -> dict[str, int]:
+        """Pending jobs count by kind"""
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT kind, COUNT(*) FROM jobs WHERE status = ? GROUP BY kind', (JobStatus.PENDING,)
+            ).fetchall()
+        return dict(rows)
+
+    def purge_sync(self, older_than_seconds: float) -> int:
+        """Delete jobs with results nobody popped and jobs nobody took, return deleted jobs count"""
+        with self._lock:
+            return self._connect().execute(
+                'DELETE FROM jobs WHERE created_at < ?', (time.time() - older_than_seconds,)).rowcount
+
+    put = async_wrapper(put_sync)
+    take = async_wrapper(take_sync)
+    finish = async_wrapper(finish_sync)
+    pop_result = async_wrapper(pop_result_sync)
+    purge = async_wrapper(purge_sync)
+
+    async def wait_result(self, job_id: str, timeout: float, poll_seconds: float = 0.1) -> typing.Any:
+        """Raises JobError for failed job and asyncio.TimeoutError if job is not finished in time"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            finished = await self.pop_result(job_id)
+            if finished is not None:
+                status, result = finished
+                if status == JobStatus.FAILED:
+                    raise JobError(result)
+                return result
+            await asyncio.sleep(poll_seconds)
+        raise asyncio.TimeoutError(f'Job {job_id} is not finished in {timeout} seconds')
+
+    async def iter_jobs(self, kind: str, min_poll_seconds: float = 0.05, max_poll_seconds: float = 1.0,
+                        stop_event: asyncio.Event | None = None) -> typing.AsyncGenerator[Job, None]:
+        """Yield taken jobs, poll interval grows while queue is empty. Iteration ends after stop_event is set"""
+        poll_seconds = min_poll_seconds
+        stop_event = stop_event or asyncio.Event()
+        while not stop_event.is_set():
+            job = await self.take(kind)
+            if job is not None:
+                poll_seconds = min_poll_seconds
+                yield job
+                continue
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), poll_seconds)
+            poll_seconds = min(poll_seconds * 2, max_poll_seconds)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,75 @@
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+
+from utils.asynctools import async_wrapper
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElectionProtocol(typing.Protocol):
+    lease_seconds: float
+
+    async def acquire(self, name: str) -> bool:
+        """Acquire or renew lease, True if this replica is leader"""
+        ...
+
+    async def release(self, name: str) -> None:
+        ...
+
+
+class SqliteLeaderElection(LeaderElectionProtocol):
+    """Lease based leader election through sqlite file in volume shared by replicas"""
+
+    def __init__(self, path: str, lease_seconds: float = 60, owner_id: str | None = None) -> None:
+        self._path = path
+        self.lease_seconds = lease_seconds
+        self._owner_id = owner_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)')
+            self._connection = connection
+        return self._connection
+
+    def acquire_sync(self, name: str) -> bool:
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) '
+                    'ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                    'WHERE leases.owner = excluded.owner OR leases.expires_at < ?',
+                    (name, self._owner_id, now + self.lease_seconds, now)
+                )
+                owner = connection.execute('SELECT owner FROM leases WHERE name = ?', (name,)).fetchone()[0]
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return owner == self._owner_id
+
+    def release_sync(self, name: str) -> None:
+        with self._lock:
+            self._connect().execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, self._owner_id))
+
+    acquire = async_wrapper(acquire_sync)
+    release = async_wrapper(release_sync)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+import typing
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LimitClass:
+    """Concurrency budget of one class of jobs, lower priority value is served first"""
+    name: str
+    max_concurrent: int
+    priority: int
+
+
+@dataclass
+class LimitClassStats:
+    running: int = 0
+    waiting: int = 0
+    started: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+
+
+@dataclass
+class _LimitClassState:
+    limit: LimitClass
+    stats: LimitClassStats = field(default_factory=LimitClassStats)
+    # user key -> waiting futures, users are served round-robin
+    waiters: OrderedDict[typing.Hashable, deque[asyncio.Future]] = field(default_factory=OrderedDict)
+
+
+class PriorityLimiter:
+    """Concurrency limiter with per-class budgets and priorities.
+    Inside a class waiting jobs are served round-robin by user, so one user can't monopolise the class budget"""
+
+    def __init__(self, limit_classes: list[LimitClass], max_concurrent: int,
+                 on_started: typing.Callable[[str, float], None] | None = None) -> None:
+        """on_started is called with class name and wait seconds of every started job"""
+        self._max_concurrent = max_concurrent
+        self._on_started = on_started
+        self._running = 0
+        self._states = {x.name: _LimitClassState(x) for x in limit_classes}
+        self._ordered_states = sorted(self._states.values(), key=lambda x: x.limit.priority)
+
+    @property
+    def max_concurrent(self) -> int:
+        return self._max_concurrent
+
+    def _pick_next(self) -> tuple[_LimitClassState, asyncio.Future] | None:
+        for state in self._ordered_states:
+            if not state.waiters or state.stats.running >= state.limit.max_concurrent:
+                continue
+            user_key, user_waiters = next(iter(state.waiters.items()))
+            waiter = user_waiters.popleft()
+            if user_waiters:
+                state.waiters.move_to_end(user_key)
+            else:
+                del state.waiters[user_key]
+            return state, waiter
+        return None
+
+    def _dispatch(self) -> None:
+        while self._running < self._max_concurrent:
+            picked = self._pick_next()
+            if picked is None:
+                return
+            state, waiter = picked
+            state.stats.waiting -= 1
+            if waiter.done():
+                continue
+            waiter.set_result(None)
+            state.stats.running += 1
+            self._running += 1
+
+    def _remove_waiter(self, state: _LimitClassState, user_key: typing.Hashable, waiter: asyncio.Future) -> None:
+        user_waiters = state.waiters.get(user_key)
+        if user_waiters and waiter in user_waiters:
+            user_waiters.remove(waiter)
+            state.stats.waiting -= 1
+            if not user_waiters:
+                del state.waiters[user_key]
+
+    async def _acquire(self, state: _LimitClassState, user_key: typing.Hashable) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.setdefault(user_key, deque()).append(waiter)
+        state.stats.waiting += 1
+        started_at = time.monotonic()
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(state)
+            else:
+                self._remove_waiter(state, user_key, waiter)
+            raise
+        wait_seconds = time.monotonic() - started_at
+        state.stats.started += 1
+        state.stats.wait_seconds_total += wait_seconds
+        state.stats.wait_seconds_max = max(state.stats.wait_seconds_max, wait_seconds)
+        if self._on_started is not None:
+            self._on_started(state.limit.name, wait_seconds)
+
+    def _release(self, state: _LimitClassState) -> None:
+        state.stats.running -= 1
+        self._running -= 1
+        self._dispatch()
+
+    async def run(self, class_name: str, user_key: typing.Hashable,
+                  coroutine: typing.Awaitable[typing.Any]) -> typing.Any:
+        state = self._states[class_name]
+        try:
+            await self._acquire(state, user_key)
+        except asyncio.CancelledError:
+            if asyncio.iscoroutine(coroutine):
+                coroutine.close()
+            raise
+        try:
+            return await coroutine
+        finally:
+            self._release(state)
+
+    def get_stats(self) -> dict[str, LimitClassStats]:
+        return {name: state.stats for name, state in self._states.items()}
+
+
+class RateLimiter:
+    """Token bucket rate limiter, waiters are served in order"""
+
+    def __init__(self, rate_per_second: float, burst: int = 1) -> None:
+        self._rate_per_second = rate_per_second
+        self._burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate_per_second)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self._rate_per_second)
+                self._refill()
+            self._tokens -= 1
+
+    async def __aenter__(self) -> None:
+        await self.acquire()
+
+    async def __aexit__(self, *args) -> None:
+        pass
@@ -0,0 +1,241 @@
+import asyncio
+import bisect
+import threading
+import time
+import typing
+from contextlib import asynccontextmanager, contextmanager
+
+from aiohttp import web
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(label_names: tuple[str, ...], label_values: tuple[str, ...], extra: str = '') -> str:
+    labels = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        labels += [extra]
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        # metrics are updated from event loop and executor threads
+        self._lock = threading.Lock()
+
+    def _get_key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels[x]) for x in self.label_names)
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.type_name}'] + \
+            self._render_samples()
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in values]
+
+
+class Gauge(_Metric):
+    """Gauge values are set directly or collected by function on every scrape"""
+    type_name = 'gauge'
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> None:
+        super().__init__(name, description, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._collect: typing.Callable[[], dict[tuple[str, ...], float]] | None = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value: float = 1, **labels) -> None:
+        self.inc(-value, **labels)
+
+    def set_collect_function(self, collect: typing.Callable[[], dict[tuple[str, ...], float]]) -> None:
+        """Function returns values by label values tuple"""
+        self._collect = collect
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        if self._collect is not None:
+            values.update(self._collect())
+        return [f'{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}'
+                for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, description, label_names)
+        self._buckets = tuple(sorted(buckets))
+        # label values -> (non-cumulative bucket counts with +Inf, sum)
+        self._values: dict[tuple[str, ...], tuple[list[int], float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._get_key(labels)
+        bucket = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self._buckets) + 1), 0.0)
+            counts[bucket] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> typing.Generator[None, None, None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in values:
+            cumulative = 0
+            for upper_bound, count in zip(self._buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(upper_bound)}"')
+                samples += [f'{self.name}_bucket{labels} {cumulative}']
+            labels = _format_labels(self.label_names, key)
+            samples += [f'{self.name}_sum{labels} {_format_value(total)}', f'{self.name}_count{labels} {cumulative}']
+        return samples
+
+
+class MetricsRegistry:
+    """Metrics of this process in Prometheus text format"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> typing.Any:
+        with self._lock:
+            registered = self._metrics.setdefault(metric.name, metric)
+        if type(registered) is not type(metric) or registered.label_names != metric.label_names:
+            raise ValueError(f'Error: Metric {metric.name} is already registered with other type or labels.')
+        return registered
+
+    def counter(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, description, label_names))
+
+    def gauge(self, name: str, description: str, label_names: tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, description, label_names, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+@asynccontextmanager
+async def metrics_server_context(host: str, port: int) -> typing.AsyncGenerator[None, None]:
+    """Metrics endpoint of processes without api (bot, recognizer)"""
+    async def _get_metrics(request: web.Request) -> web.Response:
+        body = await asyncio.get_running_loop().run_in_executor(None, REGISTRY.render)
+        return web.Response(body=body.encode(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', _get_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        yield
+    finally:
+        await runner.cleanup()
+
+# metrics shared by several modules
+NOTES_CREATED = REGISTRY.counter('notes_created_total', 'Notes created by notes app', ('backend',))
+NOTES_FAILED = REGISTRY.counter('notes_failed_total', 'Notes creation errors by notes app', ('backend',))
+NOTES_DUPLICATES_SKIPPED = REGISTRY.counter(
+    'notes_duplicates_skipped_total', 'Repeated note creations skipped by note id', ('backend',))
+NOTES_DUPLICATES_DROPPED = REGISTRY.counter(
+    'notes_duplicates_dropped_total', 'Notes dropped as similar to recent notes')
+NOTES_CREATE_SECONDS = REGISTRY.histogram(
+    'notes_create_seconds', 'Note creation duration by notes app', ('backend',))
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Api requests duration', ('method', 'route', 'status'))
+HTTP_CLIENT_RETRIES = REGISTRY.counter(
+    'http_client_retries_total', 'Retried requests to notes apps', ('client',))
+HTTP_CLIENT_BACKOFF_SECONDS = REGISTRY.counter(
+    'http_client_backoff_seconds_total', 'Time waited before retries of requests to notes apps', ('client',))
+HTTP_CLIENT_GIVEUPS = REGISTRY.counter(
+    'http_client_giveups_total', 'Requests to notes apps failed after all retries', ('client',))
+HTTP_CLIENT_DUPLICATE_WRITES = REGISTRY.counter(
+    'http_client_duplicate_writes_total', 'Retried writes skipped because previous try was applied by notes app',
+    ('client',))
+RECOGNIZE_SECONDS = REGISTRY.histogram(
+    'recognize_duration_seconds', 'Voice recognition duration', ('mode',))
+RECOGNIZE_IN_PROGRESS = REGISTRY.gauge(
+    'recognize_in_progress', 'Voices being recognized', ('mode',))
+JOB_QUEUE_PENDING = REGISTRY.gauge(
+    'job_queue_pending', 'Pending jobs of shared job queue', ('kind',))
+TELEGRAM_HANDLER_SECONDS = REGISTRY.histogram(
+    'telegram_handler_duration_seconds', 'Telegram update handlers duration', ('handler',))
+TELEGRAM_REJECTED_UPDATES = REGISTRY.counter(
+    'telegram_rejected_updates_total', 'Telegram updates of not allowed users by rejection reply', ('replied',))
+TELEGRAM_UPDATES_RUNNING = REGISTRY.gauge(
+    'telegram_updates_running', 'Telegram updates handled now by update class', ('update_class',))
+TELEGRAM_UPDATES_WAITING = REGISTRY.gauge(
+    'telegram_updates_waiting', 'Telegram updates waiting for limiter by update class', ('update_class',))
+TELEGRAM_UPDATE_WAIT_SECONDS = REGISTRY.histogram(
+    'telegram_update_wait_seconds', 'Telegram updates wait for limiter by update class', ('update_class',))
+SCHEDULER_JOB_SECONDS = REGISTRY.histogram(
+    'scheduler_job_duration_seconds', 'Scheduled job runs duration', ('job',))
+SCHEDULER_JOB_RUNS = REGISTRY.counter(
+    'scheduler_job_runs_total', 'Scheduled job runs by result', ('job', 'result'))
+CONFIG_RELOADS = REGISTRY.counter('config_reloads_total', 'Config file reloads by result', ('result',))
+TENANTS_ACTIVE = REGISTRY.gauge('tenants_active', 'Tenants with built notes handler')
+TENANT_ACTIVATIONS = REGISTRY.counter('tenant_activations_total', 'Tenant notes handlers built')
+DELIVERY_QUEUE_SIZE = REGISTRY.gauge('delivery_queue_size', 'Alice notes waiting for delivery')
+DELIVERY_FAILED = REGISTRY.counter('delivery_failed_total', 'Alice notes not delivered')
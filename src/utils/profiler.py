@@ -0,0 +1,56 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from utils.asynctools import async_wrapper
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """Samples stacks of all threads of the process (event loop, executor, recognizer).
+    Nothing runs between profiles, stacks are collected only while profile is requested"""
+
+    def __init__(self, max_seconds: float = 60) -> None:
+        self._max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _format_frame(frame) -> str:
+        code = frame.f_code
+        return f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+    def _collect_stacks(self, samples: Counter, own_thread_id: int) -> None:
+        thread_names = {x.ident: x.name for x in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack += [self._format_frame(frame)]
+                frame = frame.f_back
+            stack += [thread_names.get(thread_id, str(thread_id))]
+            samples[';'.join(reversed(stack)).replace('\n', ' ')] += 1
+
+    def profile_sync(self, seconds: float, interval_seconds: float = 0.005) -> str:
+        """Collapsed stacks (thread;outer;...;inner count), input of flamegraph.pl and speedscope.
+        Raises ProfilerBusyError if other profile is running"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError('Error: Profile is already running.')
+        try:
+            samples = Counter()
+            own_thread_id = threading.get_ident()
+            deadline = time.monotonic() + min(seconds, self._max_seconds)
+            while time.monotonic() < deadline:
+                self._collect_stacks(samples, own_thread_id)
+                time.sleep(interval_seconds)
+        finally:
+            self._lock.release()
+        return ''.join(f'{stack} {count}\n' for stack, count in samples.most_common())
+
+    # sampling runs in executor thread, so event loop keeps running while profiled
+    profile = async_wrapper(profile_sync)
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import typing
@@ -7,14 +8,16 @@ import speech_recognition
 
 from utils.convert import convert_to_wav
 from utils.asynctools import async_wrapper
+from utils.jobqueue import JobError, SqliteJobQueue
+import utils.metrics as metrics
+import utils.tracing as tracing
+
+RECOGNIZE_JOB_KIND = 'recognize'
 
 logger = logging.getLogger(__name__)
 
 
 class SpeechRecognizerProtocol(typing.Protocol):
-    def recognize(self, voice_path: str) -> str | None:
-        ...
-
     async def async_recognize(self, voice_path: str) -> str | None:
         ...
 
@@ -25,14 +28,24 @@ class SpeechRecognizer(SpeechRecognizerProtocol):
         self._tmp_dir = tmp_dir
 
     def recognize(self, source_path: str) -> str | None:
-        target_path = convert_to_wav(source_path, self._tmp_dir)
+        metrics.RECOGNIZE_IN_PROGRESS.inc(mode='local')
+        try:
+            with metrics.RECOGNIZE_SECONDS.time(mode='local'):
+                return self._recognize(source_path)
+        finally:
+            metrics.RECOGNIZE_IN_PROGRESS.dec(mode='local')
+
+    def _recognize(self, source_path: str) -> str | None:
+        with tracing.span('recognizer.convert'):
+            target_path = convert_to_wav(source_path, self._tmp_dir)
         text = None
         with speech_recognition.AudioFile(target_path) as source:
             try:
                 # self._recognizer.adjust_for_ambient_noise(source)
                 audio = self._recognizer.record(source)
-                text = self._recognizer.recognize_whisper(
-                    audio, language='Russian', model='turbo', load_options={'download_root': self._tmp_dir})
+                with tracing.span('recognizer.whisper'):
+                    text = self._recognizer.recognize_whisper(
+                        audio, language='Russian', model='turbo', load_options={'download_root': self._tmp_dir})
                 logger.info('Recognized text: %s', text)
             except Exception:
                 logger.error('Exception:\n %s', traceback.format_exc())
@@ -42,3 +55,43 @@ class SpeechRecognizer(SpeechRecognizerProtocol):
     @async_wrapper
     def async_recognize(self, source_path: str) -> str | None:
         return self.recognize(source_path)
+
+
+class QueueSpeechRecognizer(SpeechRecognizerProtocol):
+    """Recognition by recognizer worker processes through job queue, voice file must be in shared tmp_dir"""
+
+    def __init__(self, job_queue: SqliteJobQueue, timeout_seconds: float = 300) -> None:
+        self._job_queue = job_queue
+        self._timeout_seconds = timeout_seconds
+
+    async def async_recognize(self, source_path: str) -> str | None:
+        metrics.RECOGNIZE_IN_PROGRESS.inc(mode='queue')
+        try:
+            with metrics.RECOGNIZE_SECONDS.time(mode='queue'):
+                return await self._async_recognize(source_path)
+        finally:
+            metrics.RECOGNIZE_IN_PROGRESS.dec(mode='queue')
+
+    async def _async_recognize(self, source_path: str) -> str | None:
+        with tracing.span('recognizer.queue'):
+            job_id = await self._job_queue.put(
+                RECOGNIZE_JOB_KIND, {'path': source_path, 'trace_id': tracing.get_trace_id()})
+            try:
+                return await self._job_queue.wait_result(job_id, self._timeout_seconds)
+            except (JobError, asyncio.TimeoutError) as e:
+                logger.error('Queue recognize error: %s', e)
+                return None
+
+
+async def run_recognizer_worker(recognizer: SpeechRecognizerProtocol, job_queue: SqliteJobQueue,
+                                stop_event: asyncio.Event | None = None) -> None:
+    """Recognize queued voices until stop_event is set, taken job is finished before stop"""
+    async for job in job_queue.iter_jobs(RECOGNIZE_JOB_KIND, stop_event=stop_event):
+        try:
+            with tracing.trace(job.payload.get('trace_id')):
+                text = await recognizer.async_recognize(job.payload['path'])
+        except Exception as e:
+            logger.error('Recognize job error: %s', e)
+            await job_queue.finish(job.id, error=str(e) or e.__class__.__name__)
+            continue
+        await job_queue.finish(job.id, text)
@@ -1,14 +1,196 @@
+import asyncio
+import logging
+import random
+import time
 import typing
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from functools import wraps
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 
+from utils.asynctools import wait_until
+from utils.jobqueue import SqliteJobQueue
+from utils.leader import LeaderElectionProtocol
+import utils.metrics as metrics
+
+SCHEDULER_LEASE_NAME = 'scheduler'
+SCHEDULER_TRIGGER_JOB_KIND = 'scheduler_trigger'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AdaptiveJob:
+    """Job returns True if it found work, then interval is reset to min, else interval is doubled up to max"""
+    name: str
+    func: typing.Callable[[], typing.Awaitable[bool]]
+    min_seconds: float
+    max_seconds: float
+    interval_seconds: float
+    running: bool = False
+    runs: int = 0
+    last_duration_seconds: float = 0.0
+
 
 class Scheduler:
-    def __init__(self) -> None:
-        self._scheduler = AsyncIOScheduler()
+    """Interval jobs scheduler, with leader election jobs are run only by the leader replica"""
+    _is_leader: bool = True
+    _stopped: bool = False
+
+    def __init__(self, leader_election: LeaderElectionProtocol | None = None, jitter_ratio: float = 0.1) -> None:
+        self._scheduler = AsyncIOScheduler(job_defaults={'max_instances': 1, 'coalesce': True})
+        self._leader_election = leader_election
+        self._jitter_ratio = jitter_ratio
+        self._adaptive_jobs: dict[str, AdaptiveJob] = {}
+        self._running_tasks: set[asyncio.Task] = set()
+        if self._leader_election is not None:
+            self._is_leader = False
+            self._scheduler.add_job(
+                self._renew_leadership,
+                trigger=IntervalTrigger(seconds=self._leader_election.lease_seconds / 3),
+                next_run_time=datetime.now()
+            )
+
+    async def _renew_leadership(self) -> bool:
+        try:
+            is_leader = await self._leader_election.acquire(SCHEDULER_LEASE_NAME)
+        except Exception as e:
+            logger.error('Leader election error: %s', e)
+            is_leader = False
+        if is_leader != self._is_leader:
+            logger.info('Scheduler leadership %s', 'acquired' if is_leader else 'lost')
+        self._is_leader = is_leader
+        return is_leader
+
+    def _leader_only(self, func: typing.Callable[[], typing.Awaitable[None]]) -> typing.Callable:
+        @wraps(func)
+        async def _implementation():
+            if self._leader_election is not None and not await self._renew_leadership():
+                logger.debug('Not leader, skip job %s', func.__name__)
+                return
+            return await func()
+        return _implementation
+
+    def _start(self) -> None:
+        if not self._scheduler.running:
+            self._scheduler.start()
 
     async def run_job(self, func: typing.Coroutine, every_seconds: int) -> None:
         trigger = IntervalTrigger(seconds=every_seconds)
-        self._scheduler.add_job(func, trigger=trigger)
-        self._scheduler.start()
+        self._scheduler.add_job(self._leader_only(func), trigger=trigger)
+        self._start()
+
+    def _schedule_adaptive_job(self, job: AdaptiveJob, delay_seconds: float, jitter: bool = True) -> None:
+        if jitter:
+            delay_seconds *= 1 + random.uniform(-self._jitter_ratio, self._jitter_ratio)
+        self._scheduler.add_job(
+            self._run_adaptive_job,
+            trigger=DateTrigger(datetime.now() + timedelta(seconds=delay_seconds)),
+            args=[job.name],
+            id=f'adaptive:{job.name}',
+            replace_existing=True,
+            misfire_grace_time=None
+        )
+
+    async def _run_adaptive_job(self, name: str) -> None:
+        job = self._adaptive_jobs.get(name)
+        if job is None or job.running:
+            return
+        job.running = True
+        task = asyncio.current_task()
+        self._running_tasks.add(task)
+        try:
+            if self._leader_election is None or await self._renew_leadership():
+                started_at = time.monotonic()
+                try:
+                    found_work = await job.func()
+                    result = 'found_work' if found_work else 'idle'
+                except Exception as e:
+                    logger.error('Job %s error: %s', name, e)
+                    found_work = False
+                    result = 'error'
+                job.runs += 1
+                job.last_duration_seconds = time.monotonic() - started_at
+                metrics.SCHEDULER_JOB_SECONDS.observe(job.last_duration_seconds, job=name)
+                metrics.SCHEDULER_JOB_RUNS.inc(job=name, result=result)
+                job.interval_seconds = job.min_seconds if found_work else \
+                    min(job.interval_seconds * 2, job.max_seconds)
+        finally:
+            job.running = False
+            self._running_tasks.discard(task)
+            # job removed or replaced while running is not scheduled again
+            if self._adaptive_jobs.get(name) is job:
+                self._schedule_adaptive_job(job, job.interval_seconds)
+
+    async def run_adaptive_job(self, name: str, func: typing.Callable[[], typing.Awaitable[bool]],
+                               min_seconds: float, max_seconds: float) -> None:
+        """Overlap safe job with adaptive interval and jitter"""
+        job = AdaptiveJob(name, func, min_seconds, max(min_seconds, max_seconds), min_seconds)
+        self._adaptive_jobs[name] = job
+        self._schedule_adaptive_job(job, min_seconds)
+        self._start()
+
+    def touch_job(self, name: str) -> None:
+        """Activity hint, job interval is reset to min and next run is moved closer if needed"""
+        job = self._adaptive_jobs.get(name)
+        if job is None or job.interval_seconds == job.min_seconds:
+            return
+        job.interval_seconds = job.min_seconds
+        if job.running:
+            return
+        scheduled_job = self._scheduler.get_job(f'adaptive:{name}')
+        if scheduled_job is None or scheduled_job.next_run_time.timestamp() > time.time() + job.min_seconds:
+            self._schedule_adaptive_job(job, job.min_seconds)
+
+    def trigger_jobs(self, names: list[str] | None = None) -> list[str]:
+        """Run adaptive jobs now, running jobs are skipped. Return triggered job names"""
+        triggered = []
+        for name, job in self._adaptive_jobs.items():
+            if (names and name not in names) or job.running:
+                continue
+            self._schedule_adaptive_job(job, 0, jitter=False)
+            triggered += [name]
+        return triggered
+
+    def remove_adaptive_jobs(self, names: list[str]) -> None:
+        """Running jobs are finished, but not scheduled again"""
+        for name in names:
+            if self._adaptive_jobs.pop(name, None) is not None and self._scheduler.get_job(f'adaptive:{name}'):
+                self._scheduler.remove_job(f'adaptive:{name}')
+
+    def get_stats(self) -> dict[str, AdaptiveJob]:
+        return dict(self._adaptive_jobs)
+
+    async def stop(self, deadline: float | None = None) -> None:
+        """Stop scheduling, running adaptive jobs are waited until event loop time deadline. Idempotent"""
+        if self._stopped:
+            return
+        self._stopped = True
+        if self._scheduler.running:
+            self._scheduler.pause()
+            try:
+                if self._running_tasks and deadline is not None:
+                    if not await wait_until(asyncio.gather(*self._running_tasks), deadline):
+                        logger.warning('Scheduler jobs are cancelled by shutdown deadline')
+            finally:
+                # shutdown cancels running jobs, it is called soon by event loop, so running is still True after it
+                self._scheduler.shutdown(wait=False)
+        if self._leader_election is not None and self._is_leader:
+            await self._leader_election.release(SCHEDULER_LEASE_NAME)
+            self._is_leader = False
+
+
+async def put_queued_trigger(job_queue: SqliteJobQueue, names: list[str] | None = None) -> dict:
+    """Trigger jobs of scheduler in bot worker process"""
+    await job_queue.put(SCHEDULER_TRIGGER_JOB_KIND, {'names': names})
+    return {'queued': True}
+
+
+async def run_queued_triggers_consumer(scheduler: Scheduler, job_queue: SqliteJobQueue,
+                                       stop_event: asyncio.Event | None = None) -> None:
+    async for job in job_queue.iter_jobs(SCHEDULER_TRIGGER_JOB_KIND, max_poll_seconds=5, stop_event=stop_event):
+        scheduler.trigger_jobs(job.payload.get('names'))
+        await job_queue.finish(job.id, keep_result=False)
@@ -0,0 +1,139 @@
+import logging
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+import models.notes as notes_models
+from utils.asynctools import async_wrapper
+
+_WORD_RE = re.compile(r'\w+')
+
+logger = logging.getLogger(__name__)
+
+
+def to_fts_query(query: str) -> str | None:
+    """Every word of query must be found, last letters may differ (word prefix).
+    Words are quoted, so FTS5 syntax of user query is not interpreted"""
+    words = _WORD_RE.findall(query.lower())
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class SqliteNotesIndex:
+    """Local full-text index of notes of all notes services in sqlite FTS5, shared by processes of one host.
+    Notes are added after creation and by sync of notes services, notes not seen by full sync are deleted"""
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._connection: sqlite3.Connection | None = None
+        # connection is shared by executor threads
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS notes (
+                    backend TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    title TEXT,
+                    status TEXT,
+                    done INTEGER,
+                    synced_at REAL NOT NULL,
+                    PRIMARY KEY (backend, id)
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS notes_backend_synced_at ON notes (backend, synced_at)')
+            # external content table, FTS index is kept in sync with notes by triggers
+            connection.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+                    title, content='notes', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+                )
+            ''')
+            connection.execute('''
+                CREATE TRIGGER IF NOT EXISTS notes_ai AFTER INSERT ON notes BEGIN
+                    INSERT INTO notes_fts (rowid, title) VALUES (new.rowid, new.title);
+                END
+            ''')
+            connection.execute('''
+                CREATE TRIGGER IF NOT EXISTS notes_ad AFTER DELETE ON notes BEGIN
+                    INSERT INTO notes_fts (notes_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+                END
+            ''')
+            connection.execute('''
+                CREATE TRIGGER IF NOT EXISTS notes_au AFTER UPDATE OF title ON notes BEGIN
+                    INSERT INTO notes_fts (notes_fts, rowid, title) VALUES ('delete', old.rowid, old.title);
+                    INSERT INTO notes_fts (rowid, title) VALUES (new.rowid, new.title);
+                END
+            ''')
+            self._connection = connection
+        return self._connection
+
+    def add_notes_sync(self, backend: str, notes: list[notes_models.Note], synced_at: float | None = None) -> None:
+        """Insert or update notes in one transaction"""
+        synced_at = synced_at or time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.executemany(
+                    'INSERT INTO notes (backend, id, title, status, done, synced_at) VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (backend, id) DO UPDATE SET title = excluded.title, status = excluded.status, '
+                    'done = excluded.done, synced_at = excluded.synced_at',
+                    [(backend, str(x.id), x.title, x.status, x.done, synced_at) for x in notes]
+                )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def delete_notes_sync(self, backend: str, note_ids: list[uuid.UUID]) -> None:
+        with self._lock:
+            self._connect().executemany(
+                'DELETE FROM notes WHERE backend = ? AND id = ?', [(backend, str(x)) for x in note_ids])
+
+    def delete_stale_notes_sync(self, backend: str, synced_before: float) -> int:
+        """Delete notes not updated since full sync start, they were deleted in notes service"""
+        with self._lock:
+            cursor = self._connect().execute(
+                'DELETE FROM notes WHERE backend = ? AND synced_at < ?', (backend, synced_before))
+        return cursor.rowcount
+
+    def search_sync(self, query: str, limit: int = 20,
+                    backends: list[str] | None = None) -> list[notes_models.SearchedNote]:
+        """Best matching notes first"""
+        fts_query = to_fts_query(query)
+        if fts_query is None:
+            return []
+        sql = 'SELECT notes.backend, notes.id, notes.title, notes.status, notes.done FROM notes_fts ' \
+              'JOIN notes ON notes.rowid = notes_fts.rowid WHERE notes_fts MATCH ?'
+        params = [fts_query]
+        if backends:
+            sql += f' AND notes.backend IN ({", ".join("?" * len(backends))})'
+            params += backends
+        with self._lock:
+            rows = self._connect().execute(sql + ' ORDER BY rank LIMIT ?', params + [limit]).fetchall()
+        return [notes_models.SearchedNote(backend=backend, id=note_id, title=title, status=status, done=done)
+                for backend, note_id, title, status, done in rows]
+
+    def count_notes_sync(self) -> dict[str, int]:
+        """Indexed notes count by backend"""
+        with self._lock:
+            return dict(self._connect().execute('SELECT backend, COUNT(*) FROM notes GROUP BY backend').fetchall())
+
+    add_notes = async_wrapper(add_notes_sync)
+    delete_notes = async_wrapper(delete_notes_sync)
+    delete_stale_notes = async_wrapper(delete_stale_notes_sync)
+    search = async_wrapper(search_sync)
+    count_notes = async_wrapper(count_notes_sync)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
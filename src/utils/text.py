@@ -0,0 +1,61 @@
+import re
+import typing
+
+# html tags and entities of escaped text
+_HTML_TOKEN_RE = re.compile(r'<(/?)[^<>]*>|&#?\w+;')
+
+
+def _get_html_cut_index(line: str, limit: int) -> int:
+    """The longest prefix not longer than limit, that doesn't cut html entity, tag or element between tags.
+    Limit if there is no such prefix"""
+    cut_index = limit
+    element_start = None
+    for match in _HTML_TOKEN_RE.finditer(line):
+        if match.start() >= limit:
+            break
+        if match.end() > limit:
+            cut_index = match.start()
+            break
+        if match.group().startswith('<') and not match.group().endswith('/>'):
+            element_start = None if match.group(1) else match.start()
+    if element_start is not None and element_start < cut_index:
+        cut_index = element_start
+    return cut_index or limit
+
+
+def split_text(text: str, limit: int) -> list[str]:
+    """Split html text by lines into parts not longer than limit, too long lines are cut at safe html boundary"""
+    parts = []
+    current = ''
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                parts += [current]
+                current = ''
+            cut_index = _get_html_cut_index(line, limit)
+            parts += [line[:cut_index]]
+            line = line[cut_index:]
+        candidate = current + '\n' + line if current else line
+        if len(candidate) > limit:
+            parts += [current]
+            current = line
+        else:
+            current = candidate
+    if current or not parts:
+        parts += [current]
+    return parts
+
+
+async def iter_lines(chunks: typing.AsyncIterable[bytes], max_line_size: int) -> typing.AsyncGenerator[bytes, None]:
+    """Split byte chunks stream to lines without buffering whole stream.
+    Raises ValueError if line is longer than max_line_size"""
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line
+        if len(buffer) > max_line_size:
+            raise ValueError(f'Error: Line is longer than {max_line_size} bytes.')
+    if buffer:
+        yield buffer
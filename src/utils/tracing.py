@@ -0,0 +1,202 @@
+import contextvars
+import logging
+import threading
+import time
+import typing
+import uuid
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict
+
+import orjson
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+_trace_id: contextvars.ContextVar[str | None] = contextvars.ContextVar('trace_id', default=None)
+_span_id: contextvars.ContextVar[str | None] = contextvars.ContextVar('span_id', default=None)
+_exporter: typing.Optional['SpanExporterProtocol'] = None
+# shared by all spans while tracing is disabled, supports with and async with
+_NOOP_SPAN = nullcontext()
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start_time: float
+    duration_seconds: float = 0.0
+    error: str | None = None
+    attributes: dict[str, typing.Any] = field(default_factory=dict)
+
+    def set_attribute(self, name: str, value: typing.Any) -> None:
+        self.attributes[name] = value
+
+
+class SpanExporterProtocol(typing.Protocol):
+    def export(self, span: Span) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class JsonLinesSpanExporter(SpanExporterProtocol):
+    """Finished spans are buffered and appended to local file as JSON lines by writer thread,
+    so file is never written from event loop"""
+    _writer_thread: threading.Thread | None = None
+
+    def __init__(self, path: str, max_buffer_size: int = 64, flush_interval_seconds: float = 1.0) -> None:
+        self._path = path
+        self._max_buffer_size = max_buffer_size
+        self._flush_interval_seconds = flush_interval_seconds
+        self._buffer: list[bytes] = []
+        self._closed = False
+        # spans are exported from event loop and executor threads, writer waits for full buffer or interval
+        self._condition = threading.Condition()
+
+    def export(self, span: Span) -> None:
+        line = orjson.dumps(asdict(span), default=str) + b'\n'
+        with self._condition:
+            if self._closed:
+                return
+            if self._writer_thread is None:
+                self._writer_thread = threading.Thread(target=self._run_writer, name='spans-writer', daemon=True)
+                self._writer_thread.start()
+            self._buffer += [line]
+            if len(self._buffer) >= self._max_buffer_size:
+                self._condition.notify()
+
+    def _run_writer(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self._max_buffer_size:
+                    self._condition.wait(self._flush_interval_seconds)
+                lines, self._buffer = self._buffer, []
+                closed = self._closed
+            self._write(lines)
+            if closed:
+                return
+
+    def _write(self, lines: list[bytes]) -> None:
+        if not lines:
+            return
+        try:
+            with open(self._path, 'ab') as f:
+                f.write(b''.join(lines))
+        except OSError as e:
+            logger.error('Spans export error: %s', e)
+
+    def close(self) -> None:
+        """Buffered spans are written before return"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            writer_thread = self._writer_thread
+        if writer_thread is not None:
+            writer_thread.join()
+
+
+class OpenTelemetrySpanExporter(SpanExporterProtocol):
+    """Finished spans are recreated by OpenTelemetry tracer, its provider and exporter are configured by
+    opentelemetry sdk (OTEL_* environment variables). Correlation id is kept in span attributes"""
+
+    def __init__(self, instrumentation_name: str = 'notes-bot') -> None:
+        if otel_trace is None:
+            raise RuntimeError('Error: opentelemetry is not installed.')
+        self._tracer = otel_trace.get_tracer(instrumentation_name)
+
+    def export(self, span: Span) -> None:
+        attributes = {k: v if isinstance(v, (str, bool, int, float)) else str(v)
+                      for k, v in span.attributes.items()}
+        attributes['correlation_id'] = span.trace_id
+        if span.error:
+            attributes['error'] = span.error
+        start_time_ns = int(span.start_time * 1e9)
+        otel_span = self._tracer.start_span(span.name, start_time=start_time_ns, attributes=attributes)
+        otel_span.end(end_time=start_time_ns + int(span.duration_seconds * 1e9))
+
+    def close(self) -> None:
+        pass
+
+
+def configure_tracing(exporter: SpanExporterProtocol | None) -> None:
+    """Set spans exporter, without exporter tracing is disabled"""
+    global _exporter
+    if _exporter is not None:
+        _exporter.close()
+    _exporter = exporter
+
+
+def close_tracing() -> None:
+    configure_tracing(None)
+
+
+def get_trace_id() -> str | None:
+    return _trace_id.get()
+
+
+@contextmanager
+def trace(trace_id: str | None = None) -> typing.Generator[str, None, None]:
+    """Correlation id for spans of one message, random if not set"""
+    trace_id = trace_id or uuid.uuid4().hex
+    trace_token = _trace_id.set(trace_id)
+    span_token = _span_id.set(None)
+    try:
+        yield trace_id
+    finally:
+        _span_id.reset(span_token)
+        _trace_id.reset(trace_token)
+
+
+class _SpanContext:
+    def __init__(self, name: str, attributes: dict[str, typing.Any]) -> None:
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self) -> Span:
+        trace_id = _trace_id.get()
+        if trace_id is None:
+            trace_id = uuid.uuid4().hex
+            self._trace_token = _trace_id.set(trace_id)
+        else:
+            self._trace_token = None
+        self._span = Span(self._name, trace_id, uuid.uuid4().hex[:16], _span_id.get(), time.time(),
+                          attributes=self._attributes)
+        self._span_token = _span_id.set(self._span.span_id)
+        self._started_at = time.perf_counter()
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._span.duration_seconds = time.perf_counter() - self._started_at
+        if exc_type is not None:
+            self._span.error = exc_type.__name__
+        _span_id.reset(self._span_token)
+        if self._trace_token is not None:
+            _trace_id.reset(self._trace_token)
+        exporter = _exporter
+        if exporter is None:
+            return
+        try:
+            exporter.export(self._span)
+        except Exception as e:
+            logger.error('Span export error: %s', e)
+
+    async def __aenter__(self) -> Span:
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        self.__exit__(exc_type, exc_value, traceback)
+
+
+def span(name: str, **attributes) -> typing.ContextManager[Span | None]:
+    """Timed span of pipeline stage, usable with with and async with. No-op while tracing is disabled"""
+    if _exporter is None:
+        return _NOOP_SPAN
+    return _SpanContext(name, attributes)
+
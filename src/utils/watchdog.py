@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+import utils.metrics as metrics
+
+LAG_QUANTILES = (0.5, 0.9, 0.99)
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG_SECONDS = metrics.REGISTRY.histogram(
+    'event_loop_lag_seconds', 'Event loop scheduling lag',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+EVENT_LOOP_LAG_QUANTILE_SECONDS = metrics.REGISTRY.gauge(
+    'event_loop_lag_quantile_seconds', 'Event loop scheduling lag quantiles of recent samples', ('quantile',))
+EVENT_LOOP_BLOCKS = metrics.REGISTRY.counter(
+    'event_loop_blocks_total', 'Event loop blocks longer than watchdog threshold')
+
+
+class LoopLagWatchdog:
+    """Event loop lag is measured by sleeping task. Checker thread watches heartbeat of the task and
+    logs stack of blocked event loop thread, so blocking call is seen while it is still running"""
+    _monitor_task: asyncio.Task | None = None
+    _checker_thread: threading.Thread | None = None
+
+    def __init__(self, threshold_seconds: float = 0.25, interval_seconds: float = 0.1,
+                 window_size: int = 600) -> None:
+        self._threshold_seconds = threshold_seconds
+        self._interval_seconds = interval_seconds
+        self._lags: deque[float] = deque(maxlen=window_size)
+        self._heartbeat = time.monotonic()
+        self._stopped: threading.Event | None = None
+
+    def get_lag_quantiles(self) -> dict[float, float]:
+        lags = sorted(self._lags)
+        if not lags:
+            return {}
+        return {q: lags[min(int(q * len(lags)), len(lags) - 1)] for q in LAG_QUANTILES}
+
+    async def _run_monitor(self) -> None:
+        while True:
+            started_at = time.monotonic()
+            await asyncio.sleep(self._interval_seconds)
+            self._heartbeat = time.monotonic()
+            lag = max(self._heartbeat - started_at - self._interval_seconds, 0)
+            self._lags.append(lag)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+            if lag > self._threshold_seconds:
+                logger.warning('Event loop was blocked for %.3f seconds', lag)
+
+    def _report_blocked(self, loop_thread_id: int, blocked_seconds: float) -> None:
+        """Called from checker thread, only thread stack is read, asyncio state is not thread-safe"""
+        EVENT_LOOP_BLOCKS.inc()
+        frame = sys._current_frames().get(loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame else 'unknown'
+        logger.warning('Event loop is blocked for %.3f seconds, stack:\n%s', blocked_seconds, stack)
+
+    def _run_checker(self, loop_thread_id: int, stopped: threading.Event) -> None:
+        reported_heartbeat = None
+        while not stopped.wait(self._interval_seconds):
+            heartbeat = self._heartbeat
+            blocked_seconds = time.monotonic() - heartbeat - self._interval_seconds
+            # one report per block
+            if blocked_seconds > self._threshold_seconds and heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                self._report_blocked(loop_thread_id, blocked_seconds)
+
+    async def start(self) -> None:
+        if self._monitor_task is not None:
+            return
+        self._heartbeat = time.monotonic()
+        # every checker thread has own stop event, so checker not joined in time never runs after restart
+        self._stopped = threading.Event()
+        self._monitor_task = asyncio.create_task(self._run_monitor())
+        self._checker_thread = threading.Thread(
+            target=self._run_checker, args=(threading.get_ident(), self._stopped),
+            name='loop-watchdog', daemon=True)
+        self._checker_thread.start()
+        EVENT_LOOP_LAG_QUANTILE_SECONDS.set_collect_function(
+            lambda: {(str(q),): lag for q, lag in self.get_lag_quantiles().items()})
+
+    async def stop(self, join_timeout_seconds: float = 1.0) -> None:
+        """Checker thread is joined, so it doesn't report after stop"""
+        if self._monitor_task is None:
+            return
+        self._stopped.set()
+        self._monitor_task.cancel()
+        await asyncio.gather(self._monitor_task, return_exceptions=True)
+        self._monitor_task = None
+        checker_thread, self._checker_thread = self._checker_thread, None
+        await asyncio.get_running_loop().run_in_executor(None, checker_thread.join, join_timeout_seconds)
+        if checker_thread.is_alive():
+            logger.warning('Event loop watchdog checker is not stopped in %s seconds', join_timeout_seconds)
+
+    async def __aenter__(self) -> 'LoopLagWatchdog':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.stop()